@@ -0,0 +1,28 @@
+from typing import NamedTuple
+
+from settings import ACCOUNT_ID, ACCOUNTS, QUATITY_LIMIT, SANDBOX, STOCKS
+
+
+class Account(NamedTuple):
+    account_id: str
+    figis: list[str]
+    sandbox: bool
+    quantity_limit: int  # размер позиции в лотах
+
+
+def get_accounts() -> list[Account]:
+    """
+    Возвращает торгуемые счета из settings.ACCOUNTS, а если он пуст -
+    единственный счет ACCOUNT_ID с инструментами STOCKS.
+    """
+    if not ACCOUNTS:
+        return [Account(ACCOUNT_ID, list(STOCKS), SANDBOX, QUATITY_LIMIT)]
+    return [
+        Account(
+            account_id=account_id,
+            figis=list(config["figis"]),
+            sandbox=config.get("sandbox", SANDBOX),
+            quantity_limit=config.get("quantity_limit", QUATITY_LIMIT),
+        )
+        for account_id, config in ACCOUNTS.items()
+    ]
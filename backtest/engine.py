@@ -0,0 +1,346 @@
+"""
+Офлайн-бэктест MomentumStrategy на массивах 1-минутных свечей.
+
+Повторяет правила торгового робота:
+    - границы канала - процентили цен закрытия за последние days_back дней,
+      округленные до шага цены наружу;
+    - покупка до quantity_limit лотов при цене ниже нижней границы;
+    - продажа всей позиции при цене выше верхней границы;
+    - стоп-лосс на STOP_LOSS_RATIO ширины канала ниже средней цены позиции.
+
+Запуск перебора параметров по свечам из локального хранилища:
+    python -m backtest.engine BBG000000001
+"""
+import itertools
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from settings import DAYS_BACK, QUATITY_LIMIT, STOP_LOSS_RATIO
+from utils.prices import (
+    NANO,
+    ROUND_DOWN,
+    ROUND_UP,
+    float_to_nano,
+    nano_to_float,
+    round_to_tick,
+)
+from utils.rolling_percentile import RollingPercentile
+
+SECONDS_IN_DAY = 86400
+
+EXIT_SELL = 0
+EXIT_STOP_LOSS = 1
+EXIT_OPEN = 2  # позиция не закрыта к концу данных
+
+TRADE_DTYPE = np.dtype(
+    [
+        ("entry_time", np.int64),
+        ("exit_time", np.int64),
+        ("entry_price", np.float64),
+        ("exit_price", np.float64),
+        ("lots", np.int64),
+        ("exit_reason", np.int8),
+        ("pnl", np.float64),
+    ]
+)
+
+
+class BacktestResult(NamedTuple):
+    trades: np.ndarray  # структурированный массив TRADE_DTYPE
+    equity: np.ndarray
+    drawdown: np.ndarray
+    pnl: float  # с учетом комиссии, открытая позиция оценивается по последней цене
+    commission: float
+
+    @property
+    def max_drawdown(self) -> float:
+        return float(self.drawdown.min()) if len(self.drawdown) else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "pnl": self.pnl,
+            "commission": self.commission,
+            "trades": len(self.trades),
+            "stop_losses": int((self.trades["exit_reason"] == EXIT_STOP_LOSS).sum()),
+            "max_drawdown": self.max_drawdown,
+        }
+
+
+def channel_borders(
+    times: np.ndarray,
+    closes: np.ndarray,
+    days_back: int,
+    interval_sizes: list[float],
+    min_price_increment: int = 1,
+) -> dict[float, np.ndarray]:
+    """
+    Возвращает для каждого interval_size массив (n, 2) нижних и верхних границ,
+    рассчитанных на каждой свече так же, как MomentumStrategy в живом роботе:
+    процентили цен в нано-единицах, нижняя граница округляется до шага цены
+    min_price_increment вниз, верхняя вверх.
+    Одно скользящее окно используется для всех interval_size сразу. Окно
+    по времени имеет переменную длину, поэтому процентили считаются в цикле
+    по свечам за O(log n), а округление - векторно.
+    """
+    window = RollingPercentile()
+    starts = np.searchsorted(times, times - days_back * SECONDS_IN_DAY)
+    nano_closes = float_to_nano(np.asarray(closes, dtype=np.float64))
+    percentiles = {}
+    for interval_size in interval_sizes:
+        lower_percentile = (1 - interval_size) / 2 * 100
+        percentiles[interval_size] = (lower_percentile, 100 - lower_percentile)
+    borders = {
+        interval_size: np.empty((len(closes), 2)) for interval_size in interval_sizes
+    }
+    for index, (time, close) in enumerate(zip(times.tolist(), nano_closes.tolist())):
+        window.update(time, close)
+        window.expire(int(times[starts[index]]))
+        for interval_size, (lower, upper) in percentiles.items():
+            borders[interval_size][index, 0] = window.percentile(lower)
+            borders[interval_size][index, 1] = window.percentile(upper)
+    for values in borders.values():
+        lower = np.floor(values[:, 0]).astype(np.int64)
+        upper = np.ceil(values[:, 1]).astype(np.int64)
+        tick = min_price_increment
+        values[:, 0] = nano_to_float(round_to_tick(lower, tick, ROUND_DOWN))
+        values[:, 1] = nano_to_float(round_to_tick(upper, tick, ROUND_UP))
+    return borders
+
+
+def _first_true(mask: np.ndarray, start: int) -> Optional[int]:
+    index = np.flatnonzero(mask[start:])
+    return start + int(index[0]) if len(index) else None
+
+
+def _first_exit(
+    closes: np.ndarray,
+    widths: np.ndarray,
+    sell_signal: np.ndarray,
+    start: int,
+    average_price: float,
+    stop_loss_ratio: float,
+) -> tuple[Optional[int], int]:
+    """
+    Ищет первую свечу начиная со start, на которой срабатывает стоп-лосс или сигнал
+    на продажу. Поиск идет блоками растущего размера, чтобы не сравнивать весь
+    остаток массива на каждой сделке.
+    """
+    chunk = 256
+    while start < len(closes):
+        end = min(start + chunk, len(closes))
+        stop = average_price - widths[start:end] * stop_loss_ratio > closes[start:end]
+        exits = np.flatnonzero(stop | sell_signal[start:end])
+        if len(exits):
+            index = int(exits[0])
+            return start + index, EXIT_STOP_LOSS if stop[index] else EXIT_SELL
+        start = end
+        chunk *= 2
+    return None, EXIT_OPEN
+
+
+def run_backtest(
+    times: np.ndarray,
+    closes: np.ndarray,
+    borders: Optional[np.ndarray] = None,
+    interval_size: float = 0.8,
+    days_back: int = DAYS_BACK,
+    quantity_limit: int = QUATITY_LIMIT,
+    stop_loss_ratio: float = STOP_LOSS_RATIO,
+    lot_size: int = 1,
+    min_price_increment: int = 1,
+    commission_rate: float = 0.0005,
+    initial_cash: float = 0.0,
+) -> BacktestResult:
+    """
+    Прогоняет правила робота по массивам времени (секунды) и цен закрытия.
+    Сигналы считаются векторно, а цикл идет только по сделкам.
+    Шаг цены min_price_increment задается в нано-единицах.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    closes = np.asarray(closes, dtype=np.float64)
+    if borders is None:
+        borders = channel_borders(
+            times, closes, days_back, [interval_size], min_price_increment
+        )[interval_size]
+    lower, upper = borders[:, 0], borders[:, 1]
+    widths = upper - lower
+    # робот торгует только с полным окном исторических данных
+    ready = times >= times[0] + days_back * SECONDS_IN_DAY
+    sell_signal = ready & (closes >= upper)
+    buy_signal = ready & (closes <= lower) & ~sell_signal
+
+    quantity = quantity_limit * lot_size
+    trades = []
+    index = 0
+    while True:
+        entry = _first_true(buy_signal, index)
+        if entry is None:
+            break
+        entry_price = closes[entry]
+        exit_index, reason = _first_exit(
+            closes, widths, sell_signal, entry + 1, entry_price, stop_loss_ratio
+        )
+        exit_price = closes[exit_index if exit_index is not None else -1]
+        pnl = (exit_price - entry_price) * quantity
+        pnl -= entry_price * quantity * commission_rate
+        if exit_index is not None:
+            pnl -= exit_price * quantity * commission_rate
+        trades.append(
+            (
+                times[entry],
+                times[exit_index] if exit_index is not None else -1,
+                entry_price,
+                exit_price,
+                quantity_limit,
+                reason,
+                pnl,
+            )
+        )
+        if exit_index is None:
+            break
+        index = exit_index + 1
+    trades = np.array(trades, dtype=TRADE_DTYPE)
+
+    # кривая капитала: денежные потоки по сделкам и переоценка позиции
+    entries = np.searchsorted(times, trades["entry_time"])
+    closed = trades["exit_reason"] != EXIT_OPEN
+    exits = np.searchsorted(times, trades["exit_time"][closed])
+    position = np.zeros(len(closes) + 1)
+    np.add.at(position, entries, quantity)
+    np.add.at(position, exits, -quantity)
+    position = np.cumsum(position[:-1])
+    cash = np.zeros(len(closes))
+    np.add.at(cash, entries, -trades["entry_price"] * quantity * (1 + commission_rate))
+    np.add.at(
+        cash, exits, trades["exit_price"][closed] * quantity * (1 - commission_rate)
+    )
+    equity = initial_cash + np.cumsum(cash) + position * closes
+    peak = np.maximum.accumulate(equity)
+    drawdown = equity - peak
+    commission = float(
+        (trades["entry_price"] * quantity).sum()
+        + (trades["exit_price"][closed] * quantity).sum()
+    ) * commission_rate
+    return BacktestResult(
+        trades=trades,
+        equity=equity,
+        drawdown=drawdown,
+        pnl=float(equity[-1] - initial_cash) if len(equity) else 0.0,
+        commission=commission,
+    )
+
+
+_times: Optional[np.ndarray] = None
+_closes: Optional[np.ndarray] = None
+_min_price_increment = 1
+
+
+def _init_worker(times: np.ndarray, closes: np.ndarray, min_price_increment: int):
+    global _times, _closes, _min_price_increment
+    _times, _closes, _min_price_increment = times, closes, min_price_increment
+
+
+def _run_group(days_back: int, grid: list[dict]) -> list[tuple[dict, dict]]:
+    interval_sizes = sorted({params.get("interval_size", 0.8) for params in grid})
+    borders = channel_borders(
+        _times, _closes, days_back, interval_sizes, _min_price_increment
+    )
+    results = []
+    for params in grid:
+        interval_size = params.get("interval_size", 0.8)
+        result = run_backtest(
+            _times,
+            _closes,
+            borders=borders[interval_size],
+            days_back=days_back,
+            min_price_increment=_min_price_increment,
+            **params,
+        )
+        results.append((params, result.summary()))
+    return results
+
+
+def sweep(
+    times: np.ndarray,
+    closes: np.ndarray,
+    grid: list[dict],
+    processes: Optional[int] = None,
+    min_price_increment: int = 1,
+) -> list[tuple[dict, dict]]:
+    """
+    Перебирает наборы параметров run_backtest в пуле процессов.
+    Наборы с одинаковым days_back считаются вместе, чтобы границы канала
+    для всех interval_size рассчитывались за один проход. Если таких групп
+    меньше, чем процессов, группы делятся на части по interval_size, чтобы
+    заняты были все процессы.
+    """
+    groups: dict[int, list[dict]] = {}
+    for params in grid:
+        params = dict(params)
+        groups.setdefault(params.pop("days_back", DAYS_BACK), []).append(params)
+    workers = processes or os.cpu_count() or 1
+    parts = -(-workers // len(groups)) if groups else 1
+    tasks = []
+    for days_back, group in groups.items():
+        group.sort(key=lambda params: params.get("interval_size", 0.8))
+        size = -(-len(group) // min(parts, len(group)))
+        for start in range(0, len(group), size):
+            tasks.append((days_back, group[start:start + size]))
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(times, closes, min_price_increment),
+    ) as executor:
+        futures = [
+            (days_back, executor.submit(_run_group, days_back, group))
+            for days_back, group in tasks
+        ]
+        for days_back, future in futures:
+            for params, summary in future.result():
+                results.append(({"days_back": days_back, **params}, summary))
+    return results
+
+
+def load_candles(figi: str, db_name: str = "candles.db") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Загружает время и цены закрытия 1-минутных свечей из локального хранилища.
+    """
+    with sqlite3.connect(db_name) as conn:
+        rows = conn.execute(
+            "SELECT time, close FROM candles WHERE figi=? AND interval=1 ORDER BY time",
+            (figi,),
+        ).fetchall()
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    return data[:, 0], data[:, 1] / NANO
+
+
+def load_min_price_increment(figi: str, db_name: str = "instruments.db") -> int:
+    """
+    Возвращает шаг цены инструмента в нано-единицах из справочника инструментов
+    или 1, если инструмента в справочнике нет.
+    """
+    with sqlite3.connect(db_name) as conn:
+        row = conn.execute(
+            "SELECT min_price_increment FROM instruments WHERE figi=?", (figi,)
+        ).fetchone()
+    return int(row[0]) if row is not None else 1
+
+
+if __name__ == "__main__":
+    times, closes = load_candles(sys.argv[1])
+    min_price_increment = load_min_price_increment(sys.argv[1])
+    grid = [
+        {"days_back": days_back, "interval_size": interval_size}
+        for days_back, interval_size in itertools.product(
+            [3, 5, 10], [0.6, 0.7, 0.8, 0.9]
+        )
+    ]
+    results = sweep(times, closes, grid, min_price_increment=min_price_increment)
+    for params, summary in sorted(results, key=lambda x: -x[1]["pnl"]):
+        print(params, summary)
@@ -0,0 +1,378 @@
+"""
+Воспроизведение торговой сессии по журналу событий (utils.journal) через код
+TradingRobot и стратегий в модельном времени.
+
+Рыночные данные (свечи, последние цены, торговый статус) берутся из журнала
+на текущий момент модельного времени, счет эмулируется: рыночный ордер
+исполняется сразу по последней цене журнала, начальные позиции берутся
+из первого снимка портфеля счета. Роботы создаются по записям ROBOT с теми же
+счетами, лимитами позиции и параметрами инструментов, стратегии - по текущим
+настройкам, поэтому изменение стратегии можно проверить на записанной сессии.
+Паузы роботов не занимают реального времени, а результат воспроизведения
+не зависит от скорости машины.
+
+Запуск (несколько файлов журнала объединяются по времени):
+    python -m backtest.replay journal/2026-10-16-12345.journal
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+os.environ.setdefault("INVEST_TOKEN", "fake")
+
+from benchmarks.fake_broker import FakeBroker
+from utils.candle_array import CANDLE_DTYPE
+from utils.journal import (
+    CANDLES,
+    ORDER,
+    PORTFOLIO,
+    PRICE,
+    ROBOT,
+    STATUS,
+    Record,
+    read_journals,
+)
+from utils.prices import nano_to_float, nano_to_money, nano_to_quotation
+
+NS = 10 ** 9
+DIRECTIONS = {1: "BUY", 2: "SELL"}
+
+
+class Decision(NamedTuple):
+    time: datetime
+    account_id: str
+    figi: str
+    direction: str
+    quantity: int
+    price: float
+
+    @property
+    def key(self) -> tuple:
+        # одновременные ордера разных роботов могут отправляться в любом порядке
+        return (
+            int(self.time.timestamp()),
+            self.account_id,
+            self.figi,
+            self.direction,
+            self.quantity,
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"{self.time:%Y-%m-%d %H:%M:%S} {self.account_id} {self.figi} "
+            f"{self.direction} {self.quantity} @ {self.price}"
+        )
+
+
+class SimulatedClock:
+    """
+    Модельное время. Цикл событий не ждет таймеров, а переводит часы на момент
+    ближайшего из них, поэтому asyncio.sleep не занимает реального времени.
+    time.time, time.time_ns, time.monotonic и now() из SDK после install
+    возвращают модельное время, uninstall возвращает исходные функции.
+    """
+
+    def __init__(self, start: float):
+        self.start = start
+        # цикл событий считает время от start: при абсолютном времени точности
+        # float не хватает, чтобы часы дошли ровно до момента таймера
+        self.elapsed = 0.0
+        # (объект, атрибут, исходное значение или None для методов класса)
+        self._patched: list[tuple[object, str, object]] = []
+
+    @property
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time, tz=timezone.utc)
+
+    def _patch(self, target: object, name: str, value) -> None:
+        self._patched.append((target, name, vars(target).get(name)))
+        setattr(target, name, value)
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        from tinkoff.invest.utils import now
+
+        select = loop._selector.select
+
+        def simulated_select(timeout: Optional[float] = None):
+            events = select(0)
+            if not events and timeout:
+                self.elapsed += timeout
+            return events
+
+        self._patch(loop, "time", lambda: self.elapsed)
+        self._patch(loop._selector, "select", simulated_select)
+        self._patch(time, "time", lambda: self.time)
+        self._patch(time, "monotonic", lambda: self.time)
+        self._patch(time, "time_ns", lambda: int(self.time * NS))
+        # модули проекта импортируют now из SDK по имени
+        for module in list(sys.modules.values()):
+            if getattr(module, "now", None) is now:
+                self._patch(module, "now", self.now)
+
+    def uninstall(self) -> None:
+        while self._patched:
+            target, name, value = self._patched.pop()
+            if value is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+
+
+class ReplayBroker(FakeBroker):
+    """
+    Эмулятор брокера, отвечающий рыночными данными журнала на момент модельного
+    времени. Завершенные свечи берутся в окончательном виде, а формирующаяся
+    свеча и последняя цена - в том виде, в каком их получил робот к этому моменту.
+    """
+
+    def __init__(self, records: list[Record], clock: SimulatedClock):
+        super().__init__()
+        self.records = records
+        self.clock = clock
+        self.robots: dict[tuple[str, str], tuple[int, int, int]] = {}
+        self.history: dict[str, np.ndarray] = {}
+        self.forming: dict[str, np.void] = {}
+        self.last_prices: dict[str, int] = {}
+        self.statuses: dict[str, bool] = {}
+        self.recorded: list[Decision] = []
+        self.decisions: list[Decision] = []
+        self._next = 0  # первая не примененная запись
+        self._prepare()
+
+    def _prepare(self) -> None:
+        """
+        Собирает окончательные свечи, начальные позиции, роботов и ордера,
+        отправленные в записанной сессии.
+        """
+        candles: dict[str, list[np.ndarray]] = {}
+        last_prices: dict[str, int] = {}
+        for record in self.records:
+            if record.kind == ROBOT:
+                account_id, figi, *params = record.values
+                self.robots[(account_id, figi)] = tuple(params)
+            elif record.kind == CANDLES:
+                candles.setdefault(record.values[0], []).append(record.values[1])
+            elif record.kind == PRICE:
+                last_prices[record.values[0]] = record.values[1]
+            elif record.kind == PORTFOLIO:
+                account_id, positions = record.values
+                if account_id in self.positions:
+                    continue
+                self.positions[account_id] = {
+                    figi: SimpleNamespace(
+                        figi=figi,
+                        quantity_lots=nano_to_quotation(lots),
+                        average_position_price=nano_to_money(price, "rub"),
+                    )
+                    for figi, lots, price in positions
+                }
+            elif record.kind == ORDER:
+                account_id, figi, _, direction, quantity, _ = record.values
+                self.recorded.append(
+                    Decision(
+                        datetime.fromtimestamp(record.time / NS, tz=timezone.utc),
+                        account_id,
+                        figi,
+                        DIRECTIONS.get(direction, str(direction)),
+                        quantity,
+                        nano_to_float(last_prices.get(figi, 0)),
+                    )
+                )
+        for figi, arrays in candles.items():
+            rows = np.concatenate(arrays)
+            rows = rows[np.argsort(rows["time"], kind="stable")]
+            # из версий свечи с одним временем остается последняя записанная
+            last = np.append(rows["time"][1:] != rows["time"][:-1], True)
+            self.history[figi] = rows[last]
+
+    def _advance(self) -> None:
+        """
+        Применяет записи журнала до текущего модельного времени.
+        """
+        now = self.clock.time * NS
+        while self._next < len(self.records) and self.records[self._next].time <= now:
+            record = self.records[self._next]
+            self._next += 1
+            if record.kind == PRICE:
+                self.last_prices[record.values[0]] = record.values[1]
+            elif record.kind == STATUS:
+                self.statuses[record.values[0]] = bool(record.values[1])
+            elif record.kind == CANDLES and len(record.values[1]):
+                self.forming[record.values[0]] = record.values[1][-1]
+
+    def now(self) -> datetime:
+        return self.clock.now()
+
+    def price(self, figi: str, time: Optional[datetime] = None) -> float:
+        """
+        Последняя цена журнала, до первой цены - цена закрытия последней
+        завершенной свечи.
+        """
+        self._advance()
+        price = self.last_prices.get(figi)
+        if price is None:
+            rows = self.history.get(figi, np.empty(0, dtype=CANDLE_DTYPE))
+            end = np.searchsorted(rows["time"], self.clock.time - 60, side="right")
+            if end == 0:
+                raise KeyError(f"No prices in the journal before {self.now()} {figi}")
+            price = int(rows["close"][end - 1])
+        return nano_to_float(price)
+
+    @staticmethod
+    def _candle(row: np.void, is_complete: bool) -> SimpleNamespace:
+        return SimpleNamespace(
+            open=nano_to_quotation(int(row["open"])),
+            high=nano_to_quotation(int(row["high"])),
+            low=nano_to_quotation(int(row["low"])),
+            close=nano_to_quotation(int(row["close"])),
+            volume=int(row["volume"]),
+            time=datetime.fromtimestamp(int(row["time"]), tz=timezone.utc),
+            is_complete=is_complete,
+        )
+
+    async def get_all_candles(self, figi: str, from_: datetime, to: datetime, interval):
+        await self._call("get_all_candles")
+        self._advance()
+        minute = int(self.clock.time) // 60 * 60
+        rows = self.history.get(figi, np.empty(0, dtype=CANDLE_DTYPE))
+        start = np.searchsorted(rows["time"], int(from_.timestamp()))
+        end = np.searchsorted(rows["time"], min(minute, int(to.timestamp()) + 1))
+        for row in rows[start:end]:
+            yield self._candle(row, is_complete=True)
+        forming = self.forming.get(figi)
+        if forming is not None and forming["time"] == minute:
+            yield self._candle(forming, is_complete=False)
+
+    async def get_trading_status(self, figi: str):
+        await self._call("get_trading_status")
+        self._advance()
+        available = self.statuses.get(figi, True)
+        return SimpleNamespace(
+            figi=figi,
+            market_order_available_flag=available,
+            api_trade_available_flag=available,
+        )
+
+    async def post_order(
+        self,
+        figi: str,
+        quantity: int,
+        direction,
+        account_id: str,
+        order_type,
+        order_id: str = "",
+        **kwargs,
+    ):
+        response = await super().post_order(
+            figi, quantity, direction, account_id, order_type, order_id, **kwargs
+        )
+        self.decisions.append(
+            Decision(
+                self.now(),
+                account_id,
+                figi,
+                DIRECTIONS.get(direction, str(direction)),
+                quantity,
+                self.price(figi),
+            )
+        )
+        return response
+
+    post_sandbox_order = post_order
+
+
+async def _replay(broker: ReplayBroker, duration: float) -> None:
+    from client import broker_client
+    from db.instruments import Instrument, instrument_registry
+    from robot import TradingRobot
+    from stop_engine import stop_engine
+    from telegram.telegram_service import telegram_bot
+    from utils.journal import journal
+
+    journal.directory = None
+    telegram_bot.send = lambda chat_id, text: None
+    broker_client.client = broker
+    robots = []
+    for (account_id, figi), (quantity_limit, lot, increment) in broker.robots.items():
+        broker_client.register_account(account_id, True)
+        instrument_registry.by_figi[figi] = Instrument(
+            figi, "", "", "", "", lot, increment, "rub", True, ""
+        )
+        robots.append(TradingRobot(figi, account_id, quantity_limit))
+    tasks = [asyncio.create_task(robot.start()) for robot in robots]
+    tasks.append(asyncio.create_task(stop_engine.run()))
+    await asyncio.sleep(duration)
+    # вместе с роботами отменяются созданные ими задачи (трекеры ордеров и др.)
+    pending = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, *pending, return_exceptions=True)
+
+
+def replay(paths: list[str]) -> tuple[list[Decision], list[Decision]]:
+    """
+    Воспроизводит журнал и возвращает ордера записанной сессии и ордера,
+    отправленные роботами при воспроизведении.
+    """
+    records = list(read_journals(paths))
+    if not records:
+        return [], []
+    start, end = records[0].time / NS, records[-1].time / NS
+    clock = SimulatedClock(start)
+    broker = ReplayBroker(records, clock)
+    loop = asyncio.new_event_loop()
+    clock.install(loop)
+    try:
+        loop.run_until_complete(_replay(broker, end - start))
+    finally:
+        clock.uninstall()
+        loop.close()
+    return broker.recorded, broker.decisions
+
+
+def main(args) -> int:
+    started = time.perf_counter()
+    recorded, decisions = replay(args.paths)
+    elapsed = time.perf_counter() - started
+    recorded.sort(key=lambda decision: decision.key)
+    decisions.sort(key=lambda decision: decision.key)
+    for decision in decisions:
+        print(decision)
+    print(f"recorded orders: {len(recorded)}, replayed orders: {len(decisions)}")
+    for index, (expected, actual) in enumerate(zip(recorded, decisions)):
+        if expected.key != actual.key:
+            print(f"first difference at order {index}:")
+            print(f"    recorded {expected}")
+            print(f"    replayed {actual}")
+            break
+    print(f"replayed in {elapsed:.1f}s", file=sys.stderr)
+    same = [decision.key for decision in recorded] == [
+        decision.key for decision in decisions
+    ]
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала событий")
+    parser.add_argument("paths", nargs="+", help="файлы журнала")
+    arguments = parser.parse_args()
+    arguments.paths = [os.path.abspath(path) for path in arguments.paths]
+    # базы данных робота создаются во временном каталоге
+    package_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        sys.path.insert(0, package_dir)
+        code = main(arguments)
+        os.chdir(package_dir)
+    sys.exit(code)
@@ -0,0 +1,65 @@
+"""
+Сравнение памяти и времени подготовки цен закрытия: список HistoricCandle
+с последующим проходом quotation_to_float против декодирования сразу в CandleArray.
+
+Запуск:
+    python -m benchmarks.bench_candles
+"""
+import asyncio
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("INVEST_TOKEN", "fake")
+
+CANDLES = 14400  # 10 дней 1-минутных свечей
+
+
+async def collect(fake, to: datetime) -> list:
+    return [
+        candle
+        async for candle in fake.get_all_candles(
+            "FAKE", to - timedelta(minutes=CANDLES - 1), to, None
+        )
+    ]
+
+
+def measure(build) -> tuple[float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size / 1024, elapsed * 1000
+
+
+def run():
+    from benchmarks.fake_broker import FakeBroker
+    from utils.candle_array import CandleArray
+    from utils.quotation import quotation_to_float
+
+    fake = FakeBroker()
+    to = datetime.now(timezone.utc)
+
+    def build_list():
+        candles = asyncio.run(collect(fake, to))
+        return candles, [quotation_to_float(candle.close) for candle in candles]
+
+    def build_array():
+        candles = CandleArray(capacity=CANDLES)
+        for candle in asyncio.run(collect(fake, to)):
+            candles.append_candle(candle, candle.is_complete)
+        return candles, candles.closes
+
+    list_memory, list_time = measure(build_list)
+    array_memory, array_time = measure(build_array)
+    print(f"candles={CANDLES}")
+    print(f"list[HistoricCandle]: {list_memory:10.1f} KB {list_time:8.1f} ms")
+    print(f"CandleArray:          {array_memory:10.1f} KB {array_time:8.1f} ms")
+
+
+if __name__ == "__main__":
+    run()
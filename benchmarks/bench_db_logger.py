@@ -0,0 +1,63 @@
+"""
+Стоимость записи ордера в журнал для вызывающего кода: синхронная запись
+против отложенной (write-behind) при высокой частоте ордеров.
+
+Запуск:
+    python -m benchmarks.bench_db_logger
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from db.db_logger import DBLogger, Fill
+
+ORDERS = 5000
+
+
+def run_logger(db_name: str, write_behind: bool) -> tuple[float, float]:
+    db_logger = DBLogger(db_name, write_behind=write_behind)
+    order_time = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    for order_id in range(ORDERS):
+        db_logger.add_order(
+            order_id=str(order_id),
+            account_id="BENCH",
+            figi="BBG000000001",
+            order_direction="ORDER_DIRECTION_BUY",
+            quantity=1,
+            status="EXECUTION_REPORT_STATUS_NEW",
+            created_at=order_time,
+        )
+        db_logger.update_order_execution(
+            order_id=str(order_id),
+            status="EXECUTION_REPORT_STATUS_FILL",
+            price=100.5,
+            lots_executed=1,
+            updated_at=order_time,
+        )
+        db_logger.add_fill(
+            Fill(
+                str(order_id), str(order_id), "BENCH", "BBG000000001", 1, 100.5, order_time
+            )
+        )
+    caller_time = time.perf_counter() - started
+    db_logger.close()
+    total_time = time.perf_counter() - started
+    return caller_time, total_time
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        for write_behind in (False, True):
+            db_name = os.path.join(directory, f"bench_{write_behind}.db")
+            caller_time, total_time = run_logger(db_name, write_behind)
+            mode = "write-behind" if write_behind else "synchronous"
+            print(
+                f"{mode:>12}: {caller_time / ORDERS * 1e6:8.1f} us/order in caller, "
+                f"{total_time / ORDERS * 1e6:8.1f} us/order until flushed"
+            )
+
+
+if __name__ == "__main__":
+    run()
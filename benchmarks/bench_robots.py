@@ -0,0 +1,124 @@
+"""
+Нагрузочный тест TradingRobot на эмуляторе брокера: задержка торгового цикла
+(перцентили), число запросов к API на цикл, задержка цикла событий и память.
+
+Запуск:
+    python -m benchmarks.bench_robots --robots 1 10 100 1000 --cycles 5
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("INVEST_TOKEN", "fake")
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class LoopLagMonitor:
+    """
+    Измеряет, насколько позже запланированного просыпается цикл событий.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+async def run_robots(count: int, cycles: int, latency: float, days_back: int) -> dict:
+    from benchmarks.fake_broker import FakeBroker
+    from client import broker_client, portfolio_service, price_board
+    from robot import TradingRobot
+    from settings import ACCOUNT_ID
+
+    fake = FakeBroker(latency=latency, jitter=latency / 2)
+    broker_client.client = fake
+    portfolio_service.invalidate(ACCOUNT_ID)
+    price_board.figis.clear()
+
+    robots = [TradingRobot(f"FAKE{count:04d}{index:05d}") for index in range(count)]
+    for robot in robots:
+        robot.strategy.days_back = days_back
+        # каждый цикл пересчитывает границы, как робот с паузой CHECK_INTERVAL
+        robot.strategy.ttl = 0
+
+    async def timed_cycle(robot) -> float:
+        started = time.perf_counter()
+        await robot.cycle()
+        return time.perf_counter() - started
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    await asyncio.gather(*[timed_cycle(robot) for robot in robots])
+    warmup = time.perf_counter() - started
+
+    fake.calls.clear()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    latencies = []
+    for _ in range(cycles):
+        latencies.extend(await asyncio.gather(*[timed_cycle(robot) for robot in robots]))
+    monitor.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "robots": count,
+        "warmup_s": warmup,
+        "cycle_p50_ms": percentile(latencies, 50) * 1000,
+        "cycle_p95_ms": percentile(latencies, 95) * 1000,
+        "cycle_p99_ms": percentile(latencies, 99) * 1000,
+        "rpc_per_cycle": sum(fake.calls.values()) / cycles,
+        "rpc_by_method": dict(fake.calls),
+        "loop_lag_p99_ms": percentile(monitor.lags or [0.0], 99) * 1000,
+        "loop_lag_max_ms": max(monitor.lags or [0.0]) * 1000,
+        "max_rss_growth_mb": (rss_after - rss_before) / 1024,
+    }
+
+
+async def main(args):
+    from telegram.telegram_service import telegram_bot
+
+    telegram_bot.send = lambda chat_id, text: None
+    for count in args.robots:
+        result = await run_robots(count, args.cycles, args.latency, args.days_back)
+        rpc_by_method = result.pop("rpc_by_method")
+        print(" ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in result.items()
+        ))
+        print(f"    rpc: {rpc_by_method}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--robots", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--days-back", type=int, default=1)
+    arguments = parser.parse_args()
+    # базы данных робота создаются во временном каталоге
+    package_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        sys.path.insert(0, package_dir)
+        asyncio.run(main(arguments))
+        os.chdir(package_dir)
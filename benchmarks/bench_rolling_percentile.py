@@ -0,0 +1,62 @@
+"""
+Сравнение расчета границ канала: полный np.percentile на каждом цикле
+против скользящего окна RollingPercentile.
+
+Запуск:
+    python -m benchmarks.bench_rolling_percentile
+"""
+import random
+import time
+
+import numpy as np
+
+from utils.rolling_percentile import RollingPercentile
+
+WINDOW = 8000  # ~10 дней 1-минутных свечей
+CYCLES = 2000
+INTERVAL_SIZE = 0.8
+
+
+def make_closes(count: int) -> list[float]:
+    price = 100.0
+    closes = []
+    for _ in range(count):
+        price = max(0.01, price + random.gauss(0, 0.05))
+        closes.append(round(price, 2))
+    return closes
+
+
+def run():
+    closes = make_closes(WINDOW + CYCLES)
+    lower_percentile = (1 - INTERVAL_SIZE) / 2 * 100
+    percentiles = [lower_percentile, 100 - lower_percentile]
+
+    started = time.perf_counter()
+    full_borders = []
+    for cycle in range(CYCLES):
+        values = closes[cycle + 1: cycle + WINDOW + 1]
+        full_borders.append(list(np.percentile(values, percentiles)))
+    full_time = time.perf_counter() - started
+
+    window = RollingPercentile()
+    for index in range(WINDOW):
+        window.update(index, closes[index])
+    started = time.perf_counter()
+    rolling_borders = []
+    for cycle in range(CYCLES):
+        window.update(cycle + WINDOW, closes[cycle + WINDOW])
+        window.expire(cycle + 1)
+        rolling_borders.append([window.percentile(q) for q in percentiles])
+    rolling_time = time.perf_counter() - started
+
+    mismatches = sum(
+        full != rolling for full, rolling in zip(full_borders, rolling_borders)
+    )
+    print(f"window={WINDOW} cycles={CYCLES}")
+    print(f"np.percentile:     {full_time / CYCLES * 1e6:10.1f} us/cycle")
+    print(f"RollingPercentile: {rolling_time / CYCLES * 1e6:10.1f} us/cycle")
+    print(f"speedup: {full_time / rolling_time:.1f}x, mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    run()
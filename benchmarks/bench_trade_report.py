@@ -0,0 +1,77 @@
+"""
+Время отчета по журналу сделок: запросы к дневным итогам и позициям против
+агрегирования по всей таблице сделок.
+
+Запуск:
+    python -m benchmarks.bench_trade_report
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from db.db_logger import DBLogger
+from utils.read_from_db import get_instrument_stats, get_positions
+
+FILLS = 1000000
+FIGIS = [f"BBG00000{index:04d}" for index in range(50)]
+DAYS = 250
+
+
+def fill_rows(count: int):
+    started = 1700000000
+    positions = dict.fromkeys(FIGIS, 0)
+    for index in range(count):
+        figi = random.choice(FIGIS)
+        # позиция только длинная, как у робота
+        quantity = random.randint(1, 10)
+        if positions[figi] >= quantity and random.random() < 0.5:
+            quantity = -quantity
+        positions[figi] += quantity
+        yield (
+            str(index),
+            str(index // 2),
+            "BENCH",
+            figi,
+            quantity,
+            round(random.uniform(90, 110), 2),
+            started + index * DAYS * 86400 // count,
+        )
+
+
+def full_scan(conn: sqlite3.Connection) -> list[tuple]:
+    return conn.execute(
+        "SELECT figi, COUNT(*), TOTAL(MAX(quantity, 0)), TOTAL(MAX(-quantity, 0)), "
+        "TOTAL(ABS(quantity) * price), TOTAL(realized) FROM fills GROUP BY figi"
+    ).fetchall()
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "bench_report.db")
+        db_logger = DBLogger(db_name)
+        started = time.perf_counter()
+        db_logger.db_client.execute_many(
+            "INSERT INTO fills (trade_id, order_id, account_id, figi, quantity, price, "
+            "time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            fill_rows(FILLS),
+        )
+        insert_time = time.perf_counter() - started
+        db_logger.close()
+        print(f"fills={FILLS}: {insert_time / FILLS * 1e6:.1f} us/fill to insert")
+
+        with sqlite3.connect(db_name) as conn:
+            started = time.perf_counter()
+            get_instrument_stats(conn)
+            get_positions(conn)
+            report_time = time.perf_counter() - started
+            started = time.perf_counter()
+            full_scan(conn)
+            scan_time = time.perf_counter() - started
+        print(f"  summary report: {report_time * 1000:8.1f} ms")
+        print(f"  full scan:      {scan_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,235 @@
+"""
+Локальный эмулятор брокера для нагрузочного тестирования без обращения к API.
+
+FakeBroker реализует ту часть сервисов AsyncClient, которую вызывает TargetClient:
+свечи, последние цены, портфель, ордера, состояние ордера, торговый статус
+и расписание торгов.
+Подключается подменой клиента внутри TargetClient:
+
+    broker_client.client = FakeBroker(latency=0.01)
+
+поэтому весь путь вызова через TargetClient и общие сервисы сохраняется.
+"""
+import asyncio
+import math
+import random
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Optional
+from uuid import uuid4
+
+from grpc import StatusCode
+from tinkoff.invest import (
+    AioRequestError,
+    HistoricCandle,
+    MoneyValue,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    Quotation,
+)
+from tinkoff.invest.grpc.orders_pb2 import ORDER_DIRECTION_BUY
+
+from utils.prices import float_to_nano, nano_to_money, nano_to_quotation
+from utils.quotation import quotation_to_float
+
+PricePath = Callable[[str, int], float]
+
+
+def _to_quotation(value: float) -> Quotation:
+    return nano_to_quotation(float_to_nano(value))
+
+
+def _to_money(value: float) -> MoneyValue:
+    return nano_to_money(float_to_nano(value), "rub")
+
+
+def default_price_path(figi: str, minute: int) -> float:
+    """
+    Детерминированная цена инструмента на заданной минуте (от начала эпохи).
+    """
+    seed = zlib.crc32(figi.encode())
+    phase = (seed % 1000) / 100
+    base = 50 + seed % 200
+    price = base * (
+        1
+        + 0.02 * math.sin(minute / 97 + phase)
+        + 0.005 * math.sin(minute / 7.3 + 2 * phase)
+    )
+    return round(price, 2)
+
+
+class FakeBroker:
+    """
+    Эмулятор брокера с настраиваемой задержкой ответа, долей ошибок и
+    траекторией цен. Ведет счетчики вызовов по методам.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        price_path: PricePath = default_price_path,
+        seed: Optional[int] = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.price_path = price_path
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        # позиции по счету и figi
+        self.positions: dict[str, dict[str, SimpleNamespace]] = defaultdict(dict)
+        self.order_states: dict[str, SimpleNamespace] = {}
+        # сервисы AsyncClient, к которым обращается TargetClient
+        self.sandbox = self.orders = self.operations = self
+        self.market_data = self.users = self.instruments = self
+
+    async def _call(self, method: str) -> None:
+        self.calls[method] += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise AioRequestError(
+                StatusCode.UNAVAILABLE, f"fake {method} error", metadata=None
+            )
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def price(self, figi: str, time: Optional[datetime] = None) -> float:
+        time = time or self.now()
+        return self.price_path(figi, int(time.timestamp()) // 60)
+
+    # рыночные данные
+
+    async def get_all_candles(self, figi: str, from_: datetime, to: datetime, interval):
+        await self._call("get_all_candles")
+        minute = int(from_.timestamp()) // 60
+        last_minute = int(to.timestamp()) // 60
+        while minute <= last_minute:
+            close = self.price_path(figi, minute)
+            previous = self.price_path(figi, minute - 1)
+            yield HistoricCandle(
+                open=_to_quotation(previous),
+                high=_to_quotation(max(previous, close)),
+                low=_to_quotation(min(previous, close)),
+                close=_to_quotation(close),
+                volume=100,
+                time=datetime.fromtimestamp(minute * 60, tz=timezone.utc),
+                is_complete=minute < last_minute,
+            )
+            minute += 1
+
+    async def get_last_prices(self, figi: list[str]):
+        await self._call("get_last_prices")
+        now = self.now()
+        return SimpleNamespace(
+            last_prices=[
+                SimpleNamespace(
+                    figi=item,
+                    price=_to_quotation(self.price(item, now)),
+                    time=now - timedelta(seconds=1),
+                )
+                for item in figi
+            ]
+        )
+
+    async def get_trading_status(self, figi: str):
+        await self._call("get_trading_status")
+        return SimpleNamespace(
+            figi=figi, market_order_available_flag=True, api_trade_available_flag=True
+        )
+
+    async def trading_schedules(self, from_: datetime, to: datetime):
+        # площадки инструментов эмулятора неизвестны: роботы проверяют
+        # торговый статус, как без расписания
+        await self._call("trading_schedules")
+        return SimpleNamespace(exchanges=[])
+
+    # счет и ордера
+
+    async def get_accounts(self):
+        await self._call("get_accounts")
+        return SimpleNamespace(accounts=[SimpleNamespace(id="fake", name="fake")])
+
+    get_sandbox_accounts = get_accounts
+
+    async def get_portfolio(self, account_id: str):
+        await self._call("get_portfolio")
+        return SimpleNamespace(positions=list(self.positions[account_id].values()))
+
+    get_sandbox_portfolio = get_portfolio
+
+    async def get_orders(self, account_id: str):
+        await self._call("get_orders")
+        return SimpleNamespace(orders=[])
+
+    get_sandbox_orders = get_orders
+
+    async def post_order(
+        self,
+        figi: str,
+        quantity: int,
+        direction,
+        account_id: str,
+        order_type,
+        order_id: str = "",
+        **kwargs,
+    ):
+        """
+        Рыночный ордер исполняется сразу по текущей цене траектории.
+        """
+        await self._call("post_order")
+        price = self.price(figi)
+        positions = self.positions[account_id]
+        position = positions.get(figi)
+        lots, average = 0, 0.0
+        if position is not None:
+            lots = int(quotation_to_float(position.quantity_lots))
+            average = quotation_to_float(position.average_position_price)
+        if direction == ORDER_DIRECTION_BUY:
+            average = (lots * average + quantity * price) / (lots + quantity)
+            lots += quantity
+        else:
+            lots = max(0, lots - quantity)
+        if lots:
+            positions[figi] = SimpleNamespace(
+                figi=figi,
+                quantity_lots=_to_quotation(lots),
+                average_position_price=_to_money(average),
+            )
+        else:
+            positions.pop(figi, None)
+        broker_order_id = str(uuid4())
+        self.order_states[broker_order_id] = SimpleNamespace(
+            order_id=broker_order_id,
+            figi=figi,
+            direction=OrderDirection(direction),
+            order_date=self.now(),
+            lots_requested=quantity,
+            lots_executed=quantity,
+            total_order_amount=_to_money(price * quantity),
+            executed_order_price=_to_money(price),
+            execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            stages=[
+                SimpleNamespace(
+                    price=_to_money(price), quantity=quantity, trade_id=str(uuid4())
+                )
+            ],
+        )
+        return SimpleNamespace(
+            order_id=broker_order_id,
+            execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+        )
+
+    post_sandbox_order = post_order
+
+    async def get_order_state(self, account_id: str, order_id: str):
+        await self._call("get_order_state")
+        return self.order_states[order_id]
+
+    get_sandbox_order_state = get_order_state
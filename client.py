@@ -1,62 +1,386 @@
+import asyncio
+import math
+import time
+from datetime import timedelta
+from typing import AsyncIterable, NamedTuple, Optional
+
+from grpc import StatusCode
 from tinkoff.invest import (
+    AioRequestError,
     AsyncClient,
     PostOrderResponse,
     GetLastPricesResponse,
     OrderState,
     GetTradingStatusResponse,
+    MarketDataRequest,
+    MarketDataResponse,
+    PortfolioPosition,
+    TradesStreamResponse,
 )
+from tinkoff.invest.utils import now
 
-from settings import TOKEN, SANDBOX
+from settings import (
+    TOKEN,
+    SANDBOX,
+    PORTFOLIO_TTL,
+    PRICE_BATCH_WINDOW,
+    RATE_LIMITS,
+    RATE_LIMIT_QUEUE_SIZE,
+    RATE_LIMIT_RETRIES,
+)
+from utils.journal import journal
+from utils.metrics import metrics
+from utils.prices import nano_to_float, quotations_to_nano
+from utils.rate_limiter import Priority, RateLimiter
 
 
 class TargetClient:
     """
     Класс для создания экземпляра AsyncClient для работы в песочнице
     или на реальном счете.
+    Запросы проходят через планировщик с ограничением частоты по группам методов,
+    поэтому при нагрузке ордера обслуживаются раньше свечей.
+    Одно соединение обслуживает несколько счетов: запросы по счету направляются
+    в песочницу или на реальный контур по флагу, заданному для счета.
     """
 
     def __init__(self, token: str, sandbox: bool = False):
         self.token = token
-        self.sandbox = sandbox
+        self.sandbox = sandbox  # контур счетов, не зарегистрированных явно
+        self.accounts: dict[str, bool] = {}
         self.client = None
+        self.rate_limiter = RateLimiter(RATE_LIMITS, queue_size=RATE_LIMIT_QUEUE_SIZE)
+        # в рабочих процессах супервизора ордера передаются процессу-владельцу счета
+        self.order_router = None
+
+    def register_account(self, account_id: str, sandbox: bool) -> None:
+        self.accounts[account_id] = sandbox
+
+    def is_sandbox(self, account_id: Optional[str] = None) -> bool:
+        return self.accounts.get(account_id, self.sandbox)
 
     async def create(self):
         self.client = await AsyncClient(token=self.token, app_name="").__aenter__()
 
+    async def _request(self, group: str, priority: Priority, method, **kwargs):
+        """
+        Выполняет запрос после получения токена. При RESOURCE_EXHAUSTED группа
+        приостанавливается до сброса лимита и запрос повторяется.
+        """
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            await self.rate_limiter.acquire(group, priority)
+            try:
+                return await method(**kwargs)
+            except AioRequestError as err:
+                if (
+                        err.code != StatusCode.RESOURCE_EXHAUSTED
+                        or attempt == RATE_LIMIT_RETRIES
+                ):
+                    raise
+                self.rate_limiter.on_exhausted(group, err.metadata)
+                metrics.inc("retries_total", group=group)
+
+    @metrics.timed("client_request_seconds", method="get_orders")
     async def get_orders(self, **kwargs):
-        if self.sandbox:
-            return await self.client.sandbox.get_sandbox_orders(**kwargs)
-        return await self.client.orders.get_orders(**kwargs)
+        if self.is_sandbox(kwargs.get("account_id")):
+            return await self._request(
+                "sandbox", Priority.STATE, self.client.sandbox.get_sandbox_orders, **kwargs
+            )
+        return await self._request(
+            "orders", Priority.STATE, self.client.orders.get_orders, **kwargs
+        )
 
+    @metrics.timed("client_request_seconds", method="get_portfolio")
     async def get_portfolio(self, **kwargs):
-        if self.sandbox:
-            return await self.client.sandbox.get_sandbox_portfolio(**kwargs)
-        return await self.client.operations.get_portfolio(**kwargs)
+        if self.is_sandbox(kwargs.get("account_id")):
+            portfolio = await self._request(
+                "sandbox",
+                Priority.STATE,
+                self.client.sandbox.get_sandbox_portfolio,
+                **kwargs,
+            )
+        else:
+            portfolio = await self._request(
+                "operations",
+                Priority.STATE,
+                self.client.operations.get_portfolio,
+                **kwargs,
+            )
+        journal.portfolio(kwargs["account_id"], portfolio.positions)
+        return portfolio
 
+    @metrics.timed("client_request_seconds", method="get_accounts")
     async def get_accounts(self):
         if self.sandbox:
-            return await self.client.sandbox.get_sandbox_accounts()
-        return await self.client.users.get_accounts()
+            return await self._request(
+                "sandbox", Priority.STATE, self.client.sandbox.get_sandbox_accounts
+            )
+        return await self._request("users", Priority.STATE, self.client.users.get_accounts)
 
     async def get_all_candles(self, **kwargs):
-        async for candle in self.client.get_all_candles(**kwargs):
-            yield candle
+        """
+        Загружает свечи за период. При RESOURCE_EXHAUSTED группа приостанавливается
+        до сброса лимита, а загрузка продолжается с последней полученной свечи.
+        """
+        last_time = None
+        with metrics.timer("client_request_seconds", method="get_all_candles"):
+            for attempt in range(RATE_LIMIT_RETRIES + 1):
+                # SDK запрашивает 1-минутные свечи по одному дню за запрос
+                period = kwargs["to"] - kwargs["from_"]
+                days = math.ceil(period / timedelta(days=1)) + 1
+                await self.rate_limiter.acquire(
+                    "candles", Priority.CANDLES, tokens=days
+                )
+                try:
+                    async for candle in self.client.get_all_candles(**kwargs):
+                        if last_time is not None and candle.time <= last_time:
+                            continue
+                        last_time = candle.time
+                        yield candle
+                    return
+                except AioRequestError as err:
+                    if (
+                            err.code != StatusCode.RESOURCE_EXHAUSTED
+                            or attempt == RATE_LIMIT_RETRIES
+                    ):
+                        raise
+                    self.rate_limiter.on_exhausted("candles", err.metadata)
+                    metrics.inc("retries_total", group="candles")
+                    if last_time is not None:
+                        kwargs["from_"] = last_time
 
+    @metrics.timed("client_request_seconds", method="get_last_prices")
     async def get_last_prices(self, **kwargs) -> GetLastPricesResponse:
-        return await self.client.market_data.get_last_prices(**kwargs)
+        return await self._request(
+            "market_data",
+            Priority.STATE,
+            self.client.market_data.get_last_prices,
+            **kwargs,
+        )
 
-    async def post_order(self, **kwargs) -> PostOrderResponse:
-        if self.sandbox:
-            return await self.client.sandbox.post_sandbox_order(**kwargs)
-        return await self.client.orders.post_order(**kwargs)
+    @metrics.timed("client_request_seconds", method="post_order")
+    async def post_order(
+        self, priority: Priority = Priority.ORDER, **kwargs
+    ) -> PostOrderResponse:
+        if self.order_router is not None:
+            return await self.order_router.post_order(priority=priority, **kwargs)
+        sent_at = time.time_ns()
+        if self.is_sandbox(kwargs.get("account_id")):
+            response = await self._request(
+                "sandbox", priority, self.client.sandbox.post_sandbox_order, **kwargs
+            )
+        else:
+            response = await self._request(
+                "orders", priority, self.client.orders.post_order, **kwargs
+            )
+        # запись в журнал не задерживает отправку ордера
+        journal.order(
+            kwargs["account_id"],
+            kwargs["figi"],
+            kwargs.get("order_id", ""),
+            kwargs["direction"],
+            kwargs["quantity"],
+            priority,
+            sent_at,
+        )
+        return response
 
+    @metrics.timed("client_request_seconds", method="get_order_state")
     async def get_order_state(self, **kwargs) -> OrderState:
-        if self.sandbox:
-            return await self.client.sandbox.get_sandbox_order_state(**kwargs)
-        return await self.client.orders.get_order_state(**kwargs)
+        if self.is_sandbox(kwargs.get("account_id")):
+            order_state = await self._request(
+                "sandbox",
+                Priority.STATE,
+                self.client.sandbox.get_sandbox_order_state,
+                **kwargs,
+            )
+        else:
+            order_state = await self._request(
+                "orders", Priority.STATE, self.client.orders.get_order_state, **kwargs
+            )
+        journal.order_state(kwargs["account_id"], order_state)
+        return order_state
+
+    @metrics.timed("client_request_seconds", method="get_instruments")
+    async def get_instruments(self, method: str):
+        """
+        Возвращает список инструментов одного вида: shares, bonds, etfs,
+        currencies или futures.
+        """
+        return await self._request(
+            "instruments", Priority.STATE, getattr(self.client.instruments, method)
+        )
 
+    @metrics.timed("client_request_seconds", method="get_instrument_by")
+    async def get_instrument_by(self, **kwargs):
+        return await self._request(
+            "instruments",
+            Priority.STATE,
+            self.client.instruments.get_instrument_by,
+            **kwargs,
+        )
+
+    @metrics.timed("client_request_seconds", method="get_trading_schedules")
+    async def get_trading_schedules(self, **kwargs):
+        return await self._request(
+            "instruments",
+            Priority.STATE,
+            self.client.instruments.trading_schedules,
+            **kwargs,
+        )
+
+    @metrics.timed("client_request_seconds", method="get_trading_status")
     async def get_trading_status(self, **kwargs) -> GetTradingStatusResponse:
-        return await self.client.market_data.get_trading_status(**kwargs)
+        trading_status = await self._request(
+            "market_data",
+            Priority.STATE,
+            self.client.market_data.get_trading_status,
+            **kwargs,
+        )
+        journal.status(
+            kwargs["figi"],
+            trading_status.market_order_available_flag
+            and trading_status.api_trade_available_flag,
+        )
+        return trading_status
+
+    def trades_stream(self, **kwargs) -> AsyncIterable[TradesStreamResponse]:
+        return self.client.orders_stream.trades_stream(**kwargs)
+
+    def market_data_stream(
+        self, requests: AsyncIterable[MarketDataRequest]
+    ) -> AsyncIterable[MarketDataResponse]:
+        return self.client.market_data_stream.market_data_stream(requests)
+
+
+class PortfolioService:
+    """
+    Общий для всех роботов снимок портфеля, проиндексированный по figi.
+    Одновременные запросы объединяются в один вызов get_portfolio, полученный
+    снимок используется в течение ttl секунд или до вызова invalidate().
+    """
+
+    def __init__(self, client: TargetClient, ttl: float):
+        self.client = client
+        self.ttl = ttl
+        self._snapshots: dict[str, tuple[float, dict[str, PortfolioPosition]]] = {}
+        self._requests: dict[str, asyncio.Task] = {}
+
+    async def get_positions(self, account_id: str) -> dict[str, PortfolioPosition]:
+        """
+        Возвращает позиции счета по figi, при необходимости обновляя снимок.
+        """
+        snapshot = self._snapshots.get(account_id)
+        if snapshot is not None and time.monotonic() - snapshot[0] < self.ttl:
+            return snapshot[1]
+        request = self._requests.get(account_id)
+        if request is None:
+            request = asyncio.create_task(self._fetch(account_id))
+            self._requests[account_id] = request
+        return await asyncio.shield(request)
+
+    async def get_position(
+        self, account_id: str, figi: str
+    ) -> Optional[PortfolioPosition]:
+        positions = await self.get_positions(account_id)
+        return positions.get(figi)
+
+    def invalidate(self, account_id: str) -> None:
+        """
+        Сбрасывает снимок счета. Вызывается после отправки или исполнения ордера.
+        Запрос, начатый до сброса, может вернуть устаревшие данные, поэтому
+        следующий вызов get_positions отправит новый запрос.
+        """
+        self._snapshots.pop(account_id, None)
+        self._requests.pop(account_id, None)
+
+    async def _fetch(self, account_id: str) -> dict[str, PortfolioPosition]:
+        try:
+            portfolio = await self.client.get_portfolio(account_id=account_id)
+        finally:
+            is_current = self._requests.get(account_id) is asyncio.current_task()
+            if is_current:
+                del self._requests[account_id]
+        positions = {position.figi: position for position in portfolio.positions}
+        if is_current:
+            self._snapshots[account_id] = (time.monotonic(), positions)
+        return positions
+
+
+class Quote(NamedTuple):
+    price: float
+    age: float  # возраст котировки в секундах
+
+
+class QuoteUnavailable(Exception):
+    pass
+
+
+class PriceBoard:
+    """
+    Табло последних цен всех запущенных роботов. Запросы, пришедшие в течение
+    window секунд, объединяются в один вызов get_last_prices по всем
+    зарегистрированным figi.
+    """
+
+    def __init__(self, client: TargetClient, window: float):
+        self.client = client
+        self.window = window
+        self.figis: set[str] = set()
+        self.quotes: dict[str, Quote] = {}
+        self._request: Optional[asyncio.Task] = None
+
+    def register(self, figi: str) -> None:
+        self.figis.add(figi)
+
+    def unregister(self, figi: str) -> None:
+        self.figis.discard(figi)
+        self.quotes.pop(figi, None)
+
+    async def get_quote(self, figi: str) -> Quote:
+        """
+        Возвращает последнюю цену инструмента и ее возраст. Если в ответе нет
+        цены инструмента, возвращается последняя полученная ранее.
+        """
+        self.figis.add(figi)
+        quotes = await self.get_quotes()
+        quote = quotes.get(figi, self.quotes.get(figi))
+        if quote is None:
+            raise QuoteUnavailable(f"No last price for {figi}")
+        return quote
+
+    async def get_quotes(self) -> dict[str, Quote]:
+        """
+        Возвращает последние цены всех зарегистрированных инструментов.
+        """
+        if self._request is None:
+            self._request = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._request)
+
+    async def _fetch(self) -> dict[str, Quote]:
+        await asyncio.sleep(self.window)
+        # вызовы после этой точки попадут уже в следующий запрос
+        self._request = None
+        response = await self.client.get_last_prices(figi=list(self.figis))
+        received = now()
+        nano_prices = quotations_to_nano(
+            last_price.price for last_price in response.last_prices
+        )
+        journal.prices(
+            [last_price.figi for last_price in response.last_prices],
+            nano_prices.tolist(),
+        )
+        prices = nano_to_float(nano_prices)
+        quotes = {
+            last_price.figi: Quote(
+                price=price, age=(received - last_price.time).total_seconds()
+            )
+            for last_price, price in zip(response.last_prices, prices.tolist())
+        }
+        self.quotes.update(quotes)
+        return quotes
 
 
 broker_client = TargetClient(token=TOKEN, sandbox=SANDBOX)
+portfolio_service = PortfolioService(broker_client, ttl=PORTFOLIO_TTL)
+price_board = PriceBoard(broker_client, window=PRICE_BATCH_WINDOW)
@@ -0,0 +1,234 @@
+import atexit
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from tinkoff.invest import Candle, CandleInterval
+from tinkoff.invest.utils import now
+
+from client import broker_client
+from db.sqlite_client import SQLiteClient
+from db.write_behind import WriteBehindWriter
+from settings import CANDLE_MMAP_DIR, DB_WRITE_BEHIND, SQLITE_BUSY_TIMEOUT
+from utils.candle_array import CANDLE_DTYPE, CandleArray
+from utils.journal import journal
+from utils.prices import quotation_to_nano
+from utils.resampler import Resampler
+
+logger = logging.getLogger(__name__)
+
+def _to_timestamp(time: datetime) -> int:
+    return int(time.timestamp())
+
+
+class CandleStore:
+    """
+    Локальное хранилище свечей по ключу (figi, interval).
+    Свечи держатся в памяти в виде CandleArray и дублируются в SQLite, поэтому
+    переживают перезапуск робота. При каждом запросе с сервера докачивается только
+    недостающий хвост, начиная с последней сохраненной (возможно, еще
+    не сформированной) свечи. Если задан mmap_dir, массивы свечей хранятся
+    в отображенных в память файлах в этом каталоге.
+    Свечи старших таймфреймов собираются локально из 1-минутных свечей
+    без отдельной загрузки истории. В режиме write_behind свечи пишутся в базу
+    отдельным потоком, и обновления из стрима не блокируют цикл событий.
+    """
+
+    def __init__(
+        self, db_name: str, mmap_dir: Optional[str] = None, write_behind: bool = False
+    ):
+        self.db_client = SQLiteClient(db_name)
+        # в режиме супервизора базу пишут несколько рабочих процессов
+        self.db_client.connect(timeout=SQLITE_BUSY_TIMEOUT)
+        self.db_client.enable_wal()
+        self._create_tables()
+        self.writer: Optional[WriteBehindWriter] = None
+        if write_behind:
+            self.writer = WriteBehindWriter(db_name, timeout=SQLITE_BUSY_TIMEOUT)
+            atexit.register(self.close)
+        self.mmap_dir = mmap_dir
+        if mmap_dir is not None:
+            os.makedirs(mmap_dir, exist_ok=True)
+        self._candles: dict[tuple[str, int], CandleArray] = {}
+        self._resamplers: dict[tuple[str, int, int], Resampler] = {}
+
+    def _create_tables(self):
+        self.db_client.execute(
+            """
+            CREATE TABLE IF NOT EXISTS candles (
+                figi TEXT,
+                interval INTEGER,
+                time INTEGER,
+                open INTEGER,
+                high INTEGER,
+                low INTEGER,
+                close INTEGER,
+                volume INTEGER,
+                is_complete INTEGER,
+                PRIMARY KEY (figi, interval, time)
+            )
+            """
+        )
+
+    def _load(self, key: tuple[str, int], from_time: int) -> CandleArray:
+        """
+        Поднимает свечи из базы данных в память.
+        """
+        rows = self.db_client.execute_select(
+            "SELECT time, open, high, low, close, volume, is_complete FROM candles "
+            "WHERE figi=? AND interval=? AND time>=? ORDER BY time",
+            (key[0], key[1], from_time),
+        )
+        data = np.array(rows, dtype=np.int64).reshape(-1, 7)
+        stored = np.empty(len(data), dtype=CANDLE_DTYPE)
+        stored["time"] = data[:, 0]
+        for column, field in enumerate(("open", "high", "low", "close"), start=1):
+            stored[field] = data[:, column]
+        stored["volume"] = data[:, 5]
+        stored["is_complete"] = data[:, 6]
+        path = None
+        if self.mmap_dir is not None:
+            path = os.path.join(self.mmap_dir, f"{key[0]}_{key[1]}.candles")
+        candles = CandleArray(capacity=max(1024, 2 * len(stored)), path=path)
+        candles.extend(stored)
+        self._candles[key] = candles
+        logger.debug(f"Loaded {len(rows)} stored candles {key[0]}")
+        return candles
+
+    def _get(self, key: tuple[str, int], from_time: int) -> CandleArray:
+        """
+        Возвращает массив свечей, удаляя свечи старше временного окна
+        из памяти и базы данных.
+        """
+        candles = self._candles.get(key)
+        if candles is None:
+            candles = self._load(key, from_time)
+        if candles.evict(from_time):
+            self._write(
+                "DELETE FROM candles WHERE figi=? AND interval=? AND time<?",
+                [(key[0], key[1], from_time)],
+            )
+        return candles
+
+    def _write(self, sql: str, rows: list[tuple]):
+        if self.writer is not None:
+            for row in rows:
+                self.writer.submit(sql, row)
+        else:
+            self.db_client.execute_many(sql, rows)
+
+    def _save(self, rows: list[tuple]):
+        self._write(
+            "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def close(self):
+        """
+        Дожидается записи всех отложенных свечей и закрывает соединения.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        self.db_client.close()
+
+    @staticmethod
+    def _row(key: tuple[str, int], candle, is_complete: bool) -> tuple:
+        return (
+            key[0],
+            key[1],
+            _to_timestamp(candle.time),
+            quotation_to_nano(candle.open),
+            quotation_to_nano(candle.high),
+            quotation_to_nano(candle.low),
+            quotation_to_nano(candle.close),
+            candle.volume,
+            int(is_complete),
+        )
+
+    async def get_candles(
+        self,
+        figi: str,
+        interval: CandleInterval,
+        days_back: int,
+    ) -> CandleArray:
+        """
+        Возвращает свечи инструмента за последние days_back дней, докачивая с сервера
+        только свечи, появившиеся после последней сохраненной.
+        Полученные свечи декодируются сразу в массив, заменяя свечи с совпадающим
+        временем (в том числе последнюю, еще формирующуюся свечу).
+        Возвращаемый массив принадлежит хранилищу и не должен изменяться.
+        """
+        key = (figi, int(interval))
+        to = now()
+        from_ = to - timedelta(days=days_back)
+        candles = self._get(key, _to_timestamp(from_))
+
+        if len(candles):
+            from_ = datetime.fromtimestamp(candles.last_time, tz=timezone.utc)
+        rows = []
+        async for candle in broker_client.get_all_candles(
+                figi=figi,
+                from_=from_,
+                to=to,
+                interval=interval,
+        ):
+            candles.append_candle(candle, candle.is_complete)
+            rows.append(self._row(key, candle, candle.is_complete))
+        logger.debug(f"Received {len(rows)} new candles {figi}")
+        self._save(rows)
+        if interval == CandleInterval.CANDLE_INTERVAL_1_MIN:
+            journal.candles(figi, candles)
+        return candles
+
+    def add_candle(
+        self,
+        figi: str,
+        interval: CandleInterval,
+        candle: Candle,
+        days_back: int,
+    ) -> CandleArray:
+        """
+        Добавляет свечу, полученную из стрима рыночных данных, без обращения к серверу.
+        """
+        key = (figi, int(interval))
+        candles = self._get(key, _to_timestamp(now() - timedelta(days=days_back)))
+        candles.append_candle(candle, is_complete=False)
+        self._save([self._row(key, candle, is_complete=False)])
+        if interval == CandleInterval.CANDLE_INTERVAL_1_MIN:
+            journal.candles(figi, candles)
+        return candles
+
+    def resample(
+        self, figi: str, timeframe: int, days_back: int, offset: int = 0
+    ) -> CandleArray:
+        """
+        Возвращает свечи таймфрейма timeframe секунд за последние days_back дней,
+        собранные из сохраненных 1-минутных свечей, без обращения к серверу.
+        Интервалы отсчитываются от начала эпохи со сдвигом offset. Неполная первая
+        свеча, начавшаяся раньше временного окна, отбрасывается.
+        """
+        from_time = _to_timestamp(now() - timedelta(days=days_back))
+        minutes = self._get((figi, int(CandleInterval.CANDLE_INTERVAL_1_MIN)), from_time)
+        key = (figi, timeframe, offset)
+        resampler = self._resamplers.get(key)
+        if resampler is None:
+            resampler = self._resamplers[key] = Resampler(timeframe, offset)
+        resampler.consume(minutes)
+        resampler.seal(_to_timestamp(now()))
+        resampler.bars.evict(from_time)
+        return resampler.bars
+
+    async def get_bars(
+        self, figi: str, timeframe: int, days_back: int, offset: int = 0
+    ) -> CandleArray:
+        """
+        Докачивает 1-минутные свечи и возвращает свечи таймфрейма timeframe секунд.
+        """
+        await self.get_candles(figi, CandleInterval.CANDLE_INTERVAL_1_MIN, days_back)
+        return self.resample(figi, timeframe, days_back, offset)
+
+
+candle_store = CandleStore(
+    "candles.db", mmap_dir=CANDLE_MMAP_DIR, write_behind=DB_WRITE_BEHIND
+)
@@ -1,45 +1,237 @@
+import atexit
+from concurrent.futures import Future
+from datetime import datetime
+from typing import NamedTuple, Optional
+
 from db.sqlite_client import SQLiteClient
+from db.write_behind import WriteBehindWriter
+
+# Схема журнала сделок. Версия схемы хранится в PRAGMA user_version, при открытии
+# базы применяются все миграции после текущей версии. Время - unix-время в секундах,
+# цены и суммы - в валюте инструмента.
+MIGRATIONS = [
+    # 1: журнал ордеров без времени и идентификатора брокера переносится
+    # в legacy_orders, добавляются сделки, позиции и дневные итоги
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY,
+        figi str,
+        direction TEXT,
+        price REAL,
+        quantity INTEGER,
+        status TEXT
+    );
+    ALTER TABLE orders RENAME TO legacy_orders;
+    CREATE TABLE orders (
+        order_id TEXT PRIMARY KEY,
+        account_id TEXT NOT NULL,
+        figi TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        lots_requested INTEGER NOT NULL,
+        lots_executed INTEGER NOT NULL DEFAULT 0,
+        price REAL,
+        status TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    );
+    CREATE INDEX orders_figi_time ON orders (figi, created_at);
+    CREATE INDEX orders_time ON orders (created_at);
+
+    -- quantity в штуках: положительное - покупка, отрицательное - продажа;
+    -- realized - реализованный результат сделки по средней цене позиции
+    CREATE TABLE fills (
+        trade_id TEXT PRIMARY KEY,
+        order_id TEXT NOT NULL,
+        account_id TEXT NOT NULL,
+        figi TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        time INTEGER NOT NULL,
+        realized REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX fills_figi_time ON fills (figi, time);
+    CREATE INDEX fills_time ON fills (time);
+    CREATE INDEX fills_order ON fills (order_id);
+
+    -- cost - стоимость открытой позиции по цене входа, со знаком позиции
+    CREATE TABLE positions (
+        account_id TEXT NOT NULL,
+        figi TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        cost REAL NOT NULL,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (account_id, figi)
+    );
+
+    CREATE TABLE daily_summary (
+        day TEXT NOT NULL,
+        account_id TEXT NOT NULL,
+        figi TEXT NOT NULL,
+        fills INTEGER NOT NULL,
+        bought INTEGER NOT NULL,
+        sold INTEGER NOT NULL,
+        buy_value REAL NOT NULL,
+        sell_value REAL NOT NULL,
+        realized REAL NOT NULL,
+        PRIMARY KEY (day, account_id, figi)
+    );
+    CREATE INDEX daily_summary_figi ON daily_summary (figi, day);
+
+    -- позиции и дневные итоги поддерживаются при вставке сделки, поэтому отчеты
+    -- не сканируют таблицу сделок; повторная вставка сделки игнорируется
+    CREATE TRIGGER fills_apply AFTER INSERT ON fills
+    BEGIN
+        UPDATE fills SET realized = COALESCE((
+            SELECT CASE WHEN quantity * NEW.quantity < 0 THEN
+                MIN(ABS(NEW.quantity), ABS(quantity))
+                * (NEW.price - cost / quantity)
+                * (CASE WHEN quantity > 0 THEN 1 ELSE -1 END)
+            ELSE 0 END
+            FROM positions
+            WHERE account_id = NEW.account_id AND figi = NEW.figi
+        ), 0)
+        WHERE trade_id = NEW.trade_id;
+
+        INSERT INTO positions VALUES (
+            NEW.account_id, NEW.figi, NEW.quantity, NEW.quantity * NEW.price, NEW.time
+        )
+        ON CONFLICT (account_id, figi) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            cost = CASE
+                WHEN quantity * excluded.quantity >= 0 THEN cost + excluded.cost
+                WHEN ABS(excluded.quantity) <= ABS(quantity)
+                    THEN cost * (quantity + excluded.quantity) / quantity
+                ELSE (quantity + excluded.quantity) * NEW.price
+            END,
+            updated_at = excluded.updated_at;
+
+        INSERT INTO daily_summary
+        SELECT
+            date(time, 'unixepoch'), account_id, figi, 1,
+            MAX(quantity, 0), MAX(-quantity, 0),
+            MAX(quantity, 0) * price, MAX(-quantity, 0) * price,
+            realized
+        FROM fills
+        WHERE trade_id = NEW.trade_id
+        ON CONFLICT (day, account_id, figi) DO UPDATE SET
+            fills = fills + 1,
+            bought = bought + excluded.bought,
+            sold = sold + excluded.sold,
+            buy_value = buy_value + excluded.buy_value,
+            sell_value = sell_value + excluded.sell_value,
+            realized = realized + excluded.realized;
+    END;
+    """,
+]
+
+
+class Fill(NamedTuple):
+    trade_id: str
+    order_id: str
+    account_id: str
+    figi: str
+    quantity: int  # в штуках, продажа - со знаком минус
+    price: float
+    time: datetime
+
+
+def _to_timestamp(time: datetime) -> int:
+    return int(time.timestamp())
 
 
 class DBLogger:
-    def __init__(self, db_name: str):
+    """
+    Журнал ордеров и сделок. Ордера хранятся по идентификатору брокера,
+    сделки - по идентификатору сделки, позиции и дневные итоги пересчитываются
+    триггером при вставке сделки. В режиме write_behind запись выполняется
+    отдельным потоком, и вызовы add_*/update_* не блокируют торговый цикл.
+    """
+
+    def __init__(self, db_name: str, write_behind: bool = False):
         self.db_client = SQLiteClient(db_name)
         self.db_client.connect()
-        self._create_tables()
-
-    def _create_tables(self):
-        self.db_client.execute(
-            """
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY,
-                figi str,
-                direction TEXT,
-                price REAL,
-                quantity INTEGER,
-                status TEXT
+        self._migrate()
+        self.writer: Optional[WriteBehindWriter] = None
+        if write_behind:
+            self.db_client.enable_wal()
+            self.writer = WriteBehindWriter(db_name)
+            atexit.register(self.close)
+
+    def _migrate(self):
+        version = self.db_client.execute_select_one("PRAGMA user_version")[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # PRAGMA не принимает параметры, номер версии подставляется в скрипт
+            self.db_client.conn.executescript(
+                f"BEGIN; {script}; PRAGMA user_version = {number}; COMMIT;"
             )
-            """
-        )
+
+    def _insert(self, sql: str, params) -> int | Future:
+        if self.writer is not None:
+            return self.writer.submit(sql, params, need_result=True)
+        return self.db_client.execute_insert(sql, params)
+
+    def _update(self, sql: str, params) -> None:
+        if self.writer is not None:
+            self.writer.submit(sql, params)
+        else:
+            self.db_client.execute_update(sql, params)
+
+    def close(self):
+        """
+        Дожидается записи всех отложенных запросов и закрывает соединения.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        self.db_client.close()
 
     def add_order(
         self,
         order_id: str,
+        account_id: str,
         figi: str,
         order_direction: str,
-        price: float,
         quantity: int,
         status: str,
-    ):
-        self.db_client.execute_insert(
-            "INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)",
-            (order_id, figi, order_direction, price, quantity, status),
+        created_at: datetime,
+    ) -> int | Future:
+        """
+        Возвращает id строки, а в режиме write_behind - Future с ним.
+        """
+        created = _to_timestamp(created_at)
+        return self._insert(
+            "INSERT OR IGNORE INTO orders "
+            "(order_id, account_id, figi, direction, lots_requested, status, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (order_id, account_id, figi, order_direction, quantity, status,
+             created, created),
         )
 
     def get_orders(self):
         return self.db_client.execute_select("SELECT * FROM orders")
 
-    def update_order_status(self, order_id: str, status: str):
-        self.db_client.execute_update(
-            "UPDATE orders SET status=? WHERE id=?",
-            (status, order_id),
+    def update_order_status(self, order_id: str, status: str, updated_at: datetime):
+        self._update(
+            "UPDATE orders SET status=?, updated_at=? WHERE order_id=?",
+            (status, _to_timestamp(updated_at), order_id),
+        )
+
+    def update_order_execution(
+        self,
+        order_id: str,
+        status: str,
+        price: float,
+        lots_executed: int,
+        updated_at: datetime,
+    ):
+        self._update(
+            "UPDATE orders SET status=?, price=?, lots_executed=?, updated_at=? "
+            "WHERE order_id=?",
+            (status, price, lots_executed, _to_timestamp(updated_at), order_id),
+        )
+
+    def add_fill(self, fill: Fill):
+        self._update(
+            "INSERT OR IGNORE INTO fills (trade_id, order_id, account_id, figi, "
+            "quantity, price, time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*fill[:6], _to_timestamp(fill.time)),
         )
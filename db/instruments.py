@@ -0,0 +1,213 @@
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from grpc import StatusCode
+from tinkoff.invest import AioRequestError, InstrumentIdType
+
+from client import TargetClient, broker_client
+from db.sqlite_client import SQLiteClient
+from settings import INSTRUMENTS_REFRESH_INTERVAL
+from utils.prices import quotation_to_nano
+
+logger = logging.getLogger(__name__)
+
+# метод InstrumentsService и тип инструмента, как в поле instrument_type
+INSTRUMENT_KINDS = {
+    "shares": "share",
+    "bonds": "bond",
+    "etfs": "etf",
+    "currencies": "currency",
+    "futures": "futures",
+}
+
+
+# Схема справочника. Версия схемы хранится в PRAGMA user_version, при открытии
+# базы применяются все миграции после текущей версии.
+MIGRATIONS = [
+    # 1: справочник инструментов и время его последней загрузки
+    """
+    CREATE TABLE IF NOT EXISTS instruments (
+        figi TEXT PRIMARY KEY,
+        ticker TEXT,
+        class_code TEXT,
+        kind TEXT,
+        name TEXT,
+        lot INTEGER,
+        min_price_increment INTEGER,
+        currency TEXT,
+        api_trade_available INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS registry (key TEXT PRIMARY KEY, value REAL)
+    """,
+    # 2: торговая площадка инструмента; справочник загружается заново,
+    # чтобы заполнить площадки уже сохраненных инструментов
+    """
+    ALTER TABLE instruments ADD COLUMN exchange TEXT;
+    DELETE FROM registry WHERE key = 'updated'
+    """,
+]
+
+
+class Instrument(NamedTuple):
+    figi: str
+    ticker: str
+    class_code: str
+    kind: str
+    name: str
+    lot: int
+    min_price_increment: int  # шаг цены в нано-единицах
+    currency: str
+    api_trade_available: bool
+    exchange: str  # торговая площадка для расписания торгов
+
+
+class InstrumentRegistry:
+    """
+    Справочник инструментов в SQLite с индексами в памяти по figi, тикеру
+    и коду режима торгов. Полный список инструментов загружается с сервера
+    не чаще раза в INSTRUMENTS_REFRESH_INTERVAL секунд, отсутствующие
+    инструменты догружаются по одному.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_client = SQLiteClient(db_name)
+        self.db_client.connect()
+        self._create_tables()
+        self.by_figi: dict[str, Instrument] = {}
+        self.by_ticker: dict[str, list[Instrument]] = {}
+        self.by_class_code: dict[str, list[Instrument]] = {}
+        self._load()
+
+    def _create_tables(self):
+        version = self.db_client.execute_select_one("PRAGMA user_version")[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # PRAGMA не принимает параметры, номер версии подставляется в скрипт
+            self.db_client.conn.executescript(
+                f"BEGIN; {script}; PRAGMA user_version = {number}; COMMIT;"
+            )
+
+    def _load(self):
+        rows = self.db_client.execute_select("SELECT * FROM instruments")
+        for row in rows:
+            self._index(
+                Instrument(
+                    *row[:8], api_trade_available=bool(row[8]), exchange=row[9] or ""
+                )
+            )
+        logger.debug(f"Loaded {len(rows)} instruments")
+
+    def _index(self, instrument: Instrument):
+        previous = self.by_figi.get(instrument.figi)
+        if previous is not None:
+            self.by_ticker[previous.ticker].remove(previous)
+            self.by_class_code[previous.class_code].remove(previous)
+        self.by_figi[instrument.figi] = instrument
+        self.by_ticker.setdefault(instrument.ticker, []).append(instrument)
+        self.by_class_code.setdefault(instrument.class_code, []).append(instrument)
+
+    def _save(self, instruments: list[Instrument]):
+        self.db_client.execute_many(
+            "INSERT OR REPLACE INTO instruments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (*instrument[:8], int(instrument.api_trade_available), instrument.exchange)
+                for instrument in instruments
+            ],
+        )
+        for instrument in instruments:
+            self._index(instrument)
+
+    @staticmethod
+    def _convert(item, kind: str) -> Instrument:
+        return Instrument(
+            figi=item.figi,
+            ticker=item.ticker,
+            class_code=item.class_code,
+            kind=kind,
+            name=item.name,
+            lot=item.lot,
+            min_price_increment=quotation_to_nano(item.min_price_increment),
+            currency=item.currency,
+            api_trade_available=item.api_trade_available_flag,
+            exchange=item.exchange,
+        )
+
+    @property
+    def updated(self) -> float:
+        row = self.db_client.execute_select_one(
+            "SELECT value FROM registry WHERE key='updated'"
+        )
+        return row[0] if row else 0.0
+
+    async def refresh(self, client: TargetClient = broker_client, force: bool = False):
+        """
+        Загружает с сервера полный список инструментов, если справочник
+        устарел или пуст.
+        """
+        if not force and self.by_figi and (
+                time.time() - self.updated < INSTRUMENTS_REFRESH_INTERVAL
+        ):
+            return
+        instruments = []
+        for method, kind in INSTRUMENT_KINDS.items():
+            response = await client.get_instruments(method)
+            instruments.extend(self._convert(item, kind) for item in response.instruments)
+        self._save(instruments)
+        self.db_client.execute(
+            "INSERT OR REPLACE INTO registry VALUES ('updated', ?)", (time.time(),)
+        )
+        logger.info(f"Instrument registry refreshed: {len(instruments)} instruments")
+
+    async def ensure(self, figis: list[str], client: TargetClient = broker_client):
+        """
+        Догружает инструменты, которых еще нет в справочнике.
+        """
+        instruments = []
+        for figi in figis:
+            if figi in self.by_figi:
+                continue
+            try:
+                response = await client.get_instrument_by(
+                    id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
+                )
+            except AioRequestError as err:
+                if err.code != StatusCode.NOT_FOUND:
+                    raise
+                continue
+            instrument = response.instrument
+            instruments.append(self._convert(instrument, instrument.instrument_type))
+        if instruments:
+            self._save(instruments)
+
+    def get(self, figi: str) -> Optional[Instrument]:
+        return self.by_figi.get(figi)
+
+    def find(self, ticker: str, class_code: Optional[str] = None) -> Optional[Instrument]:
+        """
+        Возвращает инструмент по тикеру, при неоднозначности - с заданным
+        кодом режима торгов.
+        """
+        for instrument in self.by_ticker.get(ticker, []):
+            if class_code is None or instrument.class_code == class_code:
+                return instrument
+        return None
+
+    def validate(self, figis: list[str]) -> list[str]:
+        """
+        Возвращает figi, доступные для торговли через API, и пишет в лог остальные.
+        """
+        valid = []
+        for figi in figis:
+            instrument = self.by_figi.get(figi)
+            if instrument is None:
+                logger.error(f"Unknown instrument {figi}")
+            elif not instrument.api_trade_available:
+                logger.error(
+                    f"Instrument {figi} ({instrument.ticker}) is not tradable via API"
+                )
+            else:
+                valid.append(figi)
+        return valid
+
+
+instrument_registry = InstrumentRegistry("instruments.db")
@@ -6,8 +6,12 @@ class SQLiteClient:
         self.db_name = db_name
         self.conn = None
 
-    def connect(self):
-        self.conn = sqlite3.connect(self.db_name)
+    def connect(self, timeout: float = 5.0):
+        self.conn = sqlite3.connect(self.db_name, timeout=timeout)
+
+    def enable_wal(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
 
     def close(self):
         self.conn.close()
@@ -28,6 +32,12 @@ class SQLiteClient:
         self.conn.commit()
         return cursor.lastrowid
 
+    def execute_many(self, sql, seq_of_params):
+        cursor = self.conn.cursor()
+        cursor.executemany(sql, seq_of_params)
+        self.conn.commit()
+        return cursor.rowcount
+
     def execute_update(self, sql, params=None):
         if params is None:
             params = []
@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from db.sqlite_client import SQLiteClient
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 1000
+
+
+class WriteBehindWriter:
+    """
+    Отложенная запись в SQLite из отдельного потока. Запросы ставятся в очередь
+    и применяются пачками: подряд идущие одинаковые запросы выполняются через
+    executemany, вся пачка - в одной транзакции. База переводится в режим WAL,
+    чтобы чтение из других соединений не блокировалось записью.
+    """
+
+    def __init__(self, db_name: str, timeout: float = 5.0):
+        self.db_name = db_name
+        self.timeout = timeout  # ожидание блокировки базы другим процессом
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"write-behind-{db_name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, sql: str, params=None, need_result: bool = False) -> Optional[Future]:
+        """
+        Ставит запрос в очередь. При need_result возвращает Future с lastrowid.
+        """
+        future = Future() if need_result else None
+        self._queue.put((sql, params or [], future))
+        return future
+
+    def flush(self) -> None:
+        """
+        Блокирует до применения всех поставленных в очередь запросов.
+        """
+        self.submit("", need_result=True).result()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        db_client = SQLiteClient(self.db_name)
+        db_client.connect(timeout=self.timeout)
+        db_client.enable_wal()
+        stopped = False
+        while not stopped:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [item for item in batch if item is not None]
+            self._apply(db_client, batch)
+        db_client.close()
+
+    @staticmethod
+    def _group(batch: list) -> list:
+        """
+        Объединяет подряд идущие одинаковые запросы без Future в группы
+        (sql, список параметров, future) для executemany.
+        """
+        groups = []
+        for sql, params, future in batch:
+            if (
+                    future is None
+                    and groups
+                    and groups[-1][0] == sql
+                    and groups[-1][2] is None
+            ):
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params], future))
+        return groups
+
+    @staticmethod
+    def _execute(conn, sql: str, params: list, future: Optional[Future]):
+        if future is None:
+            conn.executemany(sql, params)
+            return None
+        cursor = conn.execute(sql, params[0]) if sql else None
+        return cursor.lastrowid if cursor else None
+
+    def _apply(self, db_client: SQLiteClient, batch: list):
+        conn = db_client.conn
+        groups = self._group(batch)
+        try:
+            with conn:
+                results = [self._execute(conn, *group) for group in groups]
+        except Exception as exc:
+            logger.error(f"Write-behind batch of {len(batch)} statements failed. {exc}")
+            # пачка откатилась целиком: запросы применяются заново по отдельности,
+            # чтобы отбросить только ошибочные
+            for group in groups:
+                self._apply_group(conn, group)
+            return
+        for (_, _, future), row_id in zip(groups, results):
+            if future is not None:
+                future.set_result(row_id)
+
+    def _apply_group(self, conn, group: tuple):
+        sql, params, future = group
+        try:
+            with conn:
+                row_id = self._execute(conn, *group)
+        except Exception as exc:
+            if len(params) > 1:
+                for item in params:
+                    self._apply_group(conn, (sql, [item], None))
+                return
+            logger.error(f"Write-behind statement dropped. {exc}. {sql} {params[0]}")
+            if future is not None:
+                future.set_exception(exc)
+            return
+        if future is not None:
+            future.set_result(row_id)
@@ -1,9 +1,22 @@
 import asyncio
 import logging
 
+from accounts import get_accounts
 from client import broker_client
+from db.instruments import instrument_registry
+from market_stream import MarketDataStream
 from robot import TradingRobot
-from settings import ETFs, stocks
+from stop_engine import stop_engine
+from supervisor import Supervisor
+from settings import (
+    RUN_MODE,
+    METRICS_PORT,
+    METRICS_DUMP_FILE,
+    METRICS_DUMP_INTERVAL,
+)
+from utils.metrics import serve_metrics
+from vector_engine import VectorEngine
+from warmup import WarmUp
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -11,10 +24,66 @@ logging.basicConfig(
 )
 
 
+async def run_robots():
+    await instrument_registry.refresh()
+    accounts = get_accounts()
+    figis = list({figi: None for account in accounts for figi in account.figis})
+    await instrument_registry.ensure(figis)
+    tradable = set(instrument_registry.validate(figis))
+    for account in accounts:
+        broker_client.register_account(account.account_id, account.sandbox)
+    if RUN_MODE == "supervisor":
+        if len(accounts) > 1:
+            raise ValueError("Supervisor mode supports a single account")
+        account = accounts[0]
+        await Supervisor(
+            [figi for figi in account.figis if figi in tradable], account
+        ).run()
+        return
+    if RUN_MODE == "vector":
+        await asyncio.gather(
+            *[
+                VectorEngine(
+                    [figi for figi in account.figis if figi in tradable],
+                    account.account_id,
+                    account.quantity_limit,
+                ).start()
+                for account in accounts
+            ]
+        )
+        return
+    robots = [
+        TradingRobot(figi, account.account_id, account.quantity_limit)
+        for account in accounts
+        for figi in account.figis
+        if figi in tradable
+    ]
+    warm_up = WarmUp(robots)
+    stop_task = asyncio.create_task(stop_engine.run())
+    try:
+        if RUN_MODE == "stream":
+            stream = MarketDataStream()
+            await asyncio.gather(
+                stream.run(),
+                warm_up.run(
+                    lambda robot, borders: robot.start_streaming(stream, borders)
+                ),
+            )
+        else:
+            await warm_up.run(lambda robot, borders: robot.start(borders))
+    finally:
+        stop_task.cancel()
+
+
 async def main_process():
     await broker_client.create()
-    # await asyncio.gather(*[TradingRobot(instrument).start() for instrument in ETFs])
-    await asyncio.gather(*[TradingRobot(instrument).start() for instrument in stocks])
+    metrics_task = asyncio.create_task(
+        serve_metrics(METRICS_PORT, METRICS_DUMP_FILE, METRICS_DUMP_INTERVAL)
+    )
+    try:
+        await run_robots()
+    finally:
+        metrics_task.cancel()
 
 
 if __name__ == "__main__":
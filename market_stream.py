@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import AsyncIterable, Awaitable, Callable, Optional
+
+from tinkoff.invest import (
+    Candle,
+    CandleInstrument,
+    LastPriceInstrument,
+    MarketDataRequest,
+    MarketDataResponse,
+    SubscribeCandlesRequest,
+    SubscribeLastPriceRequest,
+    SubscriptionAction,
+    SubscriptionInterval,
+)
+from tinkoff.invest.utils import now
+
+from client import broker_client, price_board, Quote
+from settings import STREAM_RECONNECT_DELAY
+from utils.journal import journal
+from utils.prices import quotation_to_nano
+from utils.quotation import quotation_to_float
+
+logger = logging.getLogger(__name__)
+
+StreamSource = Callable[
+    [AsyncIterable[MarketDataRequest]], AsyncIterable[MarketDataResponse]
+]
+
+MAX_RECONNECT_DELAY = 60
+
+
+class MarketDataStream:
+    """
+    Одно мультиплексированное соединение со стримом рыночных данных для всех
+    инструментов: последние цены и 1-минутные свечи. При обрыве соединения
+    переподключается и заново подписывается на все инструменты.
+    Источник стрима можно подменить (например, локальной заглушкой в тестах).
+    """
+
+    def __init__(self, source: Optional[StreamSource] = None):
+        self.source = source or broker_client.market_data_stream
+        self.figis: set[str] = set()
+        self._price_handlers: dict[str, list[Callable[[float], None]]] = {}
+        self._candle_handlers: dict[str, list[Callable[[Candle], None]]] = {}
+        self._reconnect_handlers: list[Callable[[], Awaitable[None]]] = []
+        self._pending: asyncio.Queue[str] = asyncio.Queue()
+
+    def subscribe(
+        self,
+        figi: str,
+        on_price: Optional[Callable[[float], None]] = None,
+        on_candle: Optional[Callable[[Candle], None]] = None,
+        on_reconnect: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Подписывает инструмент на стрим. Обработчики цен и свечей вызываются
+        синхронно в цикле чтения стрима и не должны блокировать его.
+        """
+        if on_price is not None:
+            self._price_handlers.setdefault(figi, []).append(on_price)
+        if on_candle is not None:
+            self._candle_handlers.setdefault(figi, []).append(on_candle)
+        if on_reconnect is not None:
+            self._reconnect_handlers.append(on_reconnect)
+        if figi not in self.figis:
+            self.figis.add(figi)
+            self._pending.put_nowait(figi)
+
+    async def _requests(self) -> AsyncIterable[MarketDataRequest]:
+        while True:
+            figis = [await self._pending.get()]
+            while not self._pending.empty():
+                figis.append(self._pending.get_nowait())
+            logger.debug(f"Subscribing {len(figis)} instruments to market data stream")
+            yield MarketDataRequest(
+                subscribe_candles_request=SubscribeCandlesRequest(
+                    subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                    instruments=[
+                        CandleInstrument(
+                            figi=figi,
+                            interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+                        )
+                        for figi in figis
+                    ],
+                )
+            )
+            yield MarketDataRequest(
+                subscribe_last_price_request=SubscribeLastPriceRequest(
+                    subscription_action=SubscriptionAction.SUBSCRIPTION_ACTION_SUBSCRIBE,
+                    instruments=[LastPriceInstrument(figi=figi) for figi in figis],
+                )
+            )
+
+    def _dispatch(self, response: MarketDataResponse) -> None:
+        if response.last_price:
+            last_price = response.last_price
+            price = quotation_to_float(last_price.price)
+            journal.prices([last_price.figi], [quotation_to_nano(last_price.price)])
+            price_board.quotes[last_price.figi] = Quote(
+                price=price, age=(now() - last_price.time).total_seconds()
+            )
+            for handler in self._price_handlers.get(last_price.figi, []):
+                handler(price)
+        elif response.candle:
+            for handler in self._candle_handlers.get(response.candle.figi, []):
+                handler(response.candle)
+
+    async def run(self) -> None:
+        """
+        Читает стрим, переподключаясь с экспоненциальной задержкой.
+        """
+        delay = STREAM_RECONNECT_DELAY
+        connected_before = False
+        while True:
+            # после переподключения подписываемся заново на все инструменты
+            self._pending = asyncio.Queue()
+            for figi in self.figis:
+                self._pending.put_nowait(figi)
+            try:
+                if connected_before:
+                    for handler in self._reconnect_handlers:
+                        asyncio.create_task(handler())
+                async for response in self.source(self._requests()):
+                    connected_before = True
+                    delay = STREAM_RECONNECT_DELAY
+                    self._dispatch(response)
+                logger.warning("Market data stream closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"Market data stream error. {exc}")
+            logger.info(f"Reconnecting to market data stream in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
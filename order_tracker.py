@@ -0,0 +1,239 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Coroutine, Optional
+
+from tinkoff.invest import (
+    AioRequestError,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderTrades,
+)
+from tinkoff.invest.utils import now
+
+from client import broker_client, portfolio_service
+from db.db_logger import DBLogger, Fill
+from db.instruments import instrument_registry
+from settings import DB_WRITE_BEHIND, ORDER_SWEEP_INTERVAL, STREAM_RECONNECT_DELAY
+from utils.quotation import quotation_to_float
+
+FINAL_ORDER_STATUSES = [
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+]
+MAX_RECONNECT_DELAY = 60
+# сколько ордеров со сделками, пришедшими до начала отслеживания, хранится
+MAX_PENDING_TRADES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedOrder:
+    def __init__(self, order_id: str):
+        self.order_id = order_id
+        self.lots_executed: int = 0
+        self.filled_at: Optional[datetime] = None
+
+
+class OrderTracker:
+    """
+    Отслеживает исполнение ордеров одного счета по стриму сделок и заносит
+    финальный статус и цену исполнения в базу данных. Периодический опрос
+    get_order_state остается только как сверка на случай пропущенных событий
+    (например, отмена ордера или песочница, где стрим сделок недоступен).
+    """
+
+    def __init__(self, account_id: str, db_logger: DBLogger):
+        self.account_id = account_id
+        self.db_logger = db_logger
+        self.sweep_interval: int = ORDER_SWEEP_INTERVAL
+        self._orders: dict[str, TrackedOrder] = {}
+        # сделки по ордерам, которые еще не начали отслеживаться: стрим может
+        # опередить ответ get_order_state в track()
+        self._pending_trades: dict[str, list[OrderTrades]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # ссылки на фоновые задачи, чтобы сборщик мусора не отменил их до завершения
+        self._tasks: set[asyncio.Task] = set()
+
+    def spawn(self, coroutine: Coroutine) -> None:
+        """
+        Запускает фоновую задачу трекера.
+        """
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def track_later(self, order_id: str) -> None:
+        """
+        Начинает отслеживать ордер в фоне, не задерживая отправившего его.
+        """
+        self.spawn(self.track(order_id))
+
+    async def track(self, order_id: str) -> None:
+        """
+        Заносит новый ордер в базу данных и начинает отслеживать его исполнение.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        try:
+            order_state = await broker_client.get_order_state(
+                account_id=self.account_id, order_id=order_id
+            )
+        except AioRequestError as err:
+            logger.error(f"Failed to get order state. order_id={order_id}. {err}")
+            return
+        order = TrackedOrder(order_id=order_id)
+        self.db_logger.add_order(
+            order_id=order_id,
+            account_id=self.account_id,
+            figi=order_state.figi,
+            order_direction=order_state.direction.name,
+            quantity=order_state.lots_requested,
+            status=order_state.execution_report_status.name,
+            created_at=order_state.order_date,
+        )
+        self._orders[order_id] = order
+        pending_trades = self._pending_trades.pop(order_id, [])
+        for order_trades in pending_trades:
+            self._add_trades(order, order_trades)
+        self._apply(order, order_state)
+        if pending_trades and order_id in self._orders:
+            # состояние могло быть запрошено до пришедших сделок
+            self.spawn(self.reconcile(order_id))
+
+    def _apply(self, order: TrackedOrder, order_state: OrderState) -> None:
+        if order_state.execution_report_status not in FINAL_ORDER_STATUSES:
+            return
+        del self._orders[order.order_id]
+        portfolio_service.invalidate(self.account_id)
+        self.db_logger.update_order_execution(
+            order_id=order.order_id,
+            status=order_state.execution_report_status.name,
+            price=quotation_to_float(order_state.executed_order_price),
+            lots_executed=order_state.lots_executed,
+            updated_at=now(),
+        )
+        self._add_fills(order, order_state)
+        logger.info(
+            f"Order {order.order_id} {order_state.figi} "
+            f"{order_state.execution_report_status.name}, "
+            f"executed {order_state.lots_executed} lots, filled at {order.filled_at}"
+        )
+
+    def _add_fills(self, order: TrackedOrder, order_state: OrderState) -> None:
+        """
+        Заносит в базу сделки по ордеру. Стадии исполнения есть и в песочнице,
+        где стрим сделок недоступен; время сделки берется из стрима, если оно
+        успело прийти, иначе - время выставления ордера.
+        """
+        instrument = instrument_registry.get(order_state.figi)
+        lot = instrument.lot if instrument is not None else 1
+        sign = 1 if order_state.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+        for stage in order_state.stages:
+            self.db_logger.add_fill(
+                Fill(
+                    trade_id=stage.trade_id,
+                    order_id=order.order_id,
+                    account_id=self.account_id,
+                    figi=order_state.figi,
+                    # количество в стадии исполнения - в лотах
+                    quantity=sign * stage.quantity * lot,
+                    price=quotation_to_float(stage.price),
+                    time=order.filled_at or order_state.order_date,
+                )
+            )
+
+    async def reconcile(self, order_id: str) -> None:
+        """
+        Запрашивает актуальное состояние ордера и фиксирует финальный статус.
+        """
+        try:
+            order_state = await broker_client.get_order_state(
+                account_id=self.account_id, order_id=order_id
+            )
+        except AioRequestError as err:
+            logger.error(f"Failed to get order state. order_id={order_id}. {err}")
+            return
+        order = self._orders.get(order_id)
+        if order is not None:
+            self._apply(order, order_state)
+
+    @staticmethod
+    def _add_trades(order: TrackedOrder, order_trades: OrderTrades) -> None:
+        for trade in order_trades.trades:
+            order.lots_executed += trade.quantity
+            order.filled_at = trade.date_time
+        logger.debug(
+            f"Order {order.order_id} executed {order.lots_executed} at {order.filled_at}"
+        )
+
+    def _on_trades(self, order_trades: OrderTrades) -> None:
+        order = self._orders.get(order_trades.order_id)
+        if order is None:
+            self._pending_trades.setdefault(order_trades.order_id, []).append(
+                order_trades
+            )
+            if len(self._pending_trades) > MAX_PENDING_TRADES:
+                # ордера, отправленные не роботом, никогда не начнут отслеживаться
+                del self._pending_trades[next(iter(self._pending_trades))]
+            return
+        self._add_trades(order, order_trades)
+        # статус и средняя цена исполнения приходят только в OrderState
+        self.spawn(self.reconcile(order.order_id))
+
+    async def _consume_trades(self) -> None:
+        delay = STREAM_RECONNECT_DELAY
+        while True:
+            try:
+                async for response in broker_client.trades_stream(
+                        accounts=[self.account_id]
+                ):
+                    delay = STREAM_RECONNECT_DELAY
+                    if response.order_trades:
+                        self._on_trades(response.order_trades)
+                logger.warning("Trades stream closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"Trades stream error. {exc}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            for order_id in list(self._orders):
+                await self.reconcile(order_id)
+
+    async def run(self) -> None:
+        tasks = [self._sweep()]
+        if not broker_client.is_sandbox(self.account_id):
+            tasks.append(self._consume_trades())
+        await asyncio.gather(*tasks)
+
+
+_order_trackers: dict[str, OrderTracker] = {}
+_db_logger: Optional[DBLogger] = None
+
+
+def get_order_tracker(account_id: str) -> OrderTracker:
+    """
+    Возвращает трекер ордеров счета, создавая его при первом обращении.
+    Журнал сделок общий для всех счетов.
+    """
+    global _db_logger
+    if account_id not in _order_trackers:
+        if _db_logger is None:
+            _db_logger = DBLogger("dblogger.db", write_behind=DB_WRITE_BEHIND)
+        _order_trackers[account_id] = OrderTracker(account_id, _db_logger)
+    return _order_trackers[account_id]
+
+
+def set_order_tracker(account_id: str, order_tracker) -> None:
+    """
+    Подменяет трекер ордеров счета, например, в рабочем процессе супервизора,
+    где ордера отслеживает процесс-владелец счета.
+    """
+    _order_trackers[account_id] = order_tracker
@@ -1,10 +1,11 @@
 import asyncio
 import logging
+from typing import Optional
 from uuid import uuid4
 
 from tinkoff.invest import (
     AioRequestError,
-    OrderExecutionReportStatus,
+    Candle,
 )
 from tinkoff.invest.grpc.orders_pb2 import (
     ORDER_DIRECTION_SELL,
@@ -12,19 +13,20 @@ from tinkoff.invest.grpc.orders_pb2 import (
     ORDER_TYPE_MARKET,
 )
 
-from client import broker_client
-from db.db_logger import DBLogger
+from client import QuoteUnavailable, broker_client, portfolio_service, price_board
+from db.instruments import instrument_registry
+from market_stream import MarketDataStream
+from order_tracker import get_order_tracker
 from settings import ACCOUNT_ID, CHECK_INTERVAL, QUATITY_LIMIT
 
-from strategies.MomentumStrategy import MomentumStrategy
+from stop_engine import stop_engine
+from strategies import get_strategy
 from telegram.telegram_service import telegram_bot
+from trading_calendar import Session, trading_calendar
+from utils.journal import journal
+from utils.metrics import metrics
 from utils.quotation import quotation_to_float
 
-FINAL_ORDER_STATUSES = [
-    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
-    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
-    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
-]
 logger = logging.getLogger(__name__)
 
 
@@ -33,18 +35,50 @@ class TradingRobot:
     Торговый робот. Получает данные из стратегии и совершает сделки.
     """
 
-    def __init__(self, figi: str):
+    def __init__(
+        self,
+        figi: str,
+        account_id: str = ACCOUNT_ID,
+        quantity_limit: int = QUATITY_LIMIT,
+    ):
         self.figi = figi
-        self.account_id = ACCOUNT_ID
-        self.strategy = MomentumStrategy(figi)
+        self.account_id = account_id
+        # стратегия и рыночные данные инструмента общие для роботов всех счетов
+        self.strategy = get_strategy(figi)
         self.check_interval: int = CHECK_INTERVAL
-        self.quantity_limit: int = QUATITY_LIMIT
-        self.db_logger = DBLogger("dblogger.db")
+        self.quantity_limit: int = quantity_limit
+        self.order_tracker = get_order_tracker(self.account_id)
+        price_board.register(figi)
+        stop_engine.register(account_id, figi)
+        journal.robot(
+            account_id, figi, quantity_limit, instrument_registry.get(figi)
+        )
+        self._borders: Optional[list] = None
+        self.last_price: Optional[float] = None
+        self._evaluation: Optional[asyncio.Task] = None
+        # сессия, в которой торговый статус инструмента уже проверен
+        self._checked_session: Optional[Session] = None
+
+    @property
+    def borders(self) -> Optional[list]:
+        return self._borders
+
+    @borders.setter
+    def borders(self, borders: Optional[list]) -> None:
+        # уровни стоп-лоссов пересчитываются при изменении границ
+        self._borders = borders
+        stop_engine.update_borders(self.figi, borders)
 
     async def waiting_market_open(self):
         """
-        Проверяет открыт ли рынок и доступен ли для торговли текущий инструмент.
+        Ждет начала торговой сессии по расписанию площадки и проверяет, доступен ли
+        для торговли текущий инструмент. Торговый статус запрашивается только
+        в начале сессии, после ошибки отправки ордера или если расписание
+        площадки неизвестно.
         """
+        session = await trading_calendar.wait_session(self.figi)
+        if session is not None and session == self._checked_session:
+            return
         trading_status = await broker_client.get_trading_status(figi=self.figi)
         while not (
                 trading_status.market_order_available_flag
@@ -53,23 +87,23 @@ class TradingRobot:
             logger.debug(f"Waiting for the market to open. figi={self.figi}")
             await asyncio.sleep(60)
             trading_status = await broker_client.get_trading_status(figi=self.figi)
+        self._checked_session = session
 
     async def get_last_price(self) -> float:
         """
         Возвращает цену закрытия последней свечи инструмента
         """
-        response = await broker_client.get_last_prices(figi=[self.figi])
-        last_prices = response.last_prices
-        return quotation_to_float(last_prices.pop().price)
+        quote = await price_board.get_quote(self.figi)
+        logger.debug(f"{self.figi} Last price age: {quote.age:.1f}s")
+        return quote.price
 
     async def get_position_lots(self) -> int:
         """
         Возвращает размер позици
         """
-        portfolio = await broker_client.get_portfolio(account_id=self.account_id)
-        for position in portfolio.positions:
-            if position.figi == self.figi:
-                return int(quotation_to_float(position.quantity_lots))
+        position = await portfolio_service.get_position(self.account_id, self.figi)
+        if position is not None:
+            return int(quotation_to_float(position.quantity_lots))
 
     async def place_sell_order(self, last_price: float) -> None:
         """
@@ -89,22 +123,21 @@ class TradingRobot:
                     order_type=ORDER_TYPE_MARKET,
                     account_id=self.account_id,
                 )
-                print(posted_order)
                 logger.debug(
                     f"Selling {position_lots} lots of {self.figi}. Last price={last_price}"
                 )
+                logger.debug(f"{self.figi} Posted order: {posted_order}")
             except Exception as exc:
                 logger.error(f"Failed to post sell order. figi={self.figi}. {exc}")
+                self._checked_session = None
                 return
+            metrics.inc("orders_total", reason="sell")
+            portfolio_service.invalidate(self.account_id)
             telegram_bot.post(
                 f"Sell {position_lots} lots of {self.figi}. Last price={last_price}"
             )
 
-            asyncio.create_task(
-                self.logging_to_db(
-                    order_id=posted_order.order_id, account_id=self.account_id
-                )
-            )
+            self.order_tracker.track_later(posted_order.order_id)
 
     async def place_buy_order(self, last_price: float) -> None:
         """
@@ -135,123 +168,141 @@ class TradingRobot:
                 )
             except Exception as exc:
                 logger.error(f"Failed to post buy order figi = {self.figi}. {exc}")
+                self._checked_session = None
                 return
+            metrics.inc("orders_total", reason="buy")
+            portfolio_service.invalidate(self.account_id)
             telegram_bot.post(
                 f"Buy {buy_lots} lots of {self.figi}. Last price = {last_price}"
             )
 
-            order_state = await broker_client.get_order_state(
-                account_id=ACCOUNT_ID, order_id=posted_order.order_id
-            )
-            print(order_state)
+            self.order_tracker.track_later(posted_order.order_id)
 
-            asyncio.create_task(
-                self.logging_to_db(
-                    order_id=posted_order.order_id, account_id=self.account_id
-                )
-            )
+    async def has_active_orders(self) -> bool:
+        """
+        Проверяет, есть ли по инструменту неисполненные ордера.
+        """
+        orders = await broker_client.get_orders(account_id=self.account_id)
+        return any(order.figi == self.figi for order in orders.orders)
 
-    async def logging_to_db(self, account_id: str, order_id: str) -> None:
+    async def trade(self, last_price: float, borders: list) -> None:
         """
-        Заносит информацию в базу данных или обновляет
+        Проверяет пересечение границ диапазона последней ценой. Стоп-лосс
+        проверяет stop_engine при получении цены, не дожидаясь решения робота.
         """
-        try:
-            order_state = await broker_client.get_order_state(
-                account_id=account_id, order_id=order_id
+        # отправляем SELL ордер, если последняя цена выше верхней границы диапазона
+        if last_price >= borders[1]:
+            logger.debug(
+                f"{self.figi} Last price {last_price} is higher than top border {borders[1]}"
             )
-        except AioRequestError:
-            return
-        self.db_logger.add_order(
-            # order_id=order_id,
-            order_id=str(uuid4().time_low),
-            figi=order_state.figi,
-            order_direction=str(order_state.direction),
-            price=quotation_to_float(order_state.total_order_amount),
-            quantity=order_state.lots_requested,
-            status=str(order_state.execution_report_status),
-        )
-        while order_state.execution_report_status not in FINAL_ORDER_STATUSES:
-            await asyncio.sleep(10)
-            order_state = await broker_client.get_order_state(
-                account_id=account_id, order_id=order_id
+            await self.place_sell_order(last_price=last_price)
+        # отправляем BUY ордер, если последняя цена ниже нижней границы диапазона
+        elif last_price <= borders[0]:
+            logger.debug(
+                f"{self.figi} Last price {last_price} is lower than bottom border {borders[0]}"
             )
-        self.db_logger.update_order_status(
-            order_id=order_id, status=str(order_state.execution_report_status)
-        )
+            await self.place_buy_order(last_price=last_price)
 
-    async def stop_loss(self, last_price: float, borders: list) -> None:
+    async def cycle(self, borders: Optional[list] = None) -> None:
         """
-        Отправляет SELL ордер, если достигнут стоп-лосс по текущей позиции.
+        Один торговый цикл: проверка статуса инструмента, пересчет границ,
+        проверка активных ордеров и торговое решение по последней цене.
+        Переданные границы (например, рассчитанные при прогреве) используются
+        без пересчета.
         """
-        portfolio = await broker_client.get_portfolio(account_id=self.account_id)
-        for position in portfolio.positions:
-            if position.figi == self.figi:
-                average_position_price = quotation_to_float(
-                    position.average_position_price
-                )
-                stop_loss_size = (borders[1] - borders[0]) * 0.3
-                stop_loss_price = average_position_price - stop_loss_size
-                logger.debug(f"{self.figi} Stop loss price = {stop_loss_price}")
-                if stop_loss_price > last_price:
-                    logger.debug(
-                        f"{self.figi} Stop loss triggered. Last price = {last_price}"
-                    )
-                    position_quantity = int(quotation_to_float(position.quantity_lots))
-                    telegram_bot.post(
-                        f"{self.figi} Stop loss triggered. Last price = {last_price}"
-                    )
-                    try:
-                        posted_order = await broker_client.post_order(
-                            order_id=str(uuid4().time),
-                            figi=self.figi,
-                            direction=ORDER_DIRECTION_SELL,
-                            quantity=position_quantity,
-                            order_type=ORDER_TYPE_MARKET,
-                            account_id=self.account_id,
-                        )
-                    except Exception as exc:
-                        logger.error(f"{self.figi} Failed to post sell order. {exc}")
-                        return
-                    asyncio.create_task(
-                        self.logging_to_db(
-                            order_id=posted_order.order_id, account_id=self.account_id
-                        )
-                    )
+        with metrics.timer("robot_stage_seconds", stage="trading_status"):
+            await self.waiting_market_open()
+        if borders is None:
+            with metrics.timer("robot_stage_seconds", stage="borders"):
+                borders = await self.strategy.calculate_borders()
+        if borders is None:
+            logger.debug(f"{self.figi} No candles to calculate borders. Waiting")
+            return
+        self.borders = borders
+        with metrics.timer("robot_stage_seconds", stage="portfolio"):
+            position_lots = await self.get_position_lots()
+        with metrics.timer("robot_stage_seconds", stage="orders"):
+            active_orders = await self.has_active_orders()
+        if active_orders:
+            logger.info(
+                f"Order in progress ({self.figi}, lots = {position_lots}). Waiting"
+            )
+            return
+
+        with metrics.timer("robot_stage_seconds", stage="last_price"):
+            last_price = await self.get_last_price()
+        logger.debug(f"{self.figi} Last price: {last_price}")
+        stop_engine.on_price(self.figi, last_price)
+        borders = self.strategy.on_tick(last_price) or borders
+        self.borders = borders
+
+        with metrics.timer("robot_stage_seconds", stage="trade"):
+            await self.trade(last_price, borders)
 
-    async def start(self):
+    async def start(self, borders: Optional[list] = None):
         while True:
             try:
-                await self.waiting_market_open()
-                borders = await self.strategy.calculate_borders()
-                position_lots = await self.get_position_lots()
-                orders = await broker_client.get_orders(account_id=self.account_id)
-                for order in orders.orders:
-                    if order.figi == self.figi:
-                        logger.info(
-                            f"Order in progress ({self.figi}, lots = {position_lots}). Waiting"
-                        )
-                        await asyncio.sleep(self.check_interval)
-                        continue
+                with metrics.timer("robot_cycle_seconds"):
+                    await self.cycle(borders)
+            except (AioRequestError, QuoteUnavailable) as err:
+                metrics.inc("errors_total", source="cycle")
+                logger.error(f"Client error {err}")
 
-                last_price = await self.get_last_price()
-                logger.debug(f"{self.figi} Last price: {last_price}")
+            borders = None
+            await asyncio.sleep(self.check_interval)
+
+    async def start_streaming(
+        self, stream: MarketDataStream, borders: Optional[list] = None
+    ):
+        """
+        Событийный режим: границы обновляются по 1-минутным свечам из стрима,
+        а пересечение границ проверяется на каждой новой последней цене.
+        """
+        stream.subscribe(
+            self.figi,
+            on_price=self.on_last_price,
+            on_candle=self.on_candle,
+            on_reconnect=self.on_reconnect,
+        )
+        await self.waiting_market_open()
+        if borders is None:
+            await self.on_reconnect()
+        else:
+            self.borders = borders
 
-                await self.stop_loss(last_price, borders)
+    async def on_reconnect(self) -> None:
+        """
+        Докачивает свечи, пропущенные за время отсутствия соединения.
+        """
+        try:
+            self.borders = await self.strategy.calculate_borders(force=True)
+        except AioRequestError as err:
+            metrics.inc("errors_total", source="reconnect")
+            logger.error(f"Client error {err}")
 
-                # отправляем SELL ордер, если последняя цена выше верхней границы диапазона
-                if last_price >= borders[1]:
-                    logger.debug(
-                        f"{self.figi} Last price {last_price} is higher than top border {borders[1]}"
-                    )
-                    await self.place_sell_order(last_price=last_price)
-                # отправляем BUY ордер, если последняя цена ниже нижней границы диапазона
-                elif last_price <= borders[0]:
-                    logger.debug(
-                        f"{self.figi} Last price {last_price} is lower than bottom border {borders[0]}"
-                    )
-                    await self.place_buy_order(last_price=last_price)
+    def on_candle(self, candle: Candle) -> None:
+        self.borders = self.strategy.on_candle(candle)
 
-            except AioRequestError as err:
-                logger.error(f"Client error {err}")
+    def on_last_price(self, price: float) -> None:
+        self.last_price = price
+        stop_engine.on_price(self.figi, price)
+        self.borders = self.strategy.on_tick(price) or self.borders
+        if self._evaluation is None or self._evaluation.done():
+            self._evaluation = asyncio.create_task(self.evaluate())
 
-            await asyncio.sleep(self.check_interval)
+    async def evaluate(self) -> None:
+        """
+        Принимает торговое решение по последней полученной из стрима цене.
+        """
+        if self.borders is None:
+            return
+        last_price = self.last_price
+        try:
+            if last_price >= self.borders[1] or last_price <= self.borders[0]:
+                if await self.has_active_orders():
+                    logger.info(f"Order in progress ({self.figi}). Waiting")
+                    return
+            await self.trade(last_price, self.borders)
+        except AioRequestError as err:
+            metrics.inc("errors_total", source="evaluate")
+            logger.error(f"Client error {err}")
@@ -10,6 +10,11 @@ SANDBOX = True
 # телеграм
 BOT_TOKEN = ""
 CHAT_ID = ""
+# размер очереди уведомлений, окно объединения сообщений в дайджест в секундах
+# и файл для сообщений, не поместившихся в очередь (None - отбрасывать)
+TELEGRAM_QUEUE_SIZE = 1000
+TELEGRAM_DIGEST_WINDOW = 2
+TELEGRAM_SPILL_FILE = "telegram_spill.log"
 
 # набор ETF Тинкофф без комиссии
 ETFs = ["BBG333333333", "BBG000000001", "TCS00A1039N1"]
@@ -17,11 +22,116 @@ ETFs = ["BBG333333333", "BBG000000001", "TCS00A1039N1"]
 # набор акций
 STOCKS = ["BBG000K3STR7", "BBG001M2SC01", "BBG0014PFYM2"]
 
+# режим работы: "polling" - опрос раз в CHECK_INTERVAL, "stream" - стрим рыночных данных,
+# "vector" - один векторизованный цикл решений по всем инструментам,
+# "supervisor" - роботы в нескольких рабочих процессах
+RUN_MODE = "polling"
+
 # размер позиции в лотах
 QUATITY_LIMIT = 2
 
+# счета, торгуемые одним процессом через общее соединение и общие рыночные данные:
+# id счета -> инструменты, контур (по умолчанию SANDBOX) и размер позиции
+# (по умолчанию QUATITY_LIMIT). Пустой словарь - один счет ACCOUNT_ID
+# с инструментами STOCKS. Режим "supervisor" поддерживает только один счет.
+# ACCOUNTS = {
+#     "sandbox-account-id": {"figis": ["BBG000K3STR7"], "sandbox": True},
+#     "live-account-id": {"figis": ["BBG001M2SC01"], "sandbox": False, "quantity_limit": 1},
+# }
+ACCOUNTS = {}
+
+# размер стоп-лосса в долях ширины диапазона
+STOP_LOSS_RATIO = 0.3
+
+# интервал проверки стоп-лоссов по последним ценам и интервал обновления
+# позиций для расчета уровней стоп-лоссов в секундах
+STOP_CHECK_INTERVAL = 1
+STOP_POSITIONS_INTERVAL = 10
+
 # временной интервал пересчета границ диапазона в секундах
 CHECK_INTERVAL = 60
 
+# границы инструмента, рассчитанные не раньше BORDERS_TTL секунд назад, роботы
+# других счетов используют без повторной загрузки свечей
+BORDERS_TTL = CHECK_INTERVAL
+
 # временное окно исторических данных
 DAYS_BACK = 10
+
+# стратегия по умолчанию: "momentum", "bollinger", "keltner" или "donchian"
+STRATEGY = "momentum"
+# стратегии отдельных инструментов, например {"BBG000000001": "bollinger"}
+STRATEGIES = {}
+
+# число роботов, одновременно загружающих исторические свечи при запуске
+WARMUP_CONCURRENCY = 5
+
+# файл снимка границ диапазона для быстрого запуска (None - не сохранять),
+# интервал сохранения и максимальный возраст используемого снимка в секундах
+BORDERS_SNAPSHOT_FILE = "borders_snapshot.json"
+BORDERS_SNAPSHOT_INTERVAL = 60
+BORDERS_SNAPSHOT_MAX_AGE = 600
+
+# время жизни общего снимка портфеля в секундах
+PORTFOLIO_TTL = 5
+
+# окно объединения запросов последних цен в один батч в секундах
+PRICE_BATCH_WINDOW = 0.05
+
+# интервал полной загрузки справочника инструментов в секундах
+INSTRUMENTS_REFRESH_INTERVAL = 86400
+
+# горизонт загрузки расписания торгов в днях и минимальная пауза
+# перед повторной проверкой расписания в секундах
+CALENDAR_DAYS_AHEAD = 7
+CALENDAR_RETRY_DELAY = 1
+
+# каталог для файлов свечей, отображенных в память (None - держать свечи в куче)
+CANDLE_MMAP_DIR = None
+
+# начальная задержка переподключения к стриму рыночных данных в секундах
+STREAM_RECONNECT_DELAY = 1
+
+# интервал сверки состояния неисполненных ордеров в секундах
+ORDER_SWEEP_INTERVAL = 60
+
+# отложенная запись журнала ордеров и свечей в базу данных из отдельного потока
+DB_WRITE_BEHIND = True
+
+# ожидание освобождения базы SQLite, занятой другим процессом, в секундах
+SQLITE_BUSY_TIMEOUT = 30
+
+# каталог журнала событий для воспроизведения сессии (None - не вести журнал)
+# и размер буфера записи журнала в байтах
+JOURNAL_DIR = "journal"
+JOURNAL_BUFFER_SIZE = 1 << 20
+
+# порт HTTP-эндпоинта метрик /metrics на localhost (None - не запускать;
+# 9100 занят node_exporter), файл и интервал периодической выгрузки метрик
+# (None - не выгружать)
+METRICS_PORT = 9746
+METRICS_DUMP_FILE = None
+METRICS_DUMP_INTERVAL = 60
+
+# лимиты запросов в минуту по группам методов API, размер очереди ожидания
+# в каждой группе и число повторов запроса после RESOURCE_EXHAUSTED
+RATE_LIMITS = {
+    "market_data": 600,
+    "candles": 300,
+    "orders": 100,
+    "operations": 200,
+    "users": 100,
+    "instruments": 200,
+    "sandbox": 200,
+}
+RATE_LIMIT_QUEUE_SIZE = 1000
+RATE_LIMIT_RETRIES = 3
+
+# интервал обновления торгового статуса инструментов в режиме "vector" в секундах
+TRADING_STATUS_INTERVAL = 300
+
+# число рабочих процессов в режиме "supervisor", интервал публикации цен и позиций
+# в табло в разделяемой памяти и интервал проверки рабочих процессов в секундах
+SUPERVISOR_WORKERS = os.cpu_count() or 1
+BOARD_REFRESH_INTERVAL = 1
+WORKER_RESTART_DELAY = 5
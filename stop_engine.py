@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from operator import attrgetter
+from typing import NamedTuple, Optional
+from uuid import uuid4
+
+from sortedcontainers import SortedKeyList
+from tinkoff.invest import OrderExecutionReportStatus
+from tinkoff.invest.grpc.orders_pb2 import ORDER_DIRECTION_SELL, ORDER_TYPE_MARKET
+from tinkoff.invest.utils import now
+
+from client import broker_client, portfolio_service, price_board
+from order_tracker import get_order_tracker
+from settings import STOP_CHECK_INTERVAL, STOP_LOSS_RATIO, STOP_POSITIONS_INTERVAL
+from telegram.telegram_service import telegram_bot
+from trading_calendar import trading_calendar
+from utils.metrics import metrics
+from utils.quotation import quotation_to_float
+from utils.rate_limiter import Priority
+
+UNFILLED_ORDER_STATUSES = [
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+]
+
+logger = logging.getLogger(__name__)
+
+
+class Stop(NamedTuple):
+    level: float  # стоп-лосс срабатывает при цене ниже уровня
+    account_id: str
+    lots: int
+
+
+class StopEngine:
+    """
+    Стоп-лоссы открытых позиций всех роботов процесса. Уровни стопов инструмента
+    хранятся в отсортированном списке, поэтому новая цена проверяется за O(log n),
+    а уровень пересчитывается только при изменении границ канала или позиции.
+    Цены приходят из стрима и торгового цикла роботов, а по инструментам,
+    для которых цены давно не было, запрашиваются раз в check_interval секунд.
+    Ордер на выход из позиции отправляется сразу при пересечении уровня,
+    а если он не исполнен, стоп восстанавливается при обновлении позиций.
+    """
+
+    def __init__(self, check_interval: float, positions_interval: float):
+        self.check_interval = check_interval
+        self.positions_interval = positions_interval
+        # в рабочих процессах супервизора цены и позиции читаются из табло
+        self.price_board = price_board
+        self.portfolio_service = portfolio_service
+        self.accounts: dict[str, set[str]] = {}  # счета роботов инструмента
+        self.borders: dict[str, list] = {}
+        # число лотов и средняя цена позиции по (счет, figi)
+        self.positions: dict[tuple[str, str], tuple[int, float]] = {}
+        self._stops: dict[tuple[str, str], Stop] = {}
+        self._levels: dict[str, SortedKeyList] = {}
+        self._checked: dict[str, float] = {}  # время последней проверки цены
+        # позиции, из которых отправлен выход по стопу: пока снимок портфеля
+        # не изменился, стоп по ним не восстанавливается
+        self._exits: dict[tuple[str, str], Optional[tuple[int, float]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._positions_updated = 0.0
+
+    def register(self, account_id: str, figi: str) -> None:
+        self.accounts.setdefault(figi, set()).add(account_id)
+        self._levels.setdefault(figi, SortedKeyList(key=attrgetter("level")))
+
+    def update_borders(self, figi: str, borders: Optional[list]) -> None:
+        if borders is None or borders == self.borders.get(figi):
+            return
+        self.borders[figi] = list(borders)
+        for account_id in self.accounts.get(figi, ()):
+            self._update_stop(account_id, figi)
+
+    def update_position(
+        self, account_id: str, figi: str, lots: int, average_price: float
+    ) -> None:
+        if self.positions.get((account_id, figi)) == (lots, average_price):
+            return
+        if (account_id, figi) in self._exits:
+            if self._exits[(account_id, figi)] == (lots, average_price):
+                return
+            del self._exits[(account_id, figi)]
+        self.positions[(account_id, figi)] = (lots, average_price)
+        self._update_stop(account_id, figi)
+
+    def _update_stop(self, account_id: str, figi: str) -> None:
+        stop = self._stops.pop((account_id, figi), None)
+        if stop is not None:
+            self._levels[figi].remove(stop)
+        borders = self.borders.get(figi)
+        lots, average_price = self.positions.get((account_id, figi), (0, 0.0))
+        if borders is None or lots <= 0:
+            return
+        stop_loss_size = (borders[1] - borders[0]) * STOP_LOSS_RATIO
+        stop = Stop(average_price - stop_loss_size, account_id, lots)
+        self._stops[(account_id, figi)] = stop
+        self._levels[figi].add(stop)
+        logger.debug(f"{figi} Stop loss price = {stop.level} ({account_id})")
+
+    def on_price(self, figi: str, price: float) -> None:
+        """
+        Отправляет ордера на выход из позиций инструмента, уровень стоп-лосса
+        которых выше цены. Вне торговой сессии стопы не срабатывают.
+        """
+        self._checked[figi] = time.monotonic()
+        levels = self._levels.get(figi)
+        if not levels or levels[-1].level <= price:
+            return
+        current = now()
+        session = trading_calendar.session(figi, current)
+        if session is not None and session.start > current:
+            return
+        index = levels.bisect_key_right(price)
+        triggered = list(levels.islice(index))
+        del levels[index:]
+        for stop in triggered:
+            key = (stop.account_id, figi)
+            del self._stops[key]
+            self._exits[key] = self.positions.pop(key, None)
+            task = asyncio.create_task(self.exit(figi, stop, price))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def exit(self, figi: str, stop: Stop, last_price: float) -> None:
+        logger.debug(f"{figi} Stop loss triggered. Last price = {last_price}")
+        telegram_bot.post(f"{figi} Stop loss triggered. Last price = {last_price}")
+        try:
+            posted_order = await broker_client.post_order(
+                priority=Priority.STOP_LOSS,
+                order_id=str(uuid4().time),
+                figi=figi,
+                direction=ORDER_DIRECTION_SELL,
+                quantity=stop.lots,
+                order_type=ORDER_TYPE_MARKET,
+                account_id=stop.account_id,
+            )
+        except Exception as exc:
+            logger.error(f"{figi} Failed to post sell order. {exc}")
+            # стоп восстановится при следующем обновлении позиций
+            self._exits.pop((stop.account_id, figi), None)
+            return
+        if posted_order.execution_report_status in UNFILLED_ORDER_STATUSES:
+            logger.error(
+                f"{figi} Sell order {posted_order.execution_report_status.name}"
+            )
+            self._exits.pop((stop.account_id, figi), None)
+            return
+        metrics.inc("orders_total", reason="stop_loss")
+        self.portfolio_service.invalidate(stop.account_id)
+        get_order_tracker(stop.account_id).track_later(posted_order.order_id)
+
+    async def refresh_positions(self) -> None:
+        keys = [
+            (account_id, figi)
+            for figi, accounts in self.accounts.items()
+            for account_id in accounts
+        ]
+        positions = await asyncio.gather(
+            *[
+                self.portfolio_service.get_position(account_id, figi)
+                for account_id, figi in keys
+            ]
+        )
+        for (account_id, figi), position in zip(keys, positions):
+            if position is None:
+                self.update_position(account_id, figi, 0, 0.0)
+                continue
+            self.update_position(
+                account_id,
+                figi,
+                int(quotation_to_float(position.quantity_lots)),
+                quotation_to_float(position.average_position_price),
+            )
+        self._positions_updated = time.monotonic()
+
+    async def check_prices(self) -> None:
+        """
+        Запрашивает цены инструментов со стопами, цены которых не проверялись
+        дольше check_interval секунд.
+        """
+        stale = [
+            figi
+            for figi, levels in self._levels.items()
+            if levels
+            and time.monotonic() - self._checked.get(figi, 0.0) >= self.check_interval
+        ]
+        if not stale:
+            return
+        quotes = await asyncio.gather(
+            *[self.price_board.get_quote(figi) for figi in stale]
+        )
+        for figi, quote in zip(stale, quotes):
+            self.on_price(figi, quote.price)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._positions_updated >= self.positions_interval:
+                    await self.refresh_positions()
+                await self.check_prices()
+            except Exception as exc:
+                # проверка стопов не должна останавливаться из-за одной ошибки
+                metrics.inc("errors_total", source="stop_engine")
+                logger.error(f"Stop engine error. {exc}")
+            await asyncio.sleep(self.check_interval)
+
+
+stop_engine = StopEngine(STOP_CHECK_INTERVAL, STOP_POSITIONS_INTERVAL)
@@ -0,0 +1,20 @@
+from strategies.base import Strategy
+from utils.indicators import BollingerBands
+
+
+class BollingerStrategy(Strategy):
+    """
+    Торговля от полос Боллинджера по ценам закрытия 1-минутных свечей.
+    """
+
+    name = "bollinger"
+
+    def __init__(self, figi: str):
+        super().__init__(figi)
+        self.period: int = 600  # примерно торговый день 1-минутных свечей
+        self.width: float = 2.0  # ширина полос в стандартных отклонениях
+        self.bands = self.indicators.get(BollingerBands, self.period, self.width)
+
+    def get_borders(self) -> list:
+        lower, _, upper = self.bands.value
+        return self.channel(lower, upper)
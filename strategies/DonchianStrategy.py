@@ -0,0 +1,23 @@
+from strategies.base import Strategy
+from utils.indicators import RollingMax, RollingMin
+
+
+class DonchianStrategy(Strategy):
+    """
+    Торговля от канала Дончиана: минимум и максимум цен за period свечей,
+    суженный на долю margin ширины канала с каждой стороны.
+    """
+
+    name = "donchian"
+
+    def __init__(self, figi: str):
+        super().__init__(figi)
+        self.period: int = 600  # примерно торговый день 1-минутных свечей
+        self.margin: float = 0.1
+        self.low = self.indicators.get(RollingMin, self.period)
+        self.high = self.indicators.get(RollingMax, self.period)
+
+    def get_borders(self) -> list:
+        low, high = self.low.value, self.high.value
+        margin = (high - low) * self.margin
+        return self.channel(low + margin, high - margin)
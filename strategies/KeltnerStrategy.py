@@ -0,0 +1,23 @@
+from strategies.base import Strategy
+from utils.indicators import ATR, EMA
+
+
+class KeltnerStrategy(Strategy):
+    """
+    Торговля от канала Кельтнера: экспоненциальное среднее цен закрытия
+    плюс-минус несколько средних истинных диапазонов.
+    """
+
+    name = "keltner"
+
+    def __init__(self, figi: str):
+        super().__init__(figi)
+        self.period: int = 600  # примерно торговый день 1-минутных свечей
+        self.multiplier: float = 5.0  # ширина канала в ATR 1-минутных свечей
+        self.ema = self.indicators.get(EMA, self.period)
+        self.atr = self.indicators.get(ATR, self.period)
+
+    def get_borders(self) -> list:
+        middle = self.ema.value
+        width = self.multiplier * self.atr.value
+        return self.channel(middle - width, middle + width)
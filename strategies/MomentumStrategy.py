@@ -1,61 +1,44 @@
 import logging
-from datetime import timedelta
 
-import numpy as np
-from tinkoff.invest import HistoricCandle, CandleInterval
-from tinkoff.invest.utils import now
-
-from settings import DAYS_BACK
-from client import broker_client
-from utils.quotation import quotation_to_float
+from strategies.base import Strategy
+from utils.candle_array import CandleArray
+from utils.rolling_percentile import RollingPercentile
 
 logger = logging.getLogger(__name__)
 
 
-class MomentumStrategy:
+class MomentumStrategy(Strategy):
     """
     Логика стратегии заключается на торговле от границ диапазона, расчитанного
     на основе экстремумов цен в заданном временном окне.
 
     """
 
+    name = "momentum"
+
     def __init__(self, figi: str):
-        self.figi = figi
-        self.days_back: int = DAYS_BACK
+        super().__init__(figi)
         self.interval_size: float = 0.8  # статистическая величина для расчета процентиля
+        self.window = RollingPercentile()
+
+    def update(self, time, open, high, low, close, volume) -> None:
+        self.window.update(time, close)
 
-    async def get_historical_data(self) -> list[HistoricCandle]:
+    def feed(self, candles: CandleArray) -> None:
         """
-        Получает исторические данные для инструмента и возвращает список 1-минутных
-        свечей с DAYS_BACK дней назад по настоящее время.
+        Добавляет в скользящее окно только новые свечи (и обновленную последнюю)
+        и удаляет из него свечи, вышедшие за пределы временного окна.
         """
-        candles = []
-        logger.debug(
-            f"Start getting {self.figi} historical data for last {self.days_back} days"
-        )
-        async for candle in broker_client.get_all_candles(
-                figi=self.figi,
-                from_=now() - timedelta(days=self.days_back),
-                to=now(),
-                interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
-        ):
-            candles.append(candle)
-        logger.debug(f"Found {len(candles)} candles {self.figi}")
-        return candles
-
-    async def calculate_borders(self) -> list | None:
+        super().feed(candles)
+        self.window.expire(int(candles.times[0]))
+
+    def get_borders(self) -> list:
         """
-        Вычисляет новые границы диапазона на основе полученных исторических данных.
+        Возвращает границы диапазона по текущему скользящему окну.
+        Окно хранит цены в нано-единицах.
         """
-        candles = await self.get_historical_data()
-        if len(candles) == 0:
-            return
-        values = []
-        for candle in candles:
-            values.append(quotation_to_float(candle.close))
         lower_percentile = (1 - self.interval_size) / 2 * 100
-        borders = list(
-            np.percentile(values, [lower_percentile, 100 - lower_percentile])
+        return self.channel(
+            self.window.percentile(lower_percentile),
+            self.window.percentile(100 - lower_percentile),
         )
-        logger.info(f"Channel borders: {borders}")
-        return borders
@@ -0,0 +1,38 @@
+from settings import STRATEGIES, STRATEGY
+from strategies.base import Strategy
+from strategies.BollingerStrategy import BollingerStrategy
+from strategies.DonchianStrategy import DonchianStrategy
+from strategies.KeltnerStrategy import KeltnerStrategy
+from strategies.MomentumStrategy import MomentumStrategy
+
+STRATEGY_CLASSES: dict[str, type[Strategy]] = {
+    strategy.name: strategy
+    for strategy in (
+        MomentumStrategy,
+        BollingerStrategy,
+        KeltnerStrategy,
+        DonchianStrategy,
+    )
+}
+
+
+def create_strategy(figi: str) -> Strategy:
+    """
+    Создает стратегию инструмента: из settings.STRATEGIES или STRATEGY по умолчанию.
+    """
+    name = STRATEGIES.get(figi, STRATEGY)
+    if name not in STRATEGY_CLASSES:
+        raise ValueError(f"Unknown strategy {name} for {figi}")
+    return STRATEGY_CLASSES[name](figi)
+
+
+_strategies: dict[str, Strategy] = {}
+
+
+def get_strategy(figi: str) -> Strategy:
+    """
+    Возвращает стратегию инструмента, общую для роботов всех счетов.
+    """
+    if figi not in _strategies:
+        _strategies[figi] = create_strategy(figi)
+    return _strategies[figi]
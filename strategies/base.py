@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Optional
+
+import numpy as np
+from tinkoff.invest import Candle, CandleInterval
+
+from db.candle_store import candle_store
+from db.instruments import instrument_registry
+from settings import BORDERS_TTL, DAYS_BACK
+from utils.candle_array import CandleArray
+from utils.indicators import get_indicator_hub
+from utils.journal import journal
+from utils.prices import ROUND_DOWN, ROUND_UP, nano_to_float, round_to_tick
+
+logger = logging.getLogger(__name__)
+
+
+class Strategy:
+    """
+    Базовый класс торговой стратегии. Стратегия получает только новые 1-минутные
+    свечи инструмента (update) и последние цены (on_tick) и возвращает границы
+    канала [нижняя, верхняя]: робот покупает по цене ниже нижней границы
+    и продает по цене выше верхней. Индикаторы берутся из общего для инструмента
+    IndicatorHub, поэтому пересчет не зависит от длины истории, а одинаковые
+    индикаторы разных стратегий считаются один раз.
+    Стратегия инструмента общая для роботов всех счетов: одновременные расчеты
+    границ объединяются, а границы не старше ttl секунд используются повторно.
+    """
+
+    name = ""
+
+    def __init__(self, figi: str):
+        self.figi = figi
+        self.days_back: int = DAYS_BACK
+        self.min_price_increment: int = 1  # шаг цены в нано-единицах
+        instrument = instrument_registry.get(figi)
+        if instrument is not None:
+            self.min_price_increment = instrument.min_price_increment
+        self.indicators = get_indicator_hub(figi)
+        self.last_time: Optional[int] = None
+        self.ttl: float = BORDERS_TTL
+        self.borders: Optional[list] = None
+        self.updated = 0.0
+        self._calculation: Optional[asyncio.Task] = None
+        self._candle: Optional[Candle] = None
+
+    async def get_historical_data(self) -> CandleArray:
+        """
+        Получает исторические данные для инструмента и возвращает массив 1-минутных
+        свечей с DAYS_BACK дней назад по настоящее время.
+        Свечи берутся из локального хранилища, с сервера докачивается только хвост.
+        """
+        candles = await candle_store.get_candles(
+            figi=self.figi,
+            interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
+            days_back=self.days_back,
+        )
+        logger.debug(f"Found {len(candles)} candles {self.figi}")
+        return candles
+
+    def update(
+        self, time: int, open: int, high: int, low: int, close: int, volume: int
+    ) -> None:
+        """
+        Учитывает свечу (цены в нано-единицах). Свеча с тем же временем,
+        что и предыдущая, заменяет ее.
+        """
+
+    def feed(self, candles: CandleArray) -> None:
+        """
+        Подает индикаторам и стратегии новые свечи массива и обновленную последнюю.
+        """
+        self.indicators.consume(candles)
+        start = 0
+        if self.last_time is not None:
+            start = int(np.searchsorted(candles.times, self.last_time))
+        for row in candles.data[start:].tolist():
+            self.update(*row[:6])
+        self.last_time = candles.last_time
+
+    async def calculate_borders(self, force: bool = False) -> Optional[list]:
+        """
+        Вычисляет новые границы диапазона по свечам, полученным с момента
+        предыдущего расчета. Без force возвращает границы, рассчитанные
+        не раньше ttl секунд назад.
+        """
+        if (
+                not force
+                and self.borders is not None
+                and time.monotonic() - self.updated < self.ttl
+        ):
+            return self.borders
+        if self._calculation is None:
+            self._calculation = asyncio.create_task(self._calculate())
+        try:
+            return await asyncio.shield(self._calculation)
+        finally:
+            if self._calculation is not None and self._calculation.done():
+                self._calculation = None
+
+    async def _calculate(self) -> Optional[list]:
+        candles = await self.get_historical_data()
+        if len(candles) == 0:
+            return None
+        self.feed(candles)
+        self.borders = self.get_borders()
+        self.updated = time.monotonic()
+        return self.borders
+
+    def on_candle(self, candle: Candle) -> Optional[list]:
+        """
+        Пересчитывает границы диапазона по свече, полученной из стрима.
+        Свеча, уже учтенная для робота другого счета, не обрабатывается повторно.
+        """
+        if candle is self._candle:
+            return self.borders
+        self._candle = candle
+        candles = candle_store.add_candle(
+            figi=self.figi,
+            interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
+            candle=candle,
+            days_back=self.days_back,
+        )
+        self.feed(candles)
+        self.borders = self.get_borders()
+        self.updated = time.monotonic()
+        return self.borders
+
+    def on_tick(self, price: float) -> Optional[list]:
+        """
+        Возвращает новые границы по последней цене или None, если границы
+        от цены не зависят.
+        """
+        return None
+
+    def get_borders(self) -> Optional[list]:
+        raise NotImplementedError
+
+    def channel(self, lower: float, upper: float) -> list:
+        """
+        Возвращает границы канала в валюте инструмента по границам в нано-единицах.
+        Цены кратны шагу цены, поэтому нижняя граница округляется до шага вниз,
+        а верхняя вверх: сравнение последней цены с округленной границей дает
+        тот же результат, что и с точной.
+        """
+        lower = round_to_tick(math.floor(lower), self.min_price_increment, ROUND_DOWN)
+        upper = round_to_tick(math.ceil(upper), self.min_price_increment, ROUND_UP)
+        journal.borders(self.figi, int(lower), int(upper))
+        borders = [nano_to_float(lower), nano_to_float(upper)]
+        logger.info(f"{self.name} channel borders {self.figi}: {borders}")
+        return borders
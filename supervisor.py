@@ -0,0 +1,464 @@
+"""
+Режим супервизора: инструменты делятся между рабочими процессами, каждый из
+которых запускает своих TradingRobot в собственном цикле событий.
+
+Главный процесс владеет счетом:
+    - публикует последние цены и позиции в табло в разделяемой памяти,
+      из которого рабочие процессы только читают;
+    - принимает от рабочих процессов ордера, проверяет активные ордера и лимит
+      позиции по инструменту и только после этого отправляет ордер брокеру;
+    - отслеживает исполнение ордеров;
+    - перезапускает упавшие рабочие процессы.
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+from uuid import uuid4
+
+import numpy as np
+from tinkoff.invest import AioRequestError, MoneyValue, PortfolioPosition
+from tinkoff.invest.grpc.orders_pb2 import ORDER_DIRECTION_BUY
+
+import robot
+from accounts import Account
+from client import Quote, broker_client, portfolio_service, price_board
+from order_tracker import get_order_tracker, set_order_tracker
+from settings import (
+    BOARD_REFRESH_INTERVAL,
+    BORDERS_SNAPSHOT_FILE,
+    RATE_LIMITS,
+    RATE_LIMIT_QUEUE_SIZE,
+    SUPERVISOR_WORKERS,
+    WARMUP_CONCURRENCY,
+    WORKER_RESTART_DELAY,
+)
+from stop_engine import stop_engine
+from utils.metrics import metrics
+from utils.quotation import float_to_quotation, quotation_to_float
+from utils.rate_limiter import Priority, RateLimiter
+from warmup import WarmUp
+
+logger = logging.getLogger(__name__)
+
+BOARD_DTYPE = np.dtype(
+    [
+        ("version", np.int64),  # нечетное значение - строка в процессе записи
+        ("price", np.float64),
+        ("price_time", np.float64),  # время цены в секундах от начала эпохи
+        ("lots", np.int64),
+        ("average_price", np.float64),
+    ]
+)
+
+
+class OrderRejected(Exception):
+    pass
+
+
+class SharedBoard:
+    """
+    Табло цен и позиций в разделяемой памяти, по строке на инструмент.
+    Пишет в табло только процесс-владелец счета. Строка защищена счетчиком версий:
+    читатель повторяет чтение, если строка менялась во время копирования.
+    """
+
+    def __init__(self, figis: list[str], name: Optional[str] = None):
+        self.figis = list(figis)
+        self.index = {figi: index for index, figi in enumerate(self.figis)}
+        self.shm = SharedMemory(
+            name=name,
+            create=name is None,
+            size=max(1, len(self.figis)) * BOARD_DTYPE.itemsize,
+        )
+        self.rows = np.ndarray(len(self.figis), dtype=BOARD_DTYPE, buffer=self.shm.buf)
+        if name is None:
+            self.rows[:] = (0, np.nan, np.nan, 0, np.nan)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, figi: str, **fields) -> None:
+        index = self.index[figi]
+        version = self.rows["version"]
+        version[index] += 1
+        for field, value in fields.items():
+            self.rows[field][index] = value
+        version[index] += 1
+
+    def read(self, figi: str) -> tuple[float, float, int, float]:
+        """
+        Возвращает цену, время цены, число лотов и среднюю цену позиции.
+        """
+        index = self.index[figi]
+        version = self.rows["version"]
+        while True:
+            started = version[index]
+            if started % 2 == 0:
+                row = self.rows[index].item()
+                if version[index] == started:
+                    return row[1:]
+
+    def close(self) -> None:
+        # буфер нельзя закрыть, пока на него ссылается массив
+        self.rows = None
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+class BoardPriceView:
+    """
+    Табло последних цен рабочего процесса: цены читаются из SharedBoard
+    без обращения к API.
+    """
+
+    def __init__(self, board: SharedBoard):
+        self.board = board
+
+    def register(self, figi: str) -> None:
+        pass
+
+    def unregister(self, figi: str) -> None:
+        pass
+
+    async def get_quote(self, figi: str) -> Quote:
+        price, price_time, _, _ = self.board.read(figi)
+        while math.isnan(price):
+            # владелец счета еще не опубликовал цену инструмента
+            await asyncio.sleep(BOARD_REFRESH_INTERVAL)
+            price, price_time, _, _ = self.board.read(figi)
+        return Quote(price=price, age=time.time() - price_time)
+
+
+class BoardPortfolioView:
+    """
+    Позиции счета для рабочего процесса, прочитанные из SharedBoard.
+    """
+
+    def __init__(self, board: SharedBoard):
+        self.board = board
+
+    async def get_position(
+        self, account_id: str, figi: str
+    ) -> Optional[PortfolioPosition]:
+        _, _, lots, average_price = self.board.read(figi)
+        if not lots:
+            return None
+        average = float_to_quotation(average_price)
+        return PortfolioPosition(
+            figi=figi,
+            quantity_lots=float_to_quotation(lots),
+            average_position_price=MoneyValue(
+                currency="", units=average.units, nano=average.nano
+            ),
+        )
+
+    async def get_positions(self, account_id: str) -> dict[str, PortfolioPosition]:
+        positions = {}
+        for figi in self.board.figis:
+            position = await self.get_position(account_id, figi)
+            if position is not None:
+                positions[figi] = position
+        return positions
+
+    def invalidate(self, account_id: str) -> None:
+        # табло обновляет владелец счета после каждого ордера
+        pass
+
+
+class OrderRouter:
+    """
+    Передает ордера рабочего процесса владельцу счета и ждет его ответа.
+    Заменяет в рабочем процессе трекер ордеров: исполнение отслеживает владелец.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        requests: multiprocessing.Queue,
+        responses: multiprocessing.Queue,
+    ):
+        self.worker_id = worker_id
+        self.requests = requests
+        self.responses = responses
+        self._pending: dict[str, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._receive, name="order-responses", daemon=True).start()
+
+    def _receive(self) -> None:
+        while True:
+            request_id, response, error = self.responses.get()
+            self._loop.call_soon_threadsafe(self._resolve, request_id, response, error)
+
+    def _resolve(self, request_id: str, response, error: Optional[str]) -> None:
+        future = self._pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(OrderRejected(error))
+        else:
+            future.set_result(response)
+
+    async def post_order(self, priority: Priority = Priority.ORDER, **kwargs):
+        request_id = uuid4().hex
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        self.requests.put((self.worker_id, request_id, priority, kwargs))
+        return await future
+
+    async def track(self, order_id: str) -> None:
+        pass
+
+    def track_later(self, order_id: str) -> None:
+        pass
+
+
+def _shared_rate_limiter(processes: int) -> RateLimiter:
+    """
+    Лимиты запросов общие для токена, поэтому делятся поровну между владельцем
+    счета и рабочими процессами.
+    """
+    return RateLimiter(
+        {group: max(1, limit // processes) for group, limit in RATE_LIMITS.items()},
+        queue_size=RATE_LIMIT_QUEUE_SIZE,
+    )
+
+
+def run_worker(
+    worker_id: int,
+    figis: list[str],
+    all_figis: list[str],
+    board_name: str,
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue,
+    processes: int,
+    account: Account,
+) -> None:
+    asyncio.run(
+        _worker(
+            worker_id,
+            figis,
+            all_figis,
+            board_name,
+            requests,
+            responses,
+            processes,
+            account,
+        )
+    )
+
+
+async def _worker(
+    worker_id: int,
+    figis: list[str],
+    all_figis: list[str],
+    board_name: str,
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue,
+    processes: int,
+    account: Account,
+) -> None:
+    board = SharedBoard(all_figis, name=board_name)
+    router = OrderRouter(worker_id, requests, responses)
+    router.start()
+    broker_client.rate_limiter = _shared_rate_limiter(processes)
+    broker_client.order_router = router
+    broker_client.register_account(account.account_id, account.sandbox)
+    set_order_tracker(account.account_id, router)
+    robot.price_board = stop_engine.price_board = BoardPriceView(board)
+    robot.portfolio_service = stop_engine.portfolio_service = BoardPortfolioView(board)
+    try:
+        await broker_client.create()
+        robots = [
+            robot.TradingRobot(figi, account.account_id, account.quantity_limit)
+            for figi in figis
+        ]
+        logger.info(f"Worker {worker_id} started for {figis}")
+        stop_task = asyncio.create_task(stop_engine.run())
+        warm_up = WarmUp(
+            robots,
+            concurrency=max(1, WARMUP_CONCURRENCY // (processes - 1)),
+            snapshot_file=(
+                f"{BORDERS_SNAPSHOT_FILE}.{worker_id}" if BORDERS_SNAPSHOT_FILE else None
+            ),
+            portfolio=robot.portfolio_service,
+        )
+        await warm_up.run(lambda trading_robot, borders: trading_robot.start(borders))
+        stop_task.cancel()
+    finally:
+        board.close()
+
+
+class Supervisor:
+    """
+    Владелец счета и рабочих процессов с роботами.
+    """
+
+    def __init__(
+        self, figis: list[str], account: Account, workers: int = SUPERVISOR_WORKERS
+    ):
+        self.figis = list(figis)
+        self.account = account
+        self.account_id = account.account_id
+        self.quantity_limit: int = account.quantity_limit
+        self.order_tracker = get_order_tracker(self.account_id)
+        workers = max(1, min(workers, len(self.figis)))
+        self.shards = [self.figis[index::workers] for index in range(workers)]
+        # fork небезопасен для процесса с открытым gRPC-каналом
+        self.context = multiprocessing.get_context("spawn")
+        self.requests = self.context.Queue()
+        self.responses = [self.context.Queue() for _ in self.shards]
+        self.processes: list[Optional[BaseProcess]] = [None] * len(self.shards)
+        self.board: Optional[SharedBoard] = None
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+        for figi in self.figis:
+            price_board.register(figi)
+
+    def start_worker(self, worker_id: int) -> None:
+        process = self.context.Process(
+            target=run_worker,
+            args=(
+                worker_id,
+                self.shards[worker_id],
+                self.figis,
+                self.board.name,
+                self.requests,
+                self.responses[worker_id],
+                len(self.shards) + 1,
+                self.account,
+            ),
+            name=f"robot-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[worker_id] = process
+
+    async def publish(self) -> None:
+        """
+        Публикует в табло последние цены и позиции всех инструментов.
+        """
+        while True:
+            try:
+                quotes, positions = await asyncio.gather(
+                    price_board.get_quotes(),
+                    portfolio_service.get_positions(self.account_id),
+                )
+                received = time.time()
+                for figi in self.figis:
+                    position = positions.get(figi)
+                    fields = {"lots": 0, "average_price": np.nan}
+                    if position is not None:
+                        fields["lots"] = int(quotation_to_float(position.quantity_lots))
+                        fields["average_price"] = quotation_to_float(
+                            position.average_position_price
+                        )
+                    quote = quotes.get(figi)
+                    if quote is not None:
+                        fields["price"] = quote.price
+                        fields["price_time"] = received - quote.age
+                    self.board.write(figi, **fields)
+            except AioRequestError as err:
+                metrics.inc("errors_total", source="publish")
+                logger.error(f"Client error {err}")
+            await asyncio.sleep(BOARD_REFRESH_INTERVAL)
+
+    async def check_order(self, order: dict) -> Optional[str]:
+        """
+        Возвращает причину отказа, если ордер нарушает лимит позиции
+        или по инструменту уже есть активный ордер.
+        """
+        figi = order["figi"]
+        orders = await broker_client.get_orders(account_id=self.account_id)
+        if any(active_order.figi == figi for active_order in orders.orders):
+            return f"{figi} order in progress"
+        position = await portfolio_service.get_position(self.account_id, figi)
+        lots = int(quotation_to_float(position.quantity_lots)) if position else 0
+        if order["direction"] == ORDER_DIRECTION_BUY:
+            if lots + order["quantity"] > self.quantity_limit:
+                return f"{figi} position limit exceeded: {lots} + {order['quantity']}"
+        elif order["quantity"] > lots:
+            return f"{figi} not enough lots to sell: {lots} < {order['quantity']}"
+        return None
+
+    async def handle_order(
+        self, worker_id: int, request_id: str, priority: Priority, order: dict
+    ) -> None:
+        order["account_id"] = self.account_id
+        lock = self._locks.setdefault(order["figi"], asyncio.Lock())
+        response, error = None, None
+        # ордера по одному инструменту проверяются и отправляются по очереди
+        async with lock:
+            try:
+                error = await self.check_order(order)
+                if error is None:
+                    response = await broker_client.post_order(priority=priority, **order)
+            except Exception as exc:
+                error = str(exc)
+            if response is not None:
+                portfolio_service.invalidate(self.account_id)
+                self.order_tracker.track_later(response.order_id)
+        if error is not None:
+            metrics.inc("orders_rejected_total")
+            logger.warning(f"Order from worker {worker_id} rejected. {error}")
+        self.responses[worker_id].put((request_id, response, error))
+
+    def _receive_orders(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            loop.call_soon_threadsafe(self._spawn_order, request)
+
+    def _spawn_order(self, request: tuple) -> None:
+        task = asyncio.create_task(self.handle_order(*request))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def watch(self) -> None:
+        """
+        Перезапускает завершившиеся рабочие процессы.
+        """
+        while True:
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            for worker_id, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                metrics.inc("worker_restarts_total")
+                logger.error(
+                    f"Worker {worker_id} exited with code {process.exitcode}. Restarting"
+                )
+                self.start_worker(worker_id)
+
+    async def run(self) -> None:
+        broker_client.rate_limiter = _shared_rate_limiter(len(self.shards) + 1)
+        self.board = SharedBoard(self.figis)
+        receiver = threading.Thread(
+            target=self._receive_orders,
+            args=(asyncio.get_running_loop(),),
+            name="order-requests",
+            daemon=True,
+        )
+        receiver.start()
+        try:
+            for worker_id in range(len(self.shards)):
+                self.start_worker(worker_id)
+            await asyncio.gather(self.publish(), self.watch())
+        finally:
+            for process in self.processes:
+                if process is not None and process.is_alive():
+                    process.terminate()
+            self.requests.put(None)
+            self.board.close()
+            self.board.unlink()
@@ -1,27 +1,153 @@
+import asyncio
+import json
 import logging
+import time
+from typing import Optional
+
 import requests
 
-from settings import BOT_TOKEN, CHAT_ID
+from settings import (
+    BOT_TOKEN,
+    CHAT_ID,
+    TELEGRAM_DIGEST_WINDOW,
+    TELEGRAM_QUEUE_SIZE,
+    TELEGRAM_SPILL_FILE,
+)
 
 logger = logging.getLogger(__name__)
 
+MAX_MESSAGE_LENGTH = 4096  # ограничение Telegram на длину сообщения
+CHAT_SEND_INTERVAL = 1.0  # не больше одного сообщения в секунду в один чат
+GLOBAL_SEND_INTERVAL = 1 / 30  # не больше 30 сообщений в секунду всего
+
 
 class TelegramService:
+    """
+    Отправка уведомлений в Telegram. В асинхронном коде post() только ставит
+    сообщение в очередь, а фоновый обработчик объединяет накопившиеся сообщения
+    в одно на чат и отправляет их с соблюдением ограничений Telegram.
+    """
+
     def __init__(self, bot_token, chat_id):
         self.bot_token = bot_token
         self.chat_id = chat_id
+        self.session = requests.Session()
+        self.queue_size: int = TELEGRAM_QUEUE_SIZE
+        self.digest_window: float = TELEGRAM_DIGEST_WINDOW
+        self.spill_file: Optional[str] = TELEGRAM_SPILL_FILE
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._spilled: list[str] = []
+        self._spill_task: Optional[asyncio.Task] = None
+        self._last_sent: dict[str, float] = {}
+        self._last_sent_any: float = 0.0
+
+    def post(self, message, chat_id=None):
+        """
+        Ставит сообщение в очередь на отправку и сразу возвращает управление.
+        Вне цикла событий сообщение отправляется синхронно.
+        """
+        if message is None:
+            return
+        chat_id = chat_id or self.chat_id
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.send(chat_id, message)
+        if self._loop is not loop:
+            # очередь привязана к циклу событий, в котором создана
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._loop = loop
+        if self._worker is None or self._worker.done():
+            # сообщения, оставшиеся в очереди упавшего обработчика, не теряются
+            self._worker = loop.create_task(self._drain())
+        try:
+            self._queue.put_nowait((chat_id, message))
+        except asyncio.QueueFull:
+            self._spill(loop, chat_id, message)
 
-    def post(self, message):
+    def send(self, chat_id, text):
         try:
-            if message is not None:
-                send_text = f"https://api.telegram.org/bot{self.bot_token}/sendMessage?chat_id={self.chat_id}&parse_mode=markdown&text={message}&disable_web_page_preview=true "
-                response = requests.get(send_text)
-                if response.status_code != 200:
-                    logger.info(response.json())
-                return response.json()
+            response = self.session.post(
+                f"https://api.telegram.org/bot{self.bot_token}/sendMessage",
+                data={
+                    "chat_id": chat_id,
+                    "parse_mode": "markdown",
+                    "text": text,
+                    "disable_web_page_preview": "true",
+                },
+                timeout=10,
+            )
+            if response.status_code != 200:
+                logger.info(response.json())
+            return response.json()
         except Exception as ex:
             logger.error(ex)
             return False
 
+    def _spill(self, loop: asyncio.AbstractEventLoop, chat_id, message):
+        """
+        Откладывает сообщение в файл. Запись идет в отдельном потоке одной
+        задачей, поэтому не блокирует цикл событий и сохраняет порядок сообщений.
+        """
+        if self.spill_file is None:
+            logger.warning(f"Telegram queue is full, message dropped: {message}")
+            return
+        self._spilled.append(json.dumps({"chat_id": chat_id, "text": message}) + "\n")
+        if self._spill_task is None or self._spill_task.done():
+            self._spill_task = loop.create_task(self._write_spilled())
+        logger.warning(f"Telegram queue is full, message spilled to {self.spill_file}")
+
+    async def _write_spilled(self):
+        while self._spilled:
+            lines, self._spilled = self._spilled, []
+            await asyncio.to_thread(self._append_spill_file, lines)
+
+    def _append_spill_file(self, lines: list[str]):
+        with open(self.spill_file, "a", encoding="utf-8") as file:
+            file.writelines(lines)
+
+    async def _wait_rate_limit(self, chat_id):
+        now = time.monotonic()
+        delay = max(
+            self._last_sent.get(chat_id, 0.0) + CHAT_SEND_INTERVAL - now,
+            self._last_sent_any + GLOBAL_SEND_INTERVAL - now,
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_sent[chat_id] = self._last_sent_any = time.monotonic()
+
+    async def _send_digest(self, chat_id, messages: list[str]):
+        chunks = [""]
+        for message in messages:
+            if chunks[-1] and len(chunks[-1]) + len(message) + 1 > MAX_MESSAGE_LENGTH:
+                chunks.append("")
+            chunks[-1] = f"{chunks[-1]}\n{message}" if chunks[-1] else message
+        for chunk in chunks:
+            await self._wait_rate_limit(chat_id)
+            result = await asyncio.to_thread(self.send, chat_id, chunk)
+            if result and result.get("error_code") == 429:
+                retry_after = result.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Telegram rate limit exceeded, retry in {retry_after}s")
+                await asyncio.sleep(retry_after)
+                await asyncio.to_thread(self.send, chat_id, chunk)
+
+    async def _drain(self):
+        while True:
+            batch = [await self._queue.get()]
+            # ждем, пока накопится пачка сообщений, и отправляем ее одним дайджестом
+            await asyncio.sleep(self.digest_window)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            digests: dict[str, list[str]] = {}
+            for chat_id, message in batch:
+                digests.setdefault(chat_id, []).append(message)
+            for chat_id, messages in digests.items():
+                try:
+                    await self._send_digest(chat_id, messages)
+                except Exception as ex:
+                    logger.error(ex)
+
 
 telegram_bot = TelegramService(BOT_TOKEN, CHAT_ID)
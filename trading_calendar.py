@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from tinkoff.invest import AioRequestError
+from tinkoff.invest.utils import now
+
+from client import TargetClient, broker_client
+from db.instruments import instrument_registry
+from settings import CALENDAR_DAYS_AHEAD, CALENDAR_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+class Session(NamedTuple):
+    start: datetime
+    end: datetime
+
+
+def _is_set(time: Optional[datetime]) -> bool:
+    # незаполненное время в расписании приходит как начало эпохи
+    return time is not None and time.timestamp() > 0
+
+
+def _day_sessions(day) -> list[Session]:
+    """
+    Возвращает интервалы непрерывной торговли дня: основная сессия без клиринга
+    и вечерняя сессия.
+    """
+    if not day.is_trading_day or not _is_set(day.start_time):
+        return []
+    sessions = [Session(day.start_time, day.end_time)]
+    if _is_set(day.clearing_start_time) and _is_set(day.clearing_end_time):
+        clearing = Session(day.clearing_start_time, day.clearing_end_time)
+        sessions = [
+            part
+            for session in sessions
+            for part in (
+                Session(session.start, min(session.end, clearing.start)),
+                Session(max(session.start, clearing.end), session.end),
+            )
+            if part.start < part.end
+        ]
+    if _is_set(day.evening_start_time) and _is_set(day.evening_end_time):
+        sessions.append(Session(day.evening_start_time, day.evening_end_time))
+    return sessions
+
+
+class TradingCalendar:
+    """
+    Общее для всех роботов расписание торгов по площадкам. Расписание загружается
+    одним запросом раз в день, а роботы спят до начала ближайшей сессии вместо
+    опроса торгового статуса инструмента.
+    """
+
+    def __init__(self, client: TargetClient, days_ahead: int):
+        self.client = client
+        self.days_ahead = days_ahead
+        self._sessions: dict[str, list[Session]] = {}
+        self._starts: dict[str, list[datetime]] = {}
+        self._loaded: Optional[date] = None
+        self._horizon: Optional[datetime] = None
+        self._request: Optional[asyncio.Task] = None
+
+    async def load(self) -> None:
+        """
+        Загружает расписания всех площадок, если они еще не загружены сегодня.
+        Одновременные вызовы объединяются в один запрос.
+        """
+        if self._loaded == now().date():
+            return
+        if self._request is None:
+            self._request = asyncio.create_task(self._fetch())
+        try:
+            await asyncio.shield(self._request)
+        finally:
+            if self._request is not None and self._request.done():
+                self._request = None
+
+    async def _fetch(self) -> None:
+        from_ = now()
+        response = await self.client.get_trading_schedules(
+            from_=from_, to=from_ + timedelta(days=self.days_ahead)
+        )
+        self._sessions.clear()
+        self._starts.clear()
+        for schedule in response.exchanges:
+            sessions = sorted(
+                session for day in schedule.days for session in _day_sessions(day)
+            )
+            self._sessions[schedule.exchange] = sessions
+            self._starts[schedule.exchange] = [session.start for session in sessions]
+        self._loaded = from_.date()
+        self._horizon = from_ + timedelta(days=self.days_ahead)
+        logger.info(f"Trading schedules loaded for {len(self._sessions)} exchanges")
+
+    def session(self, figi: str, at: datetime) -> Optional[Session]:
+        """
+        Возвращает сессию, идущую в момент at, или ближайшую следующую.
+        None - расписание площадки инструмента неизвестно.
+        """
+        instrument = instrument_registry.get(figi)
+        if instrument is None or instrument.exchange not in self._sessions:
+            return None
+        sessions = self._sessions[instrument.exchange]
+        index = bisect_right(self._starts[instrument.exchange], at)
+        if index and at < sessions[index - 1].end:
+            return sessions[index - 1]
+        if index < len(sessions):
+            return sessions[index]
+        # до конца загруженного расписания торгов нет
+        return Session(self._horizon, self._horizon)
+
+    async def wait_session(self, figi: str) -> Optional[Session]:
+        """
+        Ждет начала торговой сессии инструмента и возвращает текущую сессию.
+        None - расписание недоступно, статус инструмента нужно проверять запросом.
+        """
+        while True:
+            try:
+                await self.load()
+            except AioRequestError as err:
+                logger.error(f"Failed to load trading schedules. {err}")
+                return None
+            current = now()
+            session = self.session(figi, current)
+            if session is None:
+                return None
+            if session.start <= current:
+                return session
+            # просыпаемся к началу сессии или к следующей загрузке расписания
+            tomorrow = datetime.combine(
+                current.date() + timedelta(days=1), datetime.min.time(), timezone.utc
+            )
+            wake = min(session.start, tomorrow)
+            logger.debug(f"{figi} Waiting for the session at {session.start}")
+            await asyncio.sleep(
+                max((wake - current).total_seconds(), CALENDAR_RETRY_DELAY)
+            )
+
+
+trading_calendar = TradingCalendar(broker_client, days_ahead=CALENDAR_DAYS_AHEAD)
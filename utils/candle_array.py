@@ -0,0 +1,147 @@
+import os
+from typing import Optional, Union
+
+import numpy as np
+from tinkoff.invest import Candle, HistoricCandle
+
+from utils.prices import quotation_to_nano
+
+# цены хранятся в нано-единицах, см. utils.prices
+CANDLE_DTYPE = np.dtype(
+    [
+        ("time", np.int64),  # секунды от начала эпохи
+        ("open", np.int64),
+        ("high", np.int64),
+        ("low", np.int64),
+        ("close", np.int64),
+        ("volume", np.int64),
+        ("is_complete", np.bool_),
+    ]
+)
+
+
+class CandleArray:
+    """
+    Свечи одного инструмента в предвыделенном структурированном массиве NumPy,
+    упорядоченные по времени. Свечи декодируются в массив сразу при получении,
+    без промежуточных объектов. Место под новые свечи выделяется удвоением,
+    а свечи, вышедшие из временного окна, отбрасываются сдвигом начала окна.
+    Если задан path, массив хранится в файле, отображенном в память.
+    """
+
+    def __init__(self, capacity: int = 1024, path: Optional[str] = None):
+        self.path = path
+        self._buffer = self._allocate(max(1, capacity), path)
+        self._start = 0
+        self._end = 0
+
+    @staticmethod
+    def _allocate(capacity: int, path: Optional[str]) -> np.ndarray:
+        if path is None:
+            return np.empty(capacity, dtype=CANDLE_DTYPE)
+        return np.memmap(path, dtype=CANDLE_DTYPE, mode="w+", shape=(capacity,))
+
+    def _reserve(self, required: int = 1) -> None:
+        """
+        Освобождает место под required новых свечей в конце буфера.
+        """
+        size = len(self)
+        capacity = max(len(self._buffer) * 2, size + required)
+        if size < len(self._buffer) // 2 and size + required <= len(self._buffer):
+            # после вытеснения старых свечей хватает места в начале буфера
+            self._buffer[:size] = self._buffer[self._start:self._end]
+        elif self.path is None:
+            buffer = self._allocate(capacity, None)
+            buffer[:size] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+        else:
+            # файл увеличивается через копию во временный файл
+            temporary_path = self.path + ".tmp"
+            buffer = self._allocate(capacity, temporary_path)
+            buffer[:size] = self._buffer[self._start:self._end]
+            buffer.flush()
+            os.replace(temporary_path, self.path)
+            self._buffer = buffer
+        self._start, self._end = 0, size
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def data(self) -> np.ndarray:
+        """
+        Свечи временного окна. Массив - представление буфера и не должен изменяться.
+        """
+        return self._buffer[self._start:self._end]
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.data["time"]
+
+    @property
+    def closes(self) -> np.ndarray:
+        return self.data["close"]
+
+    @property
+    def last_time(self) -> Optional[int]:
+        return int(self._buffer[self._end - 1]["time"]) if len(self) else None
+
+    def append(
+        self,
+        time: int,
+        open: int,
+        high: int,
+        low: int,
+        close: int,
+        volume: int,
+        is_complete: bool,
+    ) -> None:
+        """
+        Добавляет свечу в конец. Свечи с тем же или более поздним временем
+        (в том числе последняя, еще формирующаяся свеча) заменяются.
+        """
+        if len(self) and time <= self._buffer[self._end - 1]["time"]:
+            self.truncate(time)
+        if self._end == len(self._buffer):
+            self._reserve()
+        self._buffer[self._end] = (time, open, high, low, close, volume, is_complete)
+        self._end += 1
+
+    def append_candle(
+        self, candle: Union[HistoricCandle, Candle], is_complete: bool
+    ) -> None:
+        self.append(
+            int(candle.time.timestamp()),
+            quotation_to_nano(candle.open),
+            quotation_to_nano(candle.high),
+            quotation_to_nano(candle.low),
+            quotation_to_nano(candle.close),
+            candle.volume,
+            is_complete,
+        )
+
+    def extend(self, rows: np.ndarray) -> None:
+        """
+        Добавляет упорядоченный по времени массив свечей CANDLE_DTYPE.
+        """
+        if not len(rows):
+            return
+        self.truncate(int(rows["time"][0]))
+        if self._end + len(rows) > len(self._buffer):
+            self._reserve(len(rows))
+        self._buffer[self._end:self._end + len(rows)] = rows
+        self._end += len(rows)
+
+    def truncate(self, from_time: int) -> None:
+        """
+        Удаляет свечи со временем from_time и позже.
+        """
+        self._end = self._start + int(np.searchsorted(self.times, from_time))
+
+    def evict(self, before_time: int) -> int:
+        """
+        Удаляет свечи старше before_time и возвращает их количество.
+        """
+        count = int(np.searchsorted(self.times, before_time))
+        self._start += count
+        return count
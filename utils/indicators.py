@@ -0,0 +1,289 @@
+"""
+Инкрементальные индикаторы по свечам. Цены подаются в нано-единицах, как в
+CandleArray, значения индикаторов - в тех же единицах. Каждое обновление
+занимает O(1) времени и памяти (для оконных индикаторов - O(period) памяти).
+"""
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from utils.candle_array import CandleArray
+
+SECONDS_IN_DAY = 86400
+
+
+class Indicator:
+    """
+    Базовый класс индикатора. Последняя свеча хранится отдельно от
+    зафиксированного состояния: свеча с тем же временем (формирующаяся) заменяет
+    ее, а в состояние свеча включается (commit), только когда приходит следующая.
+    """
+
+    def __init__(self):
+        self.last_time: Optional[int] = None
+        self.count = 0  # зафиксированные свечи
+        self._candle: Optional[tuple[int, int, int, int, int]] = None
+
+    def update(
+        self, time: int, open: int, high: int, low: int, close: int, volume: int
+    ) -> None:
+        if self.last_time is not None and time != self.last_time:
+            if time < self.last_time:
+                raise ValueError(f"Out of order candle: {time} < {self.last_time}")
+            self.commit(self.last_time, *self._candle)
+            self.count += 1
+        self.last_time = time
+        self._candle = (open, high, low, close, volume)
+
+    def commit(
+        self, time: int, open: int, high: int, low: int, close: int, volume: int
+    ) -> None:
+        raise NotImplementedError
+
+    @property
+    def value(self):
+        raise NotImplementedError
+
+
+class EMA(Indicator):
+    """
+    Экспоненциальное скользящее среднее цен закрытия.
+    """
+
+    def __init__(self, period: int):
+        super().__init__()
+        self.alpha = 2 / (period + 1)
+        self._ema: Optional[float] = None
+
+    def _next(self, close: int) -> float:
+        if self._ema is None:
+            return float(close)
+        return self._ema + self.alpha * (close - self._ema)
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        self._ema = self._next(close)
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._next(self._candle[3]) if self._candle is not None else None
+
+
+class SMA(Indicator):
+    """
+    Простое скользящее среднее цен закрытия за period свечей. Сумма окна
+    хранится целым числом нано-единиц и не накапливает ошибку округления.
+    """
+
+    def __init__(self, period: int):
+        super().__init__()
+        self.period = period
+        self._window: deque[int] = deque()
+        self._sum = 0
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        self._window.append(close)
+        self._sum += close
+        if len(self._window) >= self.period:
+            self._sum -= self._window.popleft()
+
+    @property
+    def value(self) -> Optional[float]:
+        if self._candle is None:
+            return None
+        return (self._sum + self._candle[3]) / (len(self._window) + 1)
+
+
+class RollingMax(Indicator):
+    """
+    Максимум цен high за period свечей (монотонная очередь).
+    """
+
+    sign = 1
+
+    def __init__(self, period: int):
+        super().__init__()
+        self.period = period
+        # пары (номер свечи, цена со знаком sign), цены убывают
+        self._queue: deque[tuple[int, int]] = deque()
+
+    def _price(self, high: int, low: int) -> int:
+        return high
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        price = self.sign * self._price(high, low)
+        while self._queue and self._queue[-1][1] <= price:
+            self._queue.pop()
+        self._queue.append((self.count, price))
+        # в окне остаются period - 1 зафиксированных свечей и последняя свеча
+        while self._queue and self._queue[0][0] <= self.count - (self.period - 1):
+            self._queue.popleft()
+
+    @property
+    def value(self) -> Optional[int]:
+        if self._candle is None:
+            return None
+        price = self.sign * self._price(self._candle[1], self._candle[2])
+        if self._queue:
+            price = max(price, self._queue[0][1])
+        return self.sign * price
+
+
+class RollingMin(RollingMax):
+    """
+    Минимум цен low за period свечей.
+    """
+
+    sign = -1
+
+    def _price(self, high: int, low: int) -> int:
+        return low
+
+
+class BollingerBands(Indicator):
+    """
+    Полосы Боллинджера: среднее цен закрытия за period свечей плюс-минус width
+    стандартных отклонений. Суммы значений и квадратов хранятся целыми числами,
+    поэтому дисперсия считается без потери точности. Значение - (нижняя, средняя,
+    верхняя).
+    """
+
+    def __init__(self, period: int, width: float = 2.0):
+        super().__init__()
+        self.period = period
+        self.width = width
+        self._window: deque[int] = deque()
+        self._sum = 0
+        self._sum_squares = 0
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        self._window.append(close)
+        self._sum += close
+        self._sum_squares += close * close
+        if len(self._window) >= self.period:
+            expired = self._window.popleft()
+            self._sum -= expired
+            self._sum_squares -= expired * expired
+
+    @property
+    def value(self) -> Optional[tuple[float, float, float]]:
+        if self._candle is None:
+            return None
+        close = self._candle[3]
+        count = len(self._window) + 1
+        total = self._sum + close
+        mean = total / count
+        variance = count * (self._sum_squares + close * close) - total * total
+        deviation = (variance / (count * count)) ** 0.5
+        return mean - self.width * deviation, mean, mean + self.width * deviation
+
+
+class ATR(Indicator):
+    """
+    Средний истинный диапазон со сглаживанием Уайлдера. Первые period свечей
+    усредняются простым средним.
+    """
+
+    def __init__(self, period: int):
+        super().__init__()
+        self.period = period
+        self._atr = 0.0
+        self._previous_close: Optional[int] = None
+
+    def _next(self, high: int, low: int) -> float:
+        true_range = high - low
+        if self._previous_close is not None:
+            true_range = max(
+                true_range,
+                abs(high - self._previous_close),
+                abs(low - self._previous_close),
+            )
+        return self._atr + (true_range - self._atr) / min(self.count + 1, self.period)
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        self._atr = self._next(high, low)
+        self._previous_close = close
+
+    @property
+    def value(self) -> Optional[float]:
+        if self._candle is None:
+            return None
+        return self._next(self._candle[1], self._candle[2])
+
+
+class VWAP(Indicator):
+    """
+    Средневзвешенная по объему типичная цена (high + low + close) / 3
+    с начала торгового дня. День отсчитывается от полуночи UTC со сдвигом offset.
+    """
+
+    def __init__(self, offset: int = 0):
+        super().__init__()
+        self.offset = offset
+        self._day: Optional[int] = None
+        self._value = 0.0  # сумма цена * объем
+        self._volume = 0
+
+    def _day_of(self, time: int) -> int:
+        return (time - self.offset) // SECONDS_IN_DAY
+
+    def commit(self, time, open, high, low, close, volume) -> None:
+        if self._day_of(time) != self._day:
+            self._day = self._day_of(time)
+            self._value = 0.0
+            self._volume = 0
+        self._value += (high + low + close) / 3 * volume
+        self._volume += volume
+
+    @property
+    def value(self) -> Optional[float]:
+        if self._candle is None:
+            return None
+        _, high, low, close, volume = self._candle
+        price = (high + low + close) / 3
+        if self._day_of(self.last_time) != self._day:
+            return price
+        total_volume = self._volume + volume
+        if total_volume == 0:
+            return price
+        return (self._value + price * volume) / total_volume
+
+
+class IndicatorHub:
+    """
+    Индикаторы одного инструмента, общие для всех его стратегий. Индикатор
+    с одинаковыми параметрами создается один раз и обновляется один раз на свечу,
+    сколько бы стратегий его ни использовали.
+    """
+
+    def __init__(self):
+        self._indicators: dict[tuple, Indicator] = {}
+
+    def get(self, kind: type[Indicator], *args) -> Indicator:
+        key = (kind, *args)
+        if key not in self._indicators:
+            self._indicators[key] = kind(*args)
+        return self._indicators[key]
+
+    def consume(self, candles: CandleArray) -> None:
+        """
+        Подает индикаторам свечи массива, начиная с последней учтенной каждым.
+        """
+        for indicator in self._indicators.values():
+            start = 0
+            if indicator.last_time is not None:
+                start = int(np.searchsorted(candles.times, indicator.last_time))
+            for row in candles.data[start:].tolist():
+                indicator.update(*row[:6])
+
+
+_hubs: dict[str, IndicatorHub] = {}
+
+
+def get_indicator_hub(figi: str) -> IndicatorHub:
+    """
+    Возвращает общие индикаторы 1-минутных свечей инструмента.
+    """
+    if figi not in _hubs:
+        _hubs[figi] = IndicatorHub()
+    return _hubs[figi]
@@ -0,0 +1,327 @@
+"""
+Журнал событий для воспроизведения торговой сессии (backtest.replay): свечи
+и последние цены, полученные роботами, торговый статус, портфель, состояния
+ордеров, рассчитанные границы каналов и отправленные ордера.
+
+Записи пишутся в двоичном формате через буферизованный файл, новый файл
+начинается каждые сутки (UTC). Запись - заголовок (вид записи, время
+в наносекундах UTC) и поля вида записи, у CANDLES и PORTFOLIO за ними следует
+массив элементов. Цены и количества хранятся в нано-единицах. Строки (figi,
+счета, id ордеров) заменяются номерами: первое появление строки в файле
+записывается отдельной записью SYMBOL.
+"""
+import atexit
+import heapq
+import os
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from settings import JOURNAL_BUFFER_SIZE, JOURNAL_DIR
+from utils.candle_array import CANDLE_DTYPE, CandleArray
+from utils.prices import quotation_to_nano
+
+SYMBOL = 0
+ROBOT = 1
+CANDLES = 2
+PRICE = 3
+BORDERS = 4
+STATUS = 5
+PORTFOLIO = 6
+ORDER = 7
+ORDER_STATE = 8
+
+HEADER = struct.Struct("<Bq")
+FIELDS = {
+    SYMBOL: struct.Struct("<IH"),  # номер, длина строки в байтах
+    ROBOT: struct.Struct("<IIqqq"),  # счет, figi, лимит позиции, лот, шаг цены
+    CANDLES: struct.Struct("<II"),  # figi, число свечей CANDLE_DTYPE
+    PRICE: struct.Struct("<Iq"),  # figi, последняя цена
+    BORDERS: struct.Struct("<Iqq"),  # figi, нижняя и верхняя границы
+    STATUS: struct.Struct("<IB"),  # figi, доступность торговли
+    PORTFOLIO: struct.Struct("<II"),  # счет, число позиций POSITION
+    ORDER: struct.Struct("<IIIBqB"),  # счет, figi, id, направление, лоты, приоритет
+    ORDER_STATE: struct.Struct("<IIBqq"),  # счет, id, статус, исполнено лотов, цена
+}
+POSITION = struct.Struct("<Iqq")  # figi, количество лотов, средняя цена
+# поля записей, хранящие номера строк
+SYMBOL_FIELDS = {
+    ROBOT: (0, 1),
+    CANDLES: (0,),
+    PRICE: (0,),
+    BORDERS: (0,),
+    STATUS: (0,),
+    PORTFOLIO: (0,),
+    ORDER: (0, 1, 2),
+    ORDER_STATE: (0, 1),
+}
+NS_PER_DAY = 86400 * 10 ** 9
+
+
+class Record(NamedTuple):
+    kind: int
+    time: int  # наносекунды UTC
+    # поля записи со строками вместо номеров; у CANDLES вместо числа свечей -
+    # массив CANDLE_DTYPE, у PORTFOLIO - список (figi, лоты, средняя цена)
+    values: tuple
+
+
+class Journal:
+    """
+    Журнал событий одного процесса. Запись добавляется в буфер файла без
+    обращения к диску, буфер сбрасывается при заполнении и при завершении
+    процесса. Если directory не задан, журнал не ведется.
+    """
+
+    def __init__(self, directory: Optional[str], buffer_size: int):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self._file = None
+        self._day: Optional[int] = None
+        self._symbols: dict[str, int] = {}
+        # время последней записанной свечи по figi
+        self._candle_times: dict[str, int] = {}
+        # параметры роботов повторяются в начале каждого файла
+        self._robots: list[tuple[str, str, int, int, int]] = []
+        atexit.register(self.close)
+
+    def _open(self, day: int) -> None:
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        date = datetime.fromtimestamp(day * 86400, tz=timezone.utc).date()
+        path = os.path.join(self.directory, f"{date}-{os.getpid()}.journal")
+        self._file = open(path, "ab", buffering=self.buffer_size)
+        self._day = day
+
+    def _begin(self) -> int:
+        """
+        Возвращает время записи, начиная новый файл при смене суток.
+        """
+        now = time.time_ns()
+        if now // NS_PER_DAY != self._day:
+            self._open(now // NS_PER_DAY)
+            for robot in self._robots:
+                self._write_robot(now, *robot)
+        return now
+
+    def _symbol(self, value: str, now: int) -> int:
+        symbol = self._symbols.get(value)
+        if symbol is None:
+            symbol = self._symbols[value] = len(self._symbols)
+            encoded = value.encode()
+            self._file.write(
+                HEADER.pack(SYMBOL, now)
+                + FIELDS[SYMBOL].pack(symbol, len(encoded))
+                + encoded
+            )
+        return symbol
+
+    def _write(self, kind: int, now: int, *fields, tail: bytes = b"") -> None:
+        self._file.write(HEADER.pack(kind, now) + FIELDS[kind].pack(*fields) + tail)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day = None
+            self._symbols = {}
+            self._candle_times = {}
+
+    def robot(self, account_id: str, figi: str, quantity_limit: int, instrument) -> None:
+        """
+        Записывает параметры робота и инструмента (db.instruments.Instrument или
+        None, если инструмент не найден в справочнике).
+        """
+        if self.directory is None:
+            return
+        now = self._begin()
+        robot = (
+            account_id,
+            figi,
+            quantity_limit,
+            instrument.lot if instrument is not None else 1,
+            instrument.min_price_increment if instrument is not None else 1,
+        )
+        self._robots.append(robot)
+        self._write_robot(now, *robot)
+
+    def _write_robot(
+        self,
+        now: int,
+        account_id: str,
+        figi: str,
+        quantity_limit: int,
+        lot: int,
+        min_price_increment: int,
+    ) -> None:
+        self._write(
+            ROBOT,
+            now,
+            self._symbol(account_id, now),
+            self._symbol(figi, now),
+            quantity_limit,
+            lot,
+            min_price_increment,
+        )
+
+    def candles(self, figi: str, candles: CandleArray) -> None:
+        """
+        Записывает свечи, появившиеся после последней записанной свечи инструмента,
+        и ее обновленную версию. В начале файла записывается все временное окно,
+        а роботы повторяются, поэтому каждый файл воспроизводится независимо
+        от предыдущих.
+        """
+        if self.directory is None or len(candles) == 0:
+            return
+        now = self._begin()
+        start = 0
+        last_time = self._candle_times.get(figi)
+        if last_time is not None:
+            start = int(np.searchsorted(candles.times, last_time))
+        rows = candles.data[start:]
+        self._write(
+            CANDLES, now, self._symbol(figi, now), len(rows), tail=rows.tobytes()
+        )
+        self._candle_times[figi] = candles.last_time
+
+    def prices(self, figis: Iterable[str], prices: Iterable[int]) -> None:
+        if self.directory is None:
+            return
+        now = self._begin()
+        for figi, price in zip(figis, prices):
+            self._write(PRICE, now, self._symbol(figi, now), int(price))
+
+    def borders(self, figi: str, lower: int, upper: int) -> None:
+        if self.directory is None:
+            return
+        now = self._begin()
+        self._write(BORDERS, now, self._symbol(figi, now), lower, upper)
+
+    def status(self, figi: str, available: bool) -> None:
+        if self.directory is None:
+            return
+        now = self._begin()
+        self._write(STATUS, now, self._symbol(figi, now), available)
+
+    def portfolio(self, account_id: str, positions: Iterable) -> None:
+        if self.directory is None:
+            return
+        now = self._begin()
+        items = [
+            POSITION.pack(
+                self._symbol(position.figi, now),
+                quotation_to_nano(position.quantity_lots),
+                quotation_to_nano(position.average_position_price),
+            )
+            for position in positions
+        ]
+        self._write(
+            PORTFOLIO,
+            now,
+            self._symbol(account_id, now),
+            len(items),
+            tail=b"".join(items),
+        )
+
+    def order(
+        self,
+        account_id: str,
+        figi: str,
+        order_id: str,
+        direction: int,
+        quantity: int,
+        priority: int,
+        sent_at: Optional[int] = None,
+    ) -> None:
+        """
+        Записывает отправленный ордер. sent_at - время отправки в наносекундах,
+        если запись делается после ответа брокера.
+        """
+        if self.directory is None:
+            return
+        now = self._begin()
+        self._write(
+            ORDER,
+            sent_at or now,
+            self._symbol(account_id, now),
+            self._symbol(figi, now),
+            self._symbol(order_id, now),
+            direction,
+            quantity,
+            priority,
+        )
+
+    def order_state(self, account_id: str, order_state) -> None:
+        if self.directory is None:
+            return
+        now = self._begin()
+        self._write(
+            ORDER_STATE,
+            now,
+            self._symbol(account_id, now),
+            self._symbol(order_state.order_id, now),
+            order_state.execution_report_status,
+            order_state.lots_executed,
+            quotation_to_nano(order_state.executed_order_price),
+        )
+
+
+def read_journal(path: str) -> Iterator[Record]:
+    """
+    Читает записи файла журнала. Запись, оборванная при аварийном завершении
+    процесса, и все следующие за ней пропускаются.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    symbols: dict[int, str] = {}
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        kind, time_ns = HEADER.unpack_from(data, offset)
+        fields = FIELDS[kind]
+        offset += HEADER.size
+        if offset + fields.size > len(data):
+            return
+        values = list(fields.unpack_from(data, offset))
+        offset += fields.size
+        size = 0
+        if kind == SYMBOL:
+            size = values[1]
+        elif kind == CANDLES:
+            size = values[1] * CANDLE_DTYPE.itemsize
+        elif kind == PORTFOLIO:
+            size = values[1] * POSITION.size
+        if offset + size > len(data):
+            return
+        tail = data[offset:offset + size]
+        offset += size
+        if kind == SYMBOL:
+            symbols[values[0]] = tail.decode()
+            continue
+        for index in SYMBOL_FIELDS[kind]:
+            values[index] = symbols[values[index]]
+        if kind == CANDLES:
+            values[1] = np.frombuffer(tail, dtype=CANDLE_DTYPE)
+        elif kind == PORTFOLIO:
+            values[1] = [
+                (symbols[figi], lots, price)
+                for figi, lots, price in POSITION.iter_unpack(tail)
+            ]
+        yield Record(kind, time_ns, tuple(values))
+
+
+def read_journals(paths: list[str]) -> Iterator[Record]:
+    """
+    Читает записи нескольких файлов (например, рабочих процессов супервизора)
+    в порядке времени.
+    """
+    return heapq.merge(*[read_journal(path) for path in paths], key=lambda r: r.time)
+
+
+journal = Journal(JOURNAL_DIR, buffer_size=JOURNAL_BUFFER_SIZE)
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# границы корзин гистограмм задержек в секундах
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = labels + (extra,) if extra else labels
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Реестр метрик: гистограммы задержек и счетчики с метками.
+    Обновление метрики - несколько операций со словарем, поэтому его можно
+    вызывать в горячем пути торгового цикла.
+    """
+
+    def __init__(self):
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.counters: dict[str, Counter] = {}
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: int = 1, **labels) -> None:
+        self.counters.setdefault(name, Counter())[_labels_key(labels)] += value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Декоратор асинхронной функции, измеряющий время ее выполнения
+        и считающий исключения в errors_total. У errors_total одна метка
+        source: для методов API это метка method, иначе имя метрики.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception:
+                        self.inc("errors_total", source=labels.get("method", name))
+                        raise
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> str:
+        """
+        Возвращает метрики в текстовом формате Prometheus.
+        """
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}"
+                )
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: из отдельного потока периодически снимает стек
+    главного потока и считает частоту стеков в формате collapsed stacks
+    (совместим с flamegraph.pl и speedscope).
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._target_thread_id = threading.main_thread().ident
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info("Sampling profiler started")
+
+    async def stop(self) -> None:
+        """
+        Останавливает профайлер, дожидаясь потока сэмплирования вне цикла событий.
+        """
+        self._running = False
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+        logger.info("Sampling profiler stopped")
+
+    def _run(self):
+        while self._running:
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                stack = ";".join(
+                    f"{entry.name} ({entry.filename}:{entry.lineno})"
+                    for entry in traceback.extract_stack(frame)
+                )
+                self.stacks[stack] += 1
+            time.sleep(self.interval)
+
+    def render(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.items()) + "\n"
+
+
+async def monitor_loop_lag(interval: float = 0.1) -> None:
+    """
+    Измеряет, насколько позже запланированного просыпается цикл событий.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop_lag_seconds", time.perf_counter() - started - interval)
+
+
+async def dump_metrics(file_name: str, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        with open(file_name, "w", encoding="utf-8") as file:
+            file.write(metrics.render())
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()).strip():
+            pass
+        path = request_line.split(" ")[1] if " " in request_line else "/"
+        status = "200 OK"
+        if path == "/metrics":
+            body = metrics.render()
+        elif path == "/profiler/start":
+            profiler.start()
+            body = "started\n"
+        elif path == "/profiler/stop":
+            await profiler.stop()
+            body = "stopped\n"
+        elif path == "/profiler":
+            body = profiler.render()
+        else:
+            status, body = "404 Not Found", "not found\n"
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve_metrics(
+    port: Optional[int],
+    dump_file: Optional[str] = None,
+    dump_interval: float = 60,
+) -> None:
+    """
+    Запускает монитор задержки цикла событий, HTTP-эндпоинт /metrics на localhost
+    и, если задан файл, периодическую выгрузку метрик в него.
+    Профайлер включается и выключается запросами /profiler/start и /profiler/stop,
+    результат доступен по /profiler.
+    """
+    tasks = [monitor_loop_lag()]
+    if dump_file:
+        tasks.append(dump_metrics(dump_file, dump_interval))
+    if port:
+        server = await asyncio.start_server(_handle_request, "127.0.0.1", port)
+        logger.info(f"Metrics endpoint: http://127.0.0.1:{port}/metrics")
+        tasks.append(server.serve_forever())
+    await asyncio.gather(*tasks)
+
+
+metrics = Metrics()
+profiler = SamplingProfiler()
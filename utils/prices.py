@@ -0,0 +1,71 @@
+"""
+Цены в фиксированной точке: целое число нано-единиц (units * 10^9 + nano),
+как в Quotation и MoneyValue. Сложение, сравнение и округление до шага цены
+в этом представлении точные. Перевод во float делается одним делением,
+поэтому результат - ближайшее к точному значению число с плавающей точкой
+и порядок цен при переводе сохраняется.
+"""
+from typing import Iterable, Union
+
+import numpy as np
+from tinkoff.invest import MoneyValue, Quotation
+
+NANO = 1000000000
+
+ROUND_DOWN = "down"
+ROUND_UP = "up"
+ROUND_NEAREST = "nearest"
+
+Nano = Union[int, np.ndarray]
+
+
+def quotation_to_nano(quotation: Union[Quotation, MoneyValue]) -> int:
+    return quotation.units * NANO + quotation.nano
+
+
+def quotations_to_nano(quotations: Iterable[Union[Quotation, MoneyValue]]) -> np.ndarray:
+    """
+    Переводит последовательность Quotation или MoneyValue в массив int64.
+    """
+    quotations = list(quotations)
+    units = np.fromiter(
+        (quotation.units for quotation in quotations), np.int64, len(quotations)
+    )
+    nanos = np.fromiter(
+        (quotation.nano for quotation in quotations), np.int64, len(quotations)
+    )
+    return units * NANO + nanos
+
+
+def nano_to_float(value: Nano) -> Union[float, np.ndarray]:
+    return value / NANO
+
+
+def float_to_nano(value: Union[float, np.ndarray]) -> Nano:
+    if isinstance(value, np.ndarray):
+        return np.rint(value * NANO).astype(np.int64)
+    return round(value * NANO)
+
+
+def nano_to_quotation(value: int) -> Quotation:
+    # у отрицательных значений units и nano одного знака
+    units, nano = divmod(abs(int(value)), NANO)
+    if value < 0:
+        return Quotation(units=-units, nano=-nano)
+    return Quotation(units=units, nano=nano)
+
+
+def nano_to_money(value: int, currency: str) -> MoneyValue:
+    quotation = nano_to_quotation(value)
+    return MoneyValue(currency=currency, units=quotation.units, nano=quotation.nano)
+
+
+def round_to_tick(value: Nano, tick: int, mode: str = ROUND_NEAREST) -> Nano:
+    """
+    Округляет цену в нано-единицах до кратной шагу цены tick.
+    """
+    if mode == ROUND_DOWN:
+        return value // tick * tick
+    if mode == ROUND_UP:
+        return -(-value // tick) * tick
+    return (value + tick // 2) // tick * tick
@@ -1,11 +1,19 @@
-import math
 from typing import Union
 
 from tinkoff.invest import Quotation, MoneyValue
 
+from utils.prices import NANO, float_to_nano, nano_to_quotation, quotation_to_nano
+
 
 def quotation_to_float(quotation: Union[Quotation, MoneyValue]) -> float:
     """
     конвертирует объект quotation в значение типа float
     """
-    return float(quotation.units + quotation.nano / 1000000000)
+    return quotation_to_nano(quotation) / NANO
+
+
+def float_to_quotation(value: float) -> Quotation:
+    """
+    конвертирует значение типа float в объект quotation
+    """
+    return nano_to_quotation(float_to_nano(value))
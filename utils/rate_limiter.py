@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Optional
+
+from grpc import StatusCode
+from tinkoff.invest import AioRequestError
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """
+    Классы приоритета запросов: меньшее значение обслуживается раньше.
+    """
+
+    STOP_LOSS = 0
+    ORDER = 1
+    STATE = 2  # состояние ордеров, портфель, цены, торговый статус
+    CANDLES = 3
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: int):
+        self.capacity = requests_per_minute
+        self.rate = requests_per_minute / 60
+        self.tokens = float(requests_per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, tokens: int) -> float:
+        """
+        Возвращает время в секундах, через которое будет доступно tokens токенов.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max(0.0, (min(tokens, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, tokens: int) -> bool:
+        if self.delay(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def block(self, seconds: float, remaining: Optional[int] = None) -> None:
+        """
+        Учитывает ответ сервера об исчерпании лимита.
+        """
+        self.tokens = min(self.tokens, remaining or 0)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Планировщик запросов с ограничением частоты по группам методов API.
+    Для каждой группы ведется token bucket и ограниченная очередь ожидания,
+    из которой запросы выпускаются в порядке приоритета.
+    """
+
+    def __init__(self, limits: dict[str, int], queue_size: int):
+        self.buckets = {group: TokenBucket(limit) for group, limit in limits.items()}
+        self.queue_size = queue_size
+        self._queues: dict[str, list] = {group: [] for group in limits}
+        self._dispatchers: dict[str, asyncio.Task] = {}
+        self._counter = itertools.count()
+
+    async def acquire(self, group: str, priority: Priority, tokens: int = 1) -> None:
+        bucket = self.buckets.get(group)
+        if bucket is None:
+            return
+        queue = self._queues[group]
+        if not queue and bucket.take(tokens):
+            return
+        if len(queue) >= self.queue_size:
+            # при переполнении вытесняем наименее приоритетный запрос
+            worst = max(queue)
+            if worst[0] <= priority:
+                raise AioRequestError(
+                    StatusCode.RESOURCE_EXHAUSTED, f"{group} request queue is full", None
+                )
+            queue.remove(worst)
+            heapq.heapify(queue)
+            worst[3].set_exception(
+                AioRequestError(
+                    StatusCode.RESOURCE_EXHAUSTED, f"{group} request evicted", None
+                )
+            )
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue, (priority, next(self._counter), tokens, future))
+        dispatcher = self._dispatchers.get(group)
+        if dispatcher is None or dispatcher.done():
+            self._dispatchers[group] = asyncio.create_task(self._dispatch(group))
+        await future
+
+    async def _dispatch(self, group: str) -> None:
+        bucket = self.buckets[group]
+        queue = self._queues[group]
+        while queue:
+            _, _, tokens, future = queue[0]
+            if future.done():
+                heapq.heappop(queue)
+                continue
+            delay = bucket.delay(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            bucket.take(tokens)
+            heapq.heappop(queue)
+            future.set_result(None)
+
+    def on_exhausted(self, group: str, metadata: Any) -> None:
+        """
+        Приостанавливает группу до сброса лимита, сообщенного сервером.
+        """
+        bucket = self.buckets.get(group)
+        if bucket is None:
+            return
+        reset = getattr(metadata, "ratelimit_reset", None) or 1
+        remaining = getattr(metadata, "ratelimit_remaining", None)
+        logger.warning(f"Rate limit exhausted for {group}, pausing for {reset}s")
+        bucket.block(reset, remaining)
@@ -1,14 +1,132 @@
+import argparse
 import sqlite3
+from typing import Optional
 
+# Отчет по журналу сделок dblogger.db: реализованный и нереализованный результат,
+# оборот и статистика по инструментам. Запросы читают только дневные итоги
+# и позиции, которые поддерживаются при записи сделок, поэтому время отчета
+# не зависит от числа сделок.
 
-def get_orders():
-    with sqlite3.connect("stats.db") as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM orders")
-        return cursor.fetchall()
+DB_NAME = "dblogger.db"
+
+
+def get_orders(db_name: str = DB_NAME):
+    with sqlite3.connect(db_name) as conn:
+        return conn.execute("SELECT * FROM orders ORDER BY created_at").fetchall()
+
+
+def get_instrument_stats(
+    conn: sqlite3.Connection,
+    account_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> list[tuple]:
+    """
+    Возвращает по каждому инструменту: figi, число сделок, куплено и продано штук,
+    оборот и реализованный результат за период (даты в формате YYYY-MM-DD).
+    """
+    return conn.execute(
+        """
+        SELECT figi, SUM(fills), SUM(bought), SUM(sold),
+               TOTAL(buy_value + sell_value), TOTAL(realized)
+        FROM daily_summary
+        WHERE (:account_id IS NULL OR account_id = :account_id)
+          AND (:date_from IS NULL OR day >= :date_from)
+          AND (:date_to IS NULL OR day <= :date_to)
+        GROUP BY figi
+        ORDER BY figi
+        """,
+        {"account_id": account_id, "date_from": date_from, "date_to": date_to},
+    ).fetchall()
+
+
+def get_positions(
+    conn: sqlite3.Connection, account_id: Optional[str] = None
+) -> dict[str, tuple[int, float]]:
+    """
+    Возвращает открытые позиции: figi -> (количество штук, стоимость по цене входа).
+    """
+    rows = conn.execute(
+        "SELECT figi, SUM(quantity), TOTAL(cost) FROM positions "
+        "WHERE (:account_id IS NULL OR account_id = :account_id) AND quantity != 0 "
+        "GROUP BY figi",
+        {"account_id": account_id},
+    ).fetchall()
+    return {figi: (quantity, cost) for figi, quantity, cost in rows}
+
+
+def get_last_fill_prices(conn: sqlite3.Connection, figis: list[str]) -> dict[str, float]:
+    """
+    Цена последней сделки по каждому инструменту, по индексу (figi, time).
+    """
+    prices = {}
+    for figi in figis:
+        row = conn.execute(
+            "SELECT price FROM fills WHERE figi=? ORDER BY time DESC LIMIT 1", (figi,)
+        ).fetchone()
+        if row is not None:
+            prices[figi] = row[0]
+    return prices
+
+
+def get_live_prices(figis: list[str]) -> dict[str, float]:
+    from tinkoff.invest import Client
+
+    from settings import TOKEN
+    from utils.quotation import quotation_to_float
+
+    with Client(TOKEN) as client:
+        response = client.market_data.get_last_prices(figi=figis)
+    return {price.figi: quotation_to_float(price.price) for price in response.last_prices}
+
+
+def report(
+    db_name: str = DB_NAME,
+    account_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    live: bool = False,
+) -> None:
+    with sqlite3.connect(db_name) as conn:
+        stats = get_instrument_stats(conn, account_id, date_from, date_to)
+        positions = get_positions(conn, account_id)
+        figis = list(positions)
+        if live and figis:
+            prices = get_live_prices(figis)
+        else:
+            prices = get_last_fill_prices(conn, figis)
+
+    print(
+        f"{'figi':<14}{'fills':>8}{'bought':>10}{'sold':>10}{'turnover':>16}"
+        f"{'realized':>14}{'position':>10}{'unrealized':>14}"
+    )
+    total_turnover = total_realized = total_unrealized = 0.0
+    stats = {row[0]: row[1:] for row in stats}
+    for figi in sorted(stats.keys() | positions.keys()):
+        fills, bought, sold, turnover, realized = stats.get(figi, (0, 0, 0, 0.0, 0.0))
+        quantity, cost = positions.get(figi, (0, 0.0))
+        unrealized = quantity * prices[figi] - cost if figi in prices else 0.0
+        total_turnover += turnover
+        total_realized += realized
+        total_unrealized += unrealized
+        print(
+            f"{figi:<14}{fills:>8}{bought:>10}{sold:>10}{turnover:>16.2f}"
+            f"{realized:>14.2f}{quantity:>10}{unrealized:>14.2f}"
+        )
+    print(
+        f"{'total':<42}{total_turnover:>16.2f}{total_realized:>14.2f}"
+        f"{'':>10}{total_unrealized:>14.2f}"
+    )
 
 
 if __name__ == "__main__":
-    orders = get_orders()
-    for order in orders:
-        print(order)
+    parser = argparse.ArgumentParser(description="Отчет по журналу сделок")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--account")
+    parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD")
+    parser.add_argument(
+        "--live", action="store_true", help="оценивать позиции по текущим ценам"
+    )
+    args = parser.parse_args()
+    report(args.db, args.account, args.date_from, args.date_to, args.live)
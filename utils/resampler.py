@@ -0,0 +1,94 @@
+from typing import Optional
+
+import numpy as np
+
+from utils.candle_array import CandleArray
+
+MINUTE = 60
+WEEK_OFFSET = 4 * 86400  # 1970-01-01 - четверг, недели начинаются с понедельника
+
+
+class Resampler:
+    """
+    Инкрементальная сборка свечей старшего таймфрейма из 1-минутных свечей.
+    Свеча таймфрейма обновляется за O(1) на каждую минуту: агрегат завершенных
+    минут интервала хранится отдельно от последней минуты, поэтому повторно
+    пришедшая формирующаяся минута заменяет свой вклад, а не добавляется.
+    Интервалы без минутных свечей (клиринг, ночь, выходные) пропускаются -
+    пустые свечи не создаются, как и в свечах брокера. Свеча помечается
+    сформированной, когда пришла минута следующего интервала или время вышло
+    за конец интервала (seal), например после закрытия сессии.
+    """
+
+    def __init__(self, timeframe: int, offset: int = 0, capacity: int = 1024):
+        if timeframe <= 0 or timeframe % MINUTE:
+            raise ValueError(f"Timeframe must be a multiple of a minute: {timeframe}")
+        self.timeframe = timeframe
+        self.offset = offset
+        self.bars = CandleArray(capacity)
+        self._bar_time: Optional[int] = None
+        # open, high, low, volume завершенных минут текущей свечи
+        self._base: Optional[tuple[int, int, int, int]] = None
+        # time, open, high, low, close, volume последней минуты
+        self._minute: Optional[tuple[int, int, int, int, int, int]] = None
+
+    @property
+    def last_minute(self) -> Optional[int]:
+        return self._minute[0] if self._minute is not None else None
+
+    def bar_time(self, time: int) -> int:
+        return (time - self.offset) // self.timeframe * self.timeframe + self.offset
+
+    def _write(self, is_complete: bool) -> None:
+        _, open, high, low, close, volume = self._minute
+        if self._base is not None:
+            open = self._base[0]
+            high = max(high, self._base[1])
+            low = min(low, self._base[2])
+            volume += self._base[3]
+        self.bars.append(self._bar_time, open, high, low, close, volume, is_complete)
+
+    def update(
+        self, time: int, open: int, high: int, low: int, close: int, volume: int
+    ) -> None:
+        """
+        Учитывает 1-минутную свечу. Минута с тем же временем, что и последняя,
+        заменяет ее, более ранние минуты игнорируются.
+        """
+        if self._minute is not None and time < self._minute[0]:
+            return
+        bar_time = self.bar_time(time)
+        if bar_time != self._bar_time:
+            self.seal(time)
+            self._bar_time = bar_time
+            self._base = None
+        elif time != self._minute[0]:
+            _, minute_open, minute_high, minute_low, _, minute_volume = self._minute
+            if self._base is None:
+                self._base = (minute_open, minute_high, minute_low, minute_volume)
+            else:
+                self._base = (
+                    self._base[0],
+                    max(self._base[1], minute_high),
+                    min(self._base[2], minute_low),
+                    self._base[3] + minute_volume,
+                )
+        self._minute = (time, open, high, low, close, volume)
+        self._write(is_complete=False)
+
+    def seal(self, time: int) -> None:
+        """
+        Помечает текущую свечу сформированной, если время time вышло за ее интервал.
+        """
+        if self._bar_time is not None and time >= self._bar_time + self.timeframe:
+            self._write(is_complete=True)
+
+    def consume(self, candles: CandleArray) -> None:
+        """
+        Учитывает новые 1-минутные свечи массива, начиная с последней учтенной минуты.
+        """
+        start = 0
+        if self.last_minute is not None:
+            start = int(np.searchsorted(candles.times, self.last_minute))
+        for row in candles.data[start:].tolist():
+            self.update(*row[:6])
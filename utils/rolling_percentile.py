@@ -0,0 +1,69 @@
+import math
+from collections import deque
+from typing import Optional
+
+from sortedcontainers import SortedList
+
+
+class RollingPercentile:
+    """
+    Скользящее временное окно значений с вставкой и удалением за O(log n).
+    Процентили считаются так же, как np.percentile с линейной интерполяцией,
+    вплоть до порядка операций с плавающей точкой, поэтому результаты совпадают
+    бит в бит.
+    """
+
+    def __init__(self):
+        self._items: deque[tuple[int, float]] = deque()
+        self._sorted = SortedList()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def last_time(self) -> Optional[int]:
+        return self._items[-1][0] if self._items else None
+
+    def update(self, time: int, value: float) -> None:
+        """
+        Добавляет значение в конец окна. Значение с тем же временем, что и последнее,
+        заменяет его (формирующаяся свеча).
+        """
+        if self._items:
+            last_time, last_value = self._items[-1]
+            if time == last_time:
+                self._sorted.remove(last_value)
+                self._items.pop()
+            elif time < last_time:
+                raise ValueError(f"Out of order value: {time} < {last_time}")
+        self._items.append((time, value))
+        self._sorted.add(value)
+
+    def expire(self, from_time: int) -> None:
+        """
+        Удаляет из окна значения со временем меньше from_time.
+        """
+        while self._items and self._items[0][0] < from_time:
+            self._sorted.remove(self._items.popleft()[1])
+
+    def percentile(self, q: float) -> float:
+        """
+        Возвращает q-й процентиль (0 <= q <= 100) значений окна.
+        """
+        count = len(self._sorted)
+        if count == 0:
+            raise ValueError("Percentile of empty window")
+        # повторяет numpy.lib.function_base._quantile для method="linear"
+        virtual_index = (count - 1) * (q / 100)
+        if virtual_index >= count - 1:
+            return self._sorted[-1]
+        if virtual_index < 0:
+            return self._sorted[0]
+        previous_index = math.floor(virtual_index)
+        gamma = virtual_index - previous_index
+        previous = self._sorted[previous_index]
+        following = self._sorted[previous_index + 1]
+        diff = following - previous
+        if gamma >= 0.5:
+            return following - diff * (1 - gamma)
+        return previous + diff * gamma
@@ -1,9 +1,8 @@
-import os
-from pandas import DataFrame
-from tinkoff.invest import Client
-from tinkoff.invest.services import InstrumentsService
+import asyncio
+import sys
 
-token = os.environ["INVEST_TOKEN"]
+from client import broker_client
+from db.instruments import instrument_registry
 
 TICKER = "SBER"  # BBG004730N88
 
@@ -13,28 +12,17 @@ TICKER = "SBER"  # BBG004730N88
 # TICKER = "RIM3" # FUTRTS062300
 
 
-def run():
-    with Client(token) as client:
-        instruments: InstrumentsService = client.instruments
-
-        lst = []
-        for method in ['shares', 'bonds', 'etfs', 'currencies', 'futures']:
-            for item in getattr(instruments, method)().instruments:
-                lst.append({
-                    'ticker': item.ticker,
-                    'figi': item.figi,
-                    'type': method,
-                    'name': item.name,
-                })
-
-        df = DataFrame(lst)
-        df = df[df['ticker'] == TICKER]
-        if df.empty:
-            print(f"Нет тикера {TICKER}")
-            return
-        print(df.iloc[0])
-        # print(df.to_json())
+async def run(ticker: str):
+    await broker_client.create()
+    # справочник загружается с сервера не чаще раза в сутки
+    await instrument_registry.refresh()
+    instruments = instrument_registry.by_ticker.get(ticker)
+    if not instruments:
+        print(f"Нет тикера {ticker}")
+        return
+    for instrument in instruments:
+        print(instrument)
 
 
 if __name__ == '__main__':
-    run()
+    asyncio.run(run(sys.argv[1] if len(sys.argv) > 1 else TICKER))
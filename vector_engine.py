@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import time
+from uuid import uuid4
+
+import numpy as np
+from tinkoff.invest import AioRequestError
+from tinkoff.invest.grpc.orders_pb2 import (
+    ORDER_DIRECTION_SELL,
+    ORDER_DIRECTION_BUY,
+    ORDER_TYPE_MARKET,
+)
+from tinkoff.invest.utils import now
+
+from client import broker_client, portfolio_service, price_board
+from db.instruments import instrument_registry
+from order_tracker import get_order_tracker
+from settings import (
+    ACCOUNT_ID,
+    CHECK_INTERVAL,
+    QUATITY_LIMIT,
+    STOP_LOSS_RATIO,
+    TRADING_STATUS_INTERVAL,
+)
+from strategies import get_strategy
+from telegram.telegram_service import telegram_bot
+from trading_calendar import trading_calendar
+from utils.journal import journal
+from utils.metrics import metrics
+from utils.prices import NANO, nano_to_float, quotations_to_nano
+from utils.rate_limiter import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class VectorEngine:
+    """
+    Единый торговый цикл для всех инструментов. Границы диапазона, последние цены,
+    позиции и уровни стоп-лосса хранятся в массивах NumPy, индексированных по
+    инструменту, а условия покупки, продажи и стоп-лосса проверяются для всех
+    инструментов за один векторный проход. Портфель, ордера и цены запрашиваются
+    одним вызовом на тик, а не отдельно для каждого инструмента.
+    """
+
+    def __init__(
+        self,
+        figis: list[str],
+        account_id: str = ACCOUNT_ID,
+        quantity_limit: int = QUATITY_LIMIT,
+    ):
+        self.figis = list(figis)
+        self.index = {figi: index for index, figi in enumerate(self.figis)}
+        self.account_id = account_id
+        self.strategies = [get_strategy(figi) for figi in self.figis]
+        self.check_interval: int = CHECK_INTERVAL
+        self.quantity_limit: int = quantity_limit
+        self.order_tracker = get_order_tracker(self.account_id)
+
+        count = len(self.figis)
+        self.lower = np.full(count, np.nan)
+        self.upper = np.full(count, np.nan)
+        self.last_price = np.full(count, np.nan)
+        self.lots = np.zeros(count, dtype=np.int64)
+        self.average_price = np.full(count, np.nan)
+        self.tradable = np.zeros(count, dtype=bool)
+        self.in_session = np.zeros(count, dtype=bool)
+        self.status_ok = np.zeros(count, dtype=bool)
+        # статус нужно перепроверить: новая сессия или ошибка отправки ордера
+        self.status_stale = np.ones(count, dtype=bool)
+        self._sessions: list = [None] * count
+        self.active_orders = np.zeros(count, dtype=bool)
+        self._status_updated = 0.0
+        for figi in self.figis:
+            price_board.register(figi)
+            journal.robot(
+                account_id, figi, quantity_limit, instrument_registry.get(figi)
+            )
+
+    async def refresh_trading_status(self) -> None:
+        """
+        Обновляет признак доступности торговли. Вне торговой сессии по расписанию
+        инструмент недоступен без запросов, а торговый статус запрашивается
+        только при смене сессии или после ошибки отправки ордера. Инструменты
+        с неизвестным расписанием проверяются раз в TRADING_STATUS_INTERVAL секунд.
+        """
+        try:
+            await trading_calendar.load()
+        except AioRequestError as err:
+            logger.error(f"Failed to load trading schedules. {err}")
+        current = now()
+        sessions = [trading_calendar.session(figi, current) for figi in self.figis]
+        poll = time.monotonic() - self._status_updated >= TRADING_STATUS_INTERVAL
+        self.in_session[:] = [
+            session is None or session.start <= current for session in sessions
+        ]
+        check = [
+            index
+            for index, session in enumerate(sessions)
+            if self.in_session[index]
+            and (
+                self.status_stale[index]
+                or session != self._sessions[index]
+                or (session is None and poll)
+            )
+        ]
+        self._sessions = sessions
+        if check:
+            statuses = await asyncio.gather(
+                *[
+                    broker_client.get_trading_status(figi=self.figis[index])
+                    for index in check
+                ],
+                return_exceptions=True,
+            )
+            self.status_ok[check] = [
+                not isinstance(status, Exception)
+                and status.market_order_available_flag
+                and status.api_trade_available_flag
+                for status in statuses
+            ]
+            self.status_stale[check] = False
+            if poll:
+                self._status_updated = time.monotonic()
+        self.tradable[:] = self.in_session & self.status_ok
+
+    async def refresh_borders(self) -> None:
+        results = await asyncio.gather(
+            *[strategy.calculate_borders() for strategy in self.strategies],
+            return_exceptions=True,
+        )
+        for index, borders in enumerate(results):
+            if isinstance(borders, Exception):
+                logger.error(f"Failed to calculate borders {self.figis[index]}. {borders}")
+            elif borders is not None:
+                self.lower[index], self.upper[index] = borders
+
+    async def refresh_account(self) -> None:
+        """
+        Обновляет цены, позиции и активные ордера одним запросом каждого вида.
+        """
+        quotes, positions, orders = await asyncio.gather(
+            price_board.get_quotes(),
+            portfolio_service.get_positions(self.account_id),
+            broker_client.get_orders(account_id=self.account_id),
+        )
+        self.last_price[:] = [
+            quotes[figi].price if figi in quotes else np.nan for figi in self.figis
+        ]
+        self.lots[:] = 0
+        self.average_price[:] = np.nan
+        positions = [
+            (self.index[figi], position)
+            for figi, position in positions.items()
+            if figi in self.index
+        ]
+        if positions:
+            indexes = [index for index, _ in positions]
+            # количество лотов целое, дробная часть Quotation отбрасывается
+            self.lots[indexes] = quotations_to_nano(
+                position.quantity_lots for _, position in positions
+            ) // NANO
+            self.average_price[indexes] = nano_to_float(
+                quotations_to_nano(
+                    position.average_position_price for _, position in positions
+                )
+            )
+        self.active_orders[:] = False
+        for order in orders.orders:
+            index = self.index.get(order.figi)
+            if index is not None:
+                self.active_orders[index] = True
+
+    def decide(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Возвращает индексы инструментов для стоп-лосса, продажи и покупки
+        по тем же правилам, что и TradingRobot.
+        """
+        with np.errstate(invalid="ignore"):
+            ready = (
+                self.tradable
+                & ~self.active_orders
+                & ~np.isnan(self.last_price)
+                & ~np.isnan(self.lower)
+            )
+            has_position = ready & (self.lots > 0)
+            stop_price = self.average_price - (self.upper - self.lower) * STOP_LOSS_RATIO
+            stop_loss = has_position & (stop_price > self.last_price)
+            above = self.last_price >= self.upper
+            sell = has_position & above & ~stop_loss
+            buy = (
+                ready
+                & ~stop_loss
+                & ~above
+                & (self.last_price <= self.lower)
+                & (self.lots < self.quantity_limit)
+            )
+        return np.flatnonzero(stop_loss), np.flatnonzero(sell), np.flatnonzero(buy)
+
+    async def post_order(
+        self, index: int, direction: int, quantity: int, priority: Priority, reason: str
+    ) -> None:
+        figi = self.figis[index]
+        last_price = self.last_price[index]
+        try:
+            posted_order = await broker_client.post_order(
+                priority=priority,
+                order_id=str(uuid4().time_low),
+                figi=figi,
+                direction=direction,
+                quantity=quantity,
+                order_type=ORDER_TYPE_MARKET,
+                account_id=self.account_id,
+            )
+        except Exception as exc:
+            metrics.inc("errors_total", source="engine_order")
+            logger.error(f"Failed to post {reason} order. figi={figi}. {exc}")
+            self.status_stale[index] = True
+            return
+        metrics.inc("orders_total", reason=reason)
+        self.active_orders[index] = True
+        portfolio_service.invalidate(self.account_id)
+        logger.debug(f"{reason}: {quantity} lots of {figi}. Last price={last_price}")
+        telegram_bot.post(
+            f"{reason}: {quantity} lots of {figi}. Last price = {last_price}"
+        )
+        self.order_tracker.track_later(posted_order.order_id)
+
+    async def tick(self) -> None:
+        with metrics.timer("engine_stage_seconds", stage="trading_status"):
+            await self.refresh_trading_status()
+        if not self.in_session.any():
+            # вне торговых сессий остальные запросы не нужны
+            return
+        with metrics.timer("engine_stage_seconds", stage="borders"):
+            await self.refresh_borders()
+        with metrics.timer("engine_stage_seconds", stage="account"):
+            await self.refresh_account()
+        with metrics.timer("engine_stage_seconds", stage="decide"):
+            stop_loss, sell, buy = self.decide()
+        orders = [
+            self.post_order(
+                index,
+                ORDER_DIRECTION_SELL,
+                int(self.lots[index]),
+                Priority.STOP_LOSS,
+                "Stop loss",
+            )
+            for index in stop_loss
+        ]
+        orders += [
+            self.post_order(
+                index,
+                ORDER_DIRECTION_SELL,
+                int(self.lots[index]),
+                Priority.ORDER,
+                "Sell",
+            )
+            for index in sell
+        ]
+        orders += [
+            self.post_order(
+                index,
+                ORDER_DIRECTION_BUY,
+                self.quantity_limit - int(self.lots[index]),
+                Priority.ORDER,
+                "Buy",
+            )
+            for index in buy
+        ]
+        if orders:
+            with metrics.timer("engine_stage_seconds", stage="orders"):
+                await asyncio.gather(*orders)
+
+    async def start(self):
+        while True:
+            try:
+                with metrics.timer("engine_tick_seconds"):
+                    await self.tick()
+            except AioRequestError as err:
+                metrics.inc("errors_total", source="tick")
+                logger.error(f"Client error {err}")
+
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from tinkoff.invest import AioRequestError
+
+from client import portfolio_service
+from robot import TradingRobot
+from settings import (
+    BORDERS_SNAPSHOT_FILE,
+    BORDERS_SNAPSHOT_INTERVAL,
+    BORDERS_SNAPSHOT_MAX_AGE,
+    WARMUP_CONCURRENCY,
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RobotStarter = Callable[[TradingRobot, Optional[list]], Awaitable[None]]
+
+
+class WarmUp:
+    """
+    Запуск роботов без всплеска запросов. Загрузка исторических свечей при старте
+    выполняется не более чем для concurrency роботов одновременно, первыми -
+    для инструментов с открытыми позициями. Каждый робот начинает торговать,
+    как только готовы его собственные данные.
+    Роботы, для которых в снимке есть свежие границы, начинают торговать сразу,
+    а свечи докачиваются из локального хранилища в следующем цикле.
+    """
+
+    def __init__(
+        self,
+        robots: list[TradingRobot],
+        concurrency: int = WARMUP_CONCURRENCY,
+        snapshot_file: Optional[str] = BORDERS_SNAPSHOT_FILE,
+        portfolio=portfolio_service,
+    ):
+        self.robots = robots
+        # в рабочих процессах позиции читаются из общей доски, а не запросом к брокеру
+        self.portfolio_service = portfolio
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.snapshot_file = snapshot_file
+        self.snapshot = self.load_snapshot()
+        self.started = time.monotonic()
+
+    def load_snapshot(self) -> dict[str, dict]:
+        if self.snapshot_file is None or not os.path.exists(self.snapshot_file):
+            return {}
+        try:
+            with open(self.snapshot_file, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError) as exc:
+            logger.error(f"Failed to load borders snapshot. {exc}")
+            return {}
+
+    def save_snapshot(self) -> None:
+        """
+        Сохраняет текущие границы роботов. Файл заменяется атомарно.
+        """
+        saved = time.time()
+        for robot in self.robots:
+            if robot.borders is not None:
+                self.snapshot[robot.figi] = {"time": saved, "borders": robot.borders}
+        temporary_file = self.snapshot_file + ".tmp"
+        with open(temporary_file, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot, file)
+        os.replace(temporary_file, self.snapshot_file)
+
+    async def keep_snapshot(self) -> None:
+        while True:
+            await asyncio.sleep(BORDERS_SNAPSHOT_INTERVAL)
+            try:
+                self.save_snapshot()
+            except OSError as exc:
+                logger.error(f"Failed to save borders snapshot. {exc}")
+
+    def snapshot_borders(self, figi: str) -> Optional[list]:
+        entry = self.snapshot.get(figi)
+        if entry is None or time.time() - entry["time"] > BORDERS_SNAPSHOT_MAX_AGE:
+            return None
+        return entry["borders"]
+
+    async def prioritized(self) -> list[TradingRobot]:
+        """
+        Возвращает роботов в порядке прогрева: сначала инструменты с открытыми
+        позициями, которым может понадобиться стоп-лосс.
+        """
+        try:
+            positions = {
+                account_id: await self.portfolio_service.get_positions(account_id)
+                for account_id in {robot.account_id for robot in self.robots}
+            }
+        except AioRequestError as err:
+            logger.error(f"Failed to get positions for warm-up. {err}")
+            return self.robots
+        return sorted(
+            self.robots, key=lambda robot: robot.figi not in positions[robot.account_id]
+        )
+
+    async def warm(self, robot: TradingRobot) -> Optional[list]:
+        """
+        Возвращает границы робота из снимка или рассчитывает их, загружая свечи.
+        """
+        borders = self.snapshot_borders(robot.figi)
+        if borders is not None:
+            metrics.inc("warmup_total", source="snapshot")
+            return borders
+        async with self.semaphore:
+            with metrics.timer("warmup_seconds"):
+                try:
+                    borders = await robot.strategy.calculate_borders()
+                except AioRequestError as err:
+                    # робот загрузит свечи в своем первом цикле
+                    metrics.inc("errors_total", source="warmup")
+                    logger.error(f"Warm-up failed. figi={robot.figi}. {err}")
+                    return None
+        metrics.inc("warmup_total", source="candles")
+        return borders
+
+    async def start_robot(self, robot: TradingRobot, start: RobotStarter) -> None:
+        borders = await self.warm(robot)
+        metrics.observe("warmup_ready_seconds", time.monotonic() - self.started)
+        logger.debug(f"{robot.figi} ready in {time.monotonic() - self.started:.1f}s")
+        await start(robot, borders)
+
+    async def run(self, start: RobotStarter) -> None:
+        """
+        Прогревает роботов в порядке приоритета и запускает каждого
+        вызовом start(robot, borders).
+        """
+        self.started = time.monotonic()
+        robots = await self.prioritized()
+        tasks = [self.start_robot(robot, start) for robot in robots]
+        if self.snapshot_file is not None:
+            tasks.append(self.keep_snapshot())
+        await asyncio.gather(*tasks)